@@ -0,0 +1,308 @@
+"""
+Clean repositories with their ECR listing, github branch lookup and batched
+deletes running as concurrent asyncio tasks.
+
+    DELETE_IMAGES=0 python async_engine.py org/a org/b [--ecr-concurrency 8]
+
+PruneBuilds does its I/O one request at a time: a repository's listing
+waits for github, and every batch_delete_image for the one before it. The
+engine runs the listing and branch lookup of every repository side by side
+and sends a plan's batches concurrently, within a global limit of requests
+in flight per service. boto3 and PyGithub block, so each request runs on a
+thread of the engine's pool while the event loop only schedules them; every
+ECR request still goes through the PruneBuilds rate limiter. Planning uses
+the PruneBuilds and retention functions, so the plans are the ones
+clean_images makes. Inventory snapshots and streaming aren't used.
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pruneBuilds
+import retention
+from journal import DeletionJournal, writePlanFile
+from pruneBuilds import (BATCH_DELETE_BACKOFF, BATCH_DELETE_RETRIES,
+                         BATCH_DELETE_SIZE, LIST_IMAGES_PAGE_SIZE,
+                         PERMANENT_FAILURE_CODES, logChunks, parseInventory,
+                         planDeletion)
+from rate_limiter import AdaptiveRateLimiter, parseRates
+from records import ImageId
+from run_metrics import RunMetrics
+
+logger = logging.getLogger()
+
+# ECR and github requests in flight at a time, over all repositories
+DEFAULT_ECR_CONCURRENCY = 8
+DEFAULT_GITHUB_CONCURRENCY = 4
+
+
+class AsyncEngine(object):
+    """
+    Runs the I/O of a PruneBuilds' clean_images as asyncio tasks, at most
+    ecrConcurrency ECR and githubConcurrency github requests at a time
+    """
+
+    def __init__(self, pb, ecrConcurrency=DEFAULT_ECR_CONCURRENCY,
+                 githubConcurrency=DEFAULT_GITHUB_CONCURRENCY):
+        self.pb = pb
+        self.ecrConcurrency = max(1, int(ecrConcurrency))
+        self.githubConcurrency = max(1, int(githubConcurrency))
+
+    def run(self, repositories, DELETE):
+        """
+        clean repositories on a new event loop, returning their results in
+        order like clean_images does. the plans of the run are written to
+        the PruneBuilds planFile when it has one
+        """
+        pb = self.pb
+        pb.metrics = RunMetrics()
+        pb.plans = {}
+        if int(DELETE) == 1:
+            pb.resumeInterrupted()
+        pb.prefetchBranches(repositories, refresh=True)
+        loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.ecrConcurrency + self.githubConcurrency)
+        try:
+            results = loop.run_until_complete(
+                self.cleanRepositories(repositories, DELETE))
+        finally:
+            self.executor.shutdown(wait=True)
+            loop.close()
+        logger.info({"EcrCalls": pb.rateLimiter.stats()})
+        if pb.graphqlBranches is not None:
+            logger.info(pb.graphqlBranches.stats())
+        if pb.planFile:
+            writePlanFile(pb.planFile, dict(pb.plans))
+            logger.info("Wrote the plans of {0} repositories to {1}".format(
+                len(pb.plans), pb.planFile))
+        logger.info(pb.metrics.runSummary())
+        return results
+
+    async def cleanRepositories(self, repositories, DELETE):
+        # the semaphores belong to the loop running this coroutine
+        self.ecrSlots = asyncio.Semaphore(self.ecrConcurrency)
+        self.githubSlots = asyncio.Semaphore(self.githubConcurrency)
+        return await asyncio.gather(*[
+            self.safeCleanRepository(REPOSITORY, DELETE)
+            for REPOSITORY in repositories
+        ])
+
+    async def blocking(self, slots, fn, *args, **kwargs):
+        """
+        call fn on the engine's pool once one of slots is free
+        """
+        async with slots:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs))
+
+    def ecr(self, fn, *args, **kwargs):
+        return self.blocking(self.ecrSlots, fn, *args, **kwargs)
+
+    def github(self, fn, *args, **kwargs):
+        return self.blocking(self.githubSlots, fn, *args, **kwargs)
+
+    async def getGitRepoBranches(self, REPOSITORY):
+        with self.pb.metrics.phase(REPOSITORY, 'github'):
+            return await self.github(self.pb.getGitRepoBranches, REPOSITORY)
+
+    async def listImages(self, REPOSITORY):
+        """
+        the ImageId records of every list_images page of REPOSITORY, the
+        pages following each other's nextToken
+        """
+        pb = self.pb
+        kwargs = {
+            'repositoryName': REPOSITORY,
+            'maxResults': LIST_IMAGES_PAGE_SIZE
+        }
+        images = []
+        with pb.metrics.phase(REPOSITORY, 'listing'):
+            while True:
+                page = await self.ecr(pb.ecrCall, 'list_images', **kwargs)
+                pb.metrics.add(REPOSITORY, 'pages', 1)
+                pb.metrics.add(
+                    REPOSITORY, 'bytes',
+                    int(
+                        page.get('ResponseMetadata', {}).get(
+                            'HTTPHeaders', {}).get('content-length', 0)))
+                images += [ImageId.fromApi(i) for i in page['imageIds']]
+                if not page.get('nextToken'):
+                    return images
+                kwargs['nextToken'] = page['nextToken']
+
+    async def deleteBatch(self, REPOSITORY, batch, imageIds):
+        """
+        send one batch of a plan, resubmitting its retryable failures like
+        batchDeleteImages does. returns the outcome of every attempt
+        """
+        outcomes = []
+        for attempt in range(BATCH_DELETE_RETRIES + 1):
+            if attempt > 0:
+                await asyncio.sleep(BATCH_DELETE_BACKOFF * 2**(attempt - 1))
+            response = await self.ecr(self.pb.deleteImageBatch, REPOSITORY,
+                                      imageIds)
+            outcomes.append({
+                "repository": REPOSITORY,
+                "batch": batch,
+                "attempt": attempt,
+                "requested": len(imageIds),
+                "deleted": response['imageIds'],
+                "failures": response['failures']
+            })
+            imageIds = [
+                f['imageId'] for f in response['failures']
+                if f.get('failureCode') not in PERMANENT_FAILURE_CODES
+            ]
+            if not imageIds:
+                break
+        if self.pb.journal is not None:
+            self.pb.journal.complete(REPOSITORY, batch)
+        return outcomes
+
+    async def executePlan(self, REPOSITORY, imageIds):
+        """
+        send every batch of a plan at once, journaled like executePlan
+        """
+        journal = self.pb.journal
+        if journal is None:
+            batches = list(
+                enumerate(imageIds[start:start + BATCH_DELETE_SIZE]
+                          for start in range(0, len(imageIds),
+                                             BATCH_DELETE_SIZE)))
+        else:
+            batches = journal.record(REPOSITORY, imageIds)
+        outcomes = await asyncio.gather(*[
+            self.deleteBatch(REPOSITORY, batch, ids) for batch, ids in batches
+        ])
+        if journal is not None:
+            journal.finish(REPOSITORY)
+        return [o for batchOutcomes in outcomes for o in batchOutcomes]
+
+    async def safeCleanRepository(self, REPOSITORY, DELETE):
+        try:
+            return await self.cleanRepository(REPOSITORY, DELETE)
+        except Exception as e:
+            logging.LoggerAdapter(logger, {
+                'repository': REPOSITORY
+            }).exception("Failed to clean {0}".format(REPOSITORY))
+            return {"repository": REPOSITORY, "error": str(e)}
+
+    async def cleanRepository(self, REPOSITORY, DELETE):
+        """
+        list REPOSITORY while its github branches are fetched, plan it like
+        cleanRepository and (if DELETE is 1) send the plan's batches
+        """
+        pb = self.pb
+        metrics = pb.metrics
+        log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+        result = {"repository": REPOSITORY, "deleted": 0, "failures": 0}
+
+        images, gitBranches = await asyncio.gather(
+            self.listImages(REPOSITORY), self.getGitRepoBranches(REPOSITORY))
+        result['images'] = len(images)
+        metrics.add(REPOSITORY, 'images', len(images))
+        log.info("There are {0} images in {1}".format(len(images), REPOSITORY))
+
+        with metrics.phase(REPOSITORY, 'planning'):
+            parsed = parseInventory(images)
+            orphanDigests = pb.getOrphans(images)['ImageDigests']
+        groups = None
+        if pb.lifecyclePolicy:
+            groups = await self.ecr(pb.withoutServerSideGroups, REPOSITORY,
+                                    parsed, None, log)
+        action = 'delete' if int(DELETE) == 1 else 'would delete'
+        with metrics.phase(REPOSITORY, 'planning'):
+            toDeleteTags = []
+            if gitBranches is None:
+                log.warning(
+                    "Could not list github branches of {0}, skipping deleteClosedGitBranches".
+                    format(REPOSITORY))
+            else:
+                toDeleteTags = pb.deleteClosedGitBranches(
+                    REPOSITORY, images, gitBranches, parsed)['ImageTags']
+                logChunks(log, action, 'deleteClosedGitBranches',
+                          toDeleteTags, pb.logChunkSize)
+            oldBuilds = pb.deleteOldBuilds(images, parsed,
+                                           groups)['ImageTags']
+            logChunks(log, action, 'deleteOldBuilds', oldBuilds,
+                      pb.logChunkSize)
+            logChunks(log, action, 'getOrphans', orphanDigests,
+                      pb.logChunkSize)
+            toDeleteTags = list(set(toDeleteTags + oldBuilds))
+            plan = planDeletion(parsed, toDeleteTags, orphanDigests)
+        result['condemned'] = len(toDeleteTags)
+        result['orphans'] = len(orphanDigests)
+        metrics.add(REPOSITORY, 'planned',
+                    len(toDeleteTags) + len(orphanDigests))
+        pb.plans[REPOSITORY] = {
+            'condemned': sorted(toDeleteTags),
+            'orphans': orphanDigests,
+            'imageIds': plan
+        }
+
+        if int(DELETE) == 1:
+            with metrics.phase(REPOSITORY, 'deletes'):
+                outcomes = await self.executePlan(REPOSITORY, plan)
+            pb.recordOutcomes(result, outcomes, log)
+        metrics.add(REPOSITORY, 'deleted', result['deleted'])
+        log.info(result)
+        log.info(metrics.repositorySummary(REPOSITORY))
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('repositories', nargs='+')
+    parser.add_argument(
+        '--ecr-concurrency',
+        type=int,
+        default=DEFAULT_ECR_CONCURRENCY,
+        help='ECR requests in flight at a time')
+    parser.add_argument(
+        '--github-concurrency',
+        type=int,
+        default=DEFAULT_GITHUB_CONCURRENCY,
+        help='github requests in flight at a time')
+    args = parser.parse_args(argv)
+    pruneBuilds.configureLogging(
+        queued=os.environ.get('LOG_QUEUE', '0') == '1')
+
+    if os.environ.get('DELETE_IMAGES') not in ('0', '1'):
+        logger.critical("DELETE_IMAGES must be 0 or 1")
+        return 1
+    try:
+        keep = retention.parseRetention(os.environ.get('RETENTION', ''))
+        rates = parseRates(os.environ.get('ECR_RATE_LIMITS', ''))
+    except ValueError as e:
+        logger.critical(e)
+        return 1
+    journal = None
+    if os.environ.get('JOURNAL_PATH'):
+        journal = DeletionJournal(os.environ['JOURNAL_PATH'])
+    graphqlBranches = None
+    if os.environ.get('GITHUB_GRAPHQL', '0') == '1':
+        from github_graphql import GraphqlBranches
+        graphqlBranches = GraphqlBranches(
+            os.environ.get('REGISTRY_OPS_ACCESS_TOKEN'))
+    pb = pruneBuilds.PruneBuilds(
+        workers=args.ecr_concurrency,
+        keep=keep,
+        rateLimiter=AdaptiveRateLimiter(rates),
+        journal=journal,
+        planFile=os.environ.get('PLAN_FILE'),
+        lifecyclePolicy=os.environ.get('LIFECYCLE_POLICY', '0') == '1',
+        graphqlBranches=graphqlBranches)
+    results = AsyncEngine(pb, args.ecr_concurrency,
+                          args.github_concurrency).run(
+                              args.repositories,
+                              int(os.environ['DELETE_IMAGES']))
+    return 1 if any('error' in r or r['failures'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+Benchmarks for the pruning pipeline on synthetic inventories, run against
+the local ECR/github stand-ins of synthetic_registry.
+
+    python bench_registry_ops.py --images 1000,10000,100000 \
+        --output bench_results.json --compare previous_results.json
+
+Every benchmark reports the best and mean wall time over --repeat runs.
+Results are written as JSON together with the commit they were measured on,
+so two commits can be compared with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import columnar
+from async_engine import AsyncEngine
+import retention
+from pruneBuilds import configureLogging, parseInventory
+from records import ImageId, ParsedTag
+from synthetic_registry import generateInventory, localPruneBuilds
+
+REPOSITORY = 'org/synthetic'
+# seconds every ECR and github request takes in the latency benchmarks
+LATENCY = 0.002
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(fn, repeat, setup=None):
+    """
+    best and mean wall time of fn(setup()) over repeat runs, setup not
+    being timed
+    """
+    times = []
+    for i in range(0, repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(argument)
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'mean': sum(times) / len(times)}
+
+
+def benchPruneBuilds(inventory, openBranches, **kwargs):
+    return localPruneBuilds({REPOSITORY: inventory},
+                            {REPOSITORY: openBranches}, **kwargs)
+
+
+def defaultBranches(images):
+    return min(10000, max(10, images // 100))
+
+
+def benchPlanners(images, branches, repeat):
+    inventory, openBranches = generateInventory(images, branches)
+    pb = benchPruneBuilds(inventory, openBranches)
+    parsed = parseInventory(inventory)
+    benchmarks = {
+        'parseInventory':
+        lambda _: parseInventory(inventory),
+        'deleteOldBuilds':
+        lambda _: pb.deleteOldBuilds(inventory, parsed),
+        'deleteClosedGitBranches':
+        lambda _: pb.deleteClosedGitBranches(REPOSITORY, inventory,
+                                             openBranches, parsed),
+        'getOrphans':
+        lambda _: pb.getOrphans(inventory)
+    }
+    results = []
+    for name, fn in benchmarks.items():
+        result = {
+            'benchmark': name,
+            'images': len(inventory),
+            'branches': branches
+        }
+        result.update(measure(fn, repeat))
+        results.append(result)
+    return results
+
+
+def benchFleet(images, repeat, repositories=100):
+    """
+    the retention of a fleet of `repositories` repositories holding `images`
+    images between them, per repository and in one columnar pass
+    """
+    inventories = {}
+    for n in range(0, repositories):
+        inventory, openBranches = generateInventory(
+            images // repositories, defaultBranches(images // repositories),
+            seed=n)
+        inventories['{0}-{1}'.format(REPOSITORY, n)] = parseInventory(
+            inventory)
+    size = sum(len(parsed) for parsed in inventories.values())
+    benchmarks = {
+        'selectOldBuilds-fleet':
+        lambda _: [retention.selectOldBuilds(parsed)
+                   for parsed in inventories.values()],
+        'fleetOldBuilds':
+        lambda _: columnar.fleetOldBuilds(inventories)
+    }
+    results = []
+    for name, fn in benchmarks.items():
+        result = {
+            'benchmark': name,
+            'images': size,
+            'repositories': repositories
+        }
+        result.update(measure(fn, repeat))
+        results.append(result)
+    return results
+
+
+def legacyParsed(parsed):
+    """
+    a parsed tag as the dict parseTag returned before the records, with its
+    own branch and gitKey strings like the regexp groups it came from
+    """
+    fields = {'tag': parsed.tag, 'digest': parsed.digest, 'kind': parsed.kind,
+              'gitKey': parsed.gitKey}
+    for name in ParsedTag.__slots__:
+        if getattr(parsed, name) is not None:
+            fields[name] = getattr(parsed, name)
+    for name in ('branch', 'gitKey'):
+        if fields.get(name) is not None:
+            fields[name] = ''.join(list(fields[name]))
+    return fields
+
+
+def tracedSize(build):
+    """
+    bytes still allocated once build() returned, the result being alive
+    """
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def benchMemory(images, branches):
+    """
+    memory held by a listing and its parsed tags, as boto's dicts and parsed
+    dicts and as ImageId/ParsedTag records
+    """
+    inventory, openBranches = generateInventory(images, branches)
+    parsed = parseInventory(inventory)
+    representations = {
+        'memory-dicts':
+        lambda: ([dict(i) for i in inventory],
+                 [legacyParsed(i) for i in parsed]),
+        'memory-records':
+        lambda: ([ImageId.fromApi(i) for i in inventory],
+                 parseInventory(inventory))
+    }
+    results = []
+    for name, build in representations.items():
+        results.append({
+            'benchmark': name,
+            'images': len(inventory),
+            'branches': branches,
+            'bytes': tracedSize(build)
+        })
+    return results
+
+
+def benchEndToEnd(images, branches, repeat, streaming=False):
+    """
+    clean_images with DELETE_IMAGES=1 against a fresh stand-in every run
+    """
+    inventory, openBranches = generateInventory(images, branches)
+
+    def setup():
+        return benchPruneBuilds(inventory, openBranches, streaming=streaming)
+
+    environ = dict(os.environ)
+    os.environ.update({'DELETE_IMAGES': '1', 'REGISTRIES': REPOSITORY})
+    try:
+        result = {
+            'benchmark': 'clean_images' + ('-streaming' if streaming else ''),
+            'images': len(inventory),
+            'branches': branches
+        }
+        result.update(measure(lambda pb: pb.clean_images(), repeat, setup))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    return [result]
+
+
+def benchLatency(images, repeat, repositories=10, latency=LATENCY):
+    """
+    clean_images with DELETE_IMAGES=1 over `repositories` repositories
+    holding `images` images between them, one request at a time and on the
+    asyncio engine, with `latency` seconds injected in every request. the
+    engine's result carries its speedup over the sequential run
+    """
+    inventories = {}
+    branches = {}
+    for n in range(0, repositories):
+        name = '{0}-{1}'.format(REPOSITORY, n)
+        inventories[name], branches[name] = generateInventory(
+            images // repositories, defaultBranches(images // repositories),
+            seed=n)
+    names = sorted(inventories)
+
+    def setup():
+        return localPruneBuilds(inventories, branches, latency=latency)
+
+    benchmarks = {
+        'clean_images-latency': lambda pb: pb.clean_images(),
+        'async_engine-latency': lambda pb: AsyncEngine(pb).run(names, 1)
+    }
+    environ = dict(os.environ)
+    os.environ.update({'DELETE_IMAGES': '1', 'REGISTRIES': ','.join(names)})
+    results = []
+    try:
+        for name, fn in benchmarks.items():
+            result = {
+                'benchmark': name,
+                'images': sum(len(i) for i in inventories.values()),
+                'repositories': repositories,
+                'latency': latency
+            }
+            result.update(measure(fn, repeat, setup))
+            results.append(result)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    sequential, engine = results
+    if engine['best'] > 0:
+        engine['speedup'] = sequential['best'] / engine['best']
+    return results
+
+
+def runBenchmarks(sizes, branches=None, repeat=3):
+    results = []
+    for images in sizes:
+        branchCount = branches or defaultBranches(images)
+        results += benchPlanners(images, branchCount, repeat)
+        results += benchEndToEnd(images, branchCount, repeat)
+        results += benchEndToEnd(images, branchCount, repeat, streaming=True)
+        results += benchLatency(images, repeat)
+        results += benchFleet(images, repeat)
+        results += benchMemory(images, branchCount)
+    return {
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results
+    }
+
+
+def measured(result):
+    return result['bytes'] if 'bytes' in result else result['best']
+
+
+def compare(current, baseline):
+    """
+    ratio of the best time (or the memory) of every benchmark to the same
+    benchmark in a previous result file, > 1 meaning slower or bigger
+    """
+    previous = dict(((r['benchmark'], r['images']), measured(r))
+                    for r in baseline['results'])
+    rows = []
+    for r in current['results']:
+        key = (r['benchmark'], r['images'])
+        if key in previous and previous[key] > 0:
+            rows.append({
+                'benchmark': r['benchmark'],
+                'images': r['images'],
+                'ratio': measured(r) / previous[key]
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--images',
+        default='1000,10000,100000',
+        help='comma separated inventory sizes (up to 1000000)')
+    parser.add_argument(
+        '--branches',
+        type=int,
+        help='feature branches per inventory (default images/100, max 10000)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='previous result file')
+    parser.add_argument(
+        '--log', action='store_true', help='keep INFO logging on')
+    args = parser.parse_args(argv)
+
+    if args.log:
+        configureLogging()
+    else:
+        logging.disable(logging.INFO)
+    sizes = [int(s) for s in args.images.split(',')]
+    current = runBenchmarks(sizes, args.branches, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    for r in current['results']:
+        if 'bytes' in r:
+            print('{0:<28} {1:>8} images {2:>10.1f}MB'.format(
+                r['benchmark'], r['images'], r['bytes'] / 1e6))
+            continue
+        print('{0:<28} {1:>8} images {2:>10.4f}s best {3:>10.4f}s mean{4}'.
+              format(r['benchmark'], r['images'], r['best'], r['mean'],
+                     ' {0:>6.2f}x faster'.format(r['speedup'])
+                     if 'speedup' in r else ''))
+    if args.compare:
+        with open(args.compare) as f:
+            for row in compare(current, json.load(f)):
+                print('{0:<28} {1:>8} images {2:>6.2f}x'.format(
+                    row['benchmark'], row['images'], row['ratio']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
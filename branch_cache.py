@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger()
+
+GITHUB_API = 'https://api.github.com'
+# largest page size the branches endpoint accepts
+BRANCHES_PER_PAGE = 100
+# seconds to wait for github to connect and to answer
+GITHUB_TIMEOUT = 30
+
+
+class BranchCache(object):
+    """
+    On-disk cache of github branch lists keyed by repository.
+
+    Entries younger than ttl seconds are served without touching github.
+    Older entries are revalidated page by page with If-None-Match, so an
+    unchanged branch list costs one 304 per page, which github doesn't count
+    against the rate limit. At most maxEntries repositories are kept, the
+    least recently used ones are evicted first.
+    """
+
+    def __init__(self, path, token, ttl=3600, maxEntries=1000, session=None,
+                 timeout=GITHUB_TIMEOUT):
+        self.path = path
+        self.token = token
+        self.timeout = timeout
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.session = session or requests.Session()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.requests = 0
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logger.warning(
+                    "Ignoring unreadable branch cache {0}".format(path))
+
+    def getBranches(self, repository, onRequest=None):
+        """
+        return the lower cased branch names of a github repository, from
+        the cache when it's fresh or still valid. onRequest is called for
+        every request sent to github
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(repository)
+            if entry is not None:
+                entry['lastUsed'] = now
+                if now - entry['fetchedAt'] < self.ttl:
+                    self.hits += 1
+                    return self.branchNames(entry)
+        oldPages = entry['pages'] if entry is not None else []
+
+        pages, unchanged = self.fetchPages(repository, oldPages, onRequest)
+        with self.lock:
+            if unchanged:
+                self.revalidated += 1
+            else:
+                self.misses += 1
+            entry = {'fetchedAt': now, 'lastUsed': now, 'pages': pages}
+            self.entries[repository] = entry
+            self.evict()
+        return self.branchNames(entry)
+
+    def fetchPages(self, repository, oldPages, onRequest=None):
+        """
+        walk the branches endpoint, sending the cached ETag of every page we
+        already have. returns the pages and whether all of them were 304s
+        """
+        headers = {'Accept': 'application/vnd.github.v3+json'}
+        if self.token:
+            headers['Authorization'] = 'token {0}'.format(self.token)
+        url = '{0}/repos/{1}/branches'.format(GITHUB_API, repository)
+        pages = []
+        unchanged = True
+        page = 1
+        while True:
+            cached = oldPages[page - 1] if page <= len(oldPages) else None
+            pageHeaders = dict(headers)
+            if cached is not None and cached.get('etag'):
+                pageHeaders['If-None-Match'] = cached['etag']
+            response = self.session.get(
+                url,
+                params={
+                    'per_page': BRANCHES_PER_PAGE,
+                    'page': page
+                },
+                headers=pageHeaders,
+                timeout=self.timeout)
+            with self.lock:
+                self.requests += 1
+            if onRequest is not None:
+                onRequest()
+            if response.status_code == 304:
+                pages.append(cached)
+            else:
+                response.raise_for_status()
+                unchanged = False
+                pages.append({
+                    'etag': response.headers.get('ETag'),
+                    'branches': [b['name'].lower() for b in response.json()],
+                    'hasNext': 'next' in response.links
+                })
+            if not pages[-1]['hasNext']:
+                break
+            page += 1
+        if len(pages) != len(oldPages):
+            unchanged = False
+        return pages, unchanged
+
+    def branchNames(self, entry):
+        branches = []
+        for page in entry['pages']:
+            branches += page['branches']
+        return branches
+
+    def evict(self):
+        """
+        drop the least recently used entries above maxEntries, caller holds
+        the lock
+        """
+        overflow = len(self.entries) - self.maxEntries
+        if overflow > 0:
+            for repository in sorted(
+                    self.entries,
+                    key=lambda r: self.entries[r]['lastUsed'])[:overflow]:
+                del self.entries[repository]
+
+    def save(self):
+        """
+        write the cache atomically so an interrupted run never leaves a
+        truncated file behind
+        """
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmpPath = self.path + '.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmpPath, self.path)
+
+    def resetStats(self):
+        """
+        start counting hits, misses and requests anew, e.g. for the next run
+        """
+        with self.lock:
+            self.hits = 0
+            self.revalidated = 0
+            self.misses = 0
+            self.requests = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "BranchCacheHits": self.hits,
+                "BranchCacheRevalidated": self.revalidated,
+                "BranchCacheMisses": self.misses,
+                "GithubRequests": self.requests,
+                "BranchCacheEntries": len(self.entries)
+            }
@@ -0,0 +1,154 @@
+"""
+Columnar evaluation of the deleteOldBuilds retention rules over a whole
+fleet of repositories at once.
+
+The parsed tags of every repository are loaded into NumPy arrays (repository,
+class, branch, buildNo, major, minor) and the builds kept per group are
+found with one lexsort over the fleet instead of dicts and Python loops per
+repository. The results, tag order included, are the ones
+retention.selectOldBuilds gives for each repository.
+"""
+import datetime
+
+import numpy
+
+import retention
+
+# class codes, in the order selectOldBuilds lists condemned tags
+KIND_CODES = {'develop': 0, 'master': 1, 'feature': 2, 'version': 3, 'rc': 4}
+UNKNOWN = -1
+
+
+class FleetColumns(object):
+    """
+    the parsed tags of a fleet as arrays, one row per tag in inventory order
+    """
+
+    def __init__(self, inventories):
+        """
+        inventories maps every repository to its parseInventory view
+        """
+        self.repositories = list(inventories)
+        self.tags = []
+        repositoryIds = []
+        kinds = []
+        branches = []
+        buildNos = []
+        majors = []
+        minors = []
+        # branch ids are handed out in order of first appearance, which is
+        # the order selectOldBuilds walks feature branches in
+        branchIds = {}
+        for repositoryId, repository in enumerate(self.repositories):
+            parsed = inventories[repository]
+            self.tags += [i.tag for i in parsed]
+            repositoryIds.append(
+                numpy.full(len(parsed), repositoryId, dtype=numpy.int32))
+            kinds += [KIND_CODES.get(i.kind, UNKNOWN) for i in parsed]
+            branches += [
+                branchIds.setdefault((repositoryId, i.branch), len(branchIds))
+                if i.kind == 'feature' else -1 for i in parsed
+            ]
+            buildNos += [
+                -1 if i.buildNo is None else i.buildNo for i in parsed
+            ]
+            majors += [-1 if i.major is None else i.major for i in parsed]
+            minors += [-1 if i.minor is None else i.minor for i in parsed]
+        self.repository = numpy.concatenate(
+            repositoryIds) if repositoryIds else numpy.zeros(0, numpy.int32)
+        self.kind = numpy.array(kinds, dtype=numpy.int8)
+        self.branch = numpy.array(branches, dtype=numpy.int64)
+        self.buildNo = numpy.array(buildNos, dtype=numpy.int64)
+        self.major = numpy.array(majors, dtype=numpy.int64)
+        self.minor = numpy.array(minors, dtype=numpy.int64)
+        self.position = numpy.arange(len(self.tags), dtype=numpy.int64)
+
+
+def expiredVersions(major, minor, today=None):
+    """
+    retention.isExpiredVersion over arrays of majors and minors
+    """
+    if today is None:
+        today = datetime.datetime.today()
+    latestMajor = int(today.strftime('%y'))
+    latestMinor = today.month
+    if latestMinor >= 3:
+        return (major < latestMajor) | (minor < latestMinor - 2)
+    elif latestMinor == 2:
+        return (major < latestMajor) & (minor < 12)
+    else:
+        return (major < latestMajor) & (minor < 11)
+
+
+def condemnedBuilds(columns, keep):
+    """
+    mask of the develop/master/feature rows outside the `keep` newest builds
+    of their group. within a group rows are ranked by buildNo, ties going to
+    the earlier tag like heapq.nlargest does
+    """
+    # develop and master are grouped per repository, feature builds per
+    # branch, whose ids are unique over the fleet
+    group = numpy.where(
+        columns.kind == KIND_CODES['feature'], columns.branch,
+        -1 - (columns.repository.astype(numpy.int64) * 2 + columns.kind))
+    rows = numpy.nonzero((columns.kind >= 0)
+                         & (columns.kind <= KIND_CODES['feature']))[0]
+    order = rows[numpy.lexsort((columns.position[rows],
+                                -columns.buildNo[rows], group[rows]))]
+    sortedGroup = group[order]
+    starts = numpy.ones(len(order), dtype=bool)
+    starts[1:] = sortedGroup[1:] != sortedGroup[:-1]
+    groupStart = numpy.maximum.accumulate(
+        numpy.where(starts, numpy.arange(len(order)), 0))
+    rank = numpy.arange(len(order)) - groupStart
+    keepPerKind = numpy.array(
+        [keep['develop'], keep['master'], keep['feature']], dtype=numpy.int64)
+    mask = numpy.zeros(len(columns.tags), dtype=bool)
+    mask[order] = rank >= keepPerKind[columns.kind[order]]
+    return mask
+
+
+def condemnedVersions(columns, today=None):
+    """
+    mask of the version and rc rows in an expired line, for repositories
+    with more than one version and more than one rc
+    """
+    repositories = len(columns.repositories)
+    isVersion = columns.kind == KIND_CODES['version']
+    isRc = columns.kind == KIND_CODES['rc']
+    versions = numpy.bincount(
+        columns.repository[isVersion], minlength=repositories)
+    rcs = numpy.bincount(columns.repository[isRc], minlength=repositories)
+    pruned = (versions > 1) & (rcs > 1)
+    return (isVersion | isRc) & pruned[columns.repository] & expiredVersions(
+        columns.major, columns.minor, today)
+
+
+def fleetOldBuilds(inventories, keep=None, today=None):
+    """
+    the deleteOldBuilds result of every repository of inventories
+    ({repository: parseInventory view}) computed in one pass over the fleet
+    """
+    if keep is None:
+        keep = retention.DEFAULT_RETENTION
+    columns = FleetColumns(inventories)
+    mask = condemnedBuilds(columns, keep) | condemnedVersions(columns, today)
+    rows = numpy.nonzero(mask)[0]
+    # selectOldBuilds lists develop, master, feature branches by first
+    # appearance, versions and then rc's, each in inventory order
+    branch = numpy.where(columns.kind[rows] == KIND_CODES['feature'],
+                         columns.branch[rows], 0)
+    rows = rows[numpy.lexsort((columns.position[rows], branch,
+                               columns.kind[rows], columns.repository[rows]))]
+    bounds = numpy.searchsorted(columns.repository[rows],
+                                numpy.arange(len(columns.repositories) + 1))
+    results = {}
+    for repositoryId, repository in enumerate(columns.repositories):
+        results[repository] = {
+            "Reason": "Old-builds",
+            "ImageTags": [
+                columns.tags[i]
+                for i in rows[bounds[repositoryId]:bounds[repositoryId + 1]]
+            ]
+        }
+    return results
@@ -0,0 +1,269 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# seconds a replica's heartbeat and a repository lease stay valid without
+# being renewed; both are renewed every third of it
+DEFAULT_LEASE_TTL = 300
+# points every replica gets on the hash ring, so repositories spread evenly
+VIRTUAL_NODES = 64
+
+
+class LeaseLost(Exception):
+    """
+    raised for a delete request on a repository whose lease another replica
+    took over while this one was cleaning it
+    """
+
+
+def defaultReplicaId():
+    return '{0}-{1}'.format(socket.gethostname(), os.getpid())
+
+
+def ringPoint(key):
+    return int(hashlib.md5(key.encode('utf8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring of replica ids. A repository belongs to the first
+    replica point after its own, so a replica joining or leaving only moves
+    the repositories next to its points
+    """
+
+    def __init__(self, replicas, virtualNodes=VIRTUAL_NODES):
+        self.points = sorted(
+            (ringPoint('{0}#{1}'.format(replica, n)), replica)
+            for replica in replicas for n in range(0, virtualNodes))
+        self.keys = [point for point, replica in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        n = bisect.bisect(self.keys, ringPoint(key)) % len(self.points)
+        return self.points[n][1]
+
+
+class LeaseStore(object):
+    """
+    SQLite store of replica heartbeats and repository leases, shared by the
+    replicas through a file on a common volume. SQLite's file locking makes
+    every acquire atomic across processes
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS replicas (replica TEXT PRIMARY KEY, "
+                "expires REAL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases (repository TEXT PRIMARY KEY, "
+                "owner TEXT, expires REAL)")
+
+    def heartbeat(self, replica, expires):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO replicas (replica, expires) VALUES (?, ?)",
+                (replica, expires))
+
+    def leave(self, replica):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM replicas WHERE replica = ?",
+                                    (replica, ))
+            self.connection.execute("DELETE FROM leases WHERE owner = ?",
+                                    (replica, ))
+
+    def liveReplicas(self, now):
+        with self.lock:
+            return [
+                row[0] for row in self.connection.execute(
+                    "SELECT replica FROM replicas WHERE expires > ? "
+                    "ORDER BY replica", (now, ))
+            ]
+
+    def acquire(self, repository, owner, expires, now):
+        """
+        take or renew the lease of repository until expires. fails while
+        another owner holds a lease that hasn't expired
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO leases (repository, owner, expires) "
+                "VALUES (?, ?, ?)", (repository, owner, expires))
+            cursor = self.connection.execute(
+                "UPDATE leases SET owner = ?, expires = ? WHERE repository = ? "
+                "AND (owner = ? OR expires <= ?)",
+                (owner, expires, repository, owner, now))
+            return cursor.rowcount == 1
+
+    def release(self, repository, owner):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM leases WHERE repository = ? AND owner = ?",
+                (repository, owner))
+
+    def owner(self, repository, now):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT owner FROM leases WHERE repository = ? AND expires > ?",
+                (repository, now)).fetchone()
+        return row[0] if row else None
+
+
+class Coordinator(object):
+    """
+    Shares the repositories of REGISTRIES between registry-ops replicas.
+
+    Every replica heartbeats into a shared LeaseStore. A repository is
+    assigned by consistent hashing over the replicas whose heartbeat is
+    alive, and its owner holds a lease on it for as long as it cleans it, so
+    two replicas never prune the same repository even while the ring
+    changes. Heartbeats and leases expire after `ttl` seconds: the
+    repositories of a replica that crashed move to the others once its
+    heartbeat is gone, and its leases can be taken over once they lapse. A
+    replica that stalled past the ttl and finds its lease taken over stops
+    deleting from that repository (see checkLease).
+    """
+
+    def __init__(self, store, replica=None, ttl=DEFAULT_LEASE_TTL,
+                 clock=time.time):
+        self.store = store
+        self.replica = replica or defaultReplicaId()
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # blocks holding every lease of this replica, and the leases taken
+        # over while held
+        self.held = {}
+        self.lost = set()
+
+    def heartbeat(self):
+        self.store.heartbeat(self.replica, self.clock() + self.ttl)
+
+    def leave(self):
+        """
+        hand this replica's repositories to the others right away
+        """
+        self.store.leave(self.replica)
+
+    def assigned(self, repository):
+        """
+        whether repository hashes to this replica among the live ones
+        """
+        ring = HashRing(self.store.liveReplicas(self.clock()))
+        return ring.owner(repository) == self.replica
+
+    @contextmanager
+    def lease(self, repository):
+        """
+        hold the lease of repository for the enclosed block, renewing it
+        every third of the ttl. yields whether it was acquired. blocks of
+        this replica that need the same lease at once share it, the last one
+        to end releases it
+        """
+        with self.lock:
+            held = self.held.get(repository)
+            if held is not None:
+                held['blocks'] += 1
+            else:
+                now = self.clock()
+                if self.store.acquire(repository, self.replica,
+                                      now + self.ttl, now):
+                    held = self.hold(repository)
+        if held is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self.lock:
+                held['blocks'] -= 1
+                last = held['blocks'] == 0
+                if last:
+                    del self.held[repository]
+            if last:
+                held['stopped'].set()
+                held['renewer'].join()
+                with self.lock:
+                    # unless another block took the lease again meanwhile
+                    if repository not in self.held:
+                        self.lost.discard(repository)
+                        self.store.release(repository, self.replica)
+
+    def hold(self, repository):
+        # caller holds the lock and just acquired the lease
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(self.ttl / 3.0):
+                if not self.renew(repository):
+                    return
+
+        held = {
+            'blocks': 1,
+            'stopped': stopped,
+            'renewer': threading.Thread(target=renew, daemon=True)
+        }
+        self.lost.discard(repository)
+        self.held[repository] = held
+        held['renewer'].start()
+        return held
+
+    def renew(self, repository):
+        """
+        extend this replica's heartbeat and lease of repository. returns
+        False, and marks the lease lost, when another replica took it over
+        """
+        now = self.clock()
+        self.store.heartbeat(self.replica, now + self.ttl)
+        if self.store.acquire(repository, self.replica, now + self.ttl, now):
+            return True
+        logging.LoggerAdapter(logger, {'repository': repository}).error(
+            "Lost the lease of {0} to replica {1}".format(
+                repository, self.store.owner(repository, now)))
+        with self.lock:
+            self.lost.add(repository)
+        return False
+
+    def checkLease(self, repository):
+        """
+        raise LeaseLost if the lease of repository was taken over
+        """
+        with self.lock:
+            lost = repository in self.lost
+        if lost:
+            raise LeaseLost(
+                "The lease of {0} was taken over by another replica".format(
+                    repository))
+
+    def run(self, repository, fn):
+        """
+        run fn if repository is assigned to this replica and its lease could
+        be taken, returning its result (None when skipped)
+        """
+        self.heartbeat()
+        log = logging.LoggerAdapter(logger, {'repository': repository})
+        if not self.assigned(repository):
+            log.debug("{0} is assigned to another replica".format(repository))
+            return None
+        with self.lease(repository) as acquired:
+            if not acquired:
+                log.info("Skipping {0}, replica {1} holds its lease".format(
+                    repository, self.store.owner(repository, self.clock())))
+                return None
+            return fn()
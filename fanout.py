@@ -0,0 +1,200 @@
+"""
+Prune the repositories of several AWS accounts and regions from one
+container.
+
+    python fanout.py targets.json [--processes 8]
+
+targets.json lists the account/role/region/repository targets:
+
+    {"targets": [{"account": "123456789012",
+                  "role": "arn:aws:iam::123456789012:role/registry-ops",
+                  "region": "us-west-2",
+                  "repositories": ["org/a", "org/b"]}]}
+
+Every target is cleaned in its own worker process, with its own boto3
+session (the role, when given, is assumed through STS), ECR client and rate
+limiter, so targets don't share a GIL, a connection pool or each other's
+throttling. DELETE_IMAGES, RETENTION, REPOSITORY_WORKERS, ECR_RATE_LIMITS,
+LOG_CHUNK_SIZE and REGISTRY_OPS_ACCESS_TOKEN are read from the environment
+like registry_ops.py does. The run summaries of the targets are merged into one.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+import pruneBuilds
+import retention
+from rate_limiter import AdaptiveRateLimiter, parseRates
+from run_metrics import COUNTERS
+
+logger = logging.getLogger()
+
+# session name of the assumed roles, shown in the target accounts' CloudTrail
+ROLE_SESSION_NAME = 'registry-ops'
+
+
+def loadTargets(path):
+    """
+    the targets of a fan-out config file, raising ValueError on an invalid
+    one
+    """
+    with open(path) as f:
+        try:
+            config = json.load(f)
+        except ValueError:
+            raise ValueError("{0} is not valid JSON".format(path))
+    targets = config.get('targets') if isinstance(config, dict) else None
+    if not isinstance(targets, list) or not targets:
+        raise ValueError("{0} lists no targets".format(path))
+    for target in targets:
+        if not isinstance(target, dict) or not target.get('region') or \
+                not isinstance(target.get('repositories'), list) or \
+                not target['repositories']:
+            raise ValueError(
+                "Invalid target {0}, a target needs a region and repositories".
+                format(json.dumps(target)))
+    return targets
+
+
+def targetName(target):
+    return '{0}/{1}'.format(target.get('account', 'default'), target['region'])
+
+
+def targetSession(target, sts=None):
+    """
+    a boto3 session in the target's region, with the credentials of its role
+    when it has one
+    """
+    if not target.get('role'):
+        return boto3.Session(region_name=target['region'])
+    kwargs = {'RoleArn': target['role'], 'RoleSessionName': ROLE_SESSION_NAME}
+    if target.get('externalId'):
+        kwargs['ExternalId'] = target['externalId']
+    credentials = (sts or boto3.client('sts')).assume_role(
+        **kwargs)['Credentials']
+    return boto3.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'],
+        region_name=target['region'])
+
+
+def targetPruneBuilds(target):
+    workers = int(os.environ.get('REPOSITORY_WORKERS', '1'))
+    client = targetSession(target).client(
+        'ecr',
+        config=Config(
+            max_pool_connections=max(pruneBuilds.DEFAULT_POOL_CONNECTIONS,
+                                     workers * 2),
+            retries={'max_attempts': 0}))
+    return pruneBuilds.PruneBuilds(
+        workers=workers,
+        keep=retention.parseRetention(os.environ.get('RETENTION', '')),
+        rateLimiter=AdaptiveRateLimiter(
+            parseRates(os.environ.get('ECR_RATE_LIMITS', ''))),
+        client=client,
+        logChunkSize=int(
+            os.environ.get('LOG_CHUNK_SIZE', str(pruneBuilds.LOG_CHUNK_SIZE))))
+
+
+def runTarget(target, makePruneBuilds=targetPruneBuilds):
+    """
+    clean the repositories of one target, in a worker process. a target
+    that fails (e.g. its role can't be assumed) is reported, not raised, so
+    the other targets are still cleaned
+    """
+    name = targetName(target)
+    try:
+        pb = makePruneBuilds(target)
+        results = pb.clean_images(target['repositories'])
+        return {
+            "target": name,
+            "results": results,
+            "summary": pb.metrics.runSummary()
+        }
+    except Exception as e:
+        logger.exception("Failed to clean target {0}".format(name))
+        return {"target": name, "error": str(e)}
+
+
+def mergeSummaries(outcomes, seconds):
+    """
+    one run summary over the outcomes of every target
+    """
+    summary = {
+        "Summary": "fanout",
+        "targets": len(outcomes),
+        "failedTargets": [o['target'] for o in outcomes if 'error' in o],
+        "repositories": 0,
+        "seconds": round(seconds, 6)
+    }
+    phases = {}
+    calls = {}
+    for counter in COUNTERS:
+        summary[counter] = 0
+    for outcome in outcomes:
+        if 'summary' not in outcome:
+            continue
+        targetSummary = outcome['summary']
+        summary['repositories'] += targetSummary['repositories']
+        for counter in COUNTERS:
+            summary[counter] += targetSummary[counter]
+        for p, t in targetSummary['phases'].items():
+            phases[p] = phases.get(p, 0) + t
+        for c, n in targetSummary['calls'].items():
+            calls[c] = calls.get(c, 0) + n
+    summary['phases'] = dict((p, round(t, 6)) for p, t in phases.items())
+    summary['calls'] = calls
+    return summary
+
+
+def runFanout(targets, processes=None, runner=runTarget,
+              executorClass=ProcessPoolExecutor):
+    """
+    clean every target on a pool of `processes` worker processes (one per
+    core by default) and return the outcome of every target, in the order
+    of targets, along with the merged summary
+    """
+    processes = processes or os.cpu_count() or 1
+    start = time.perf_counter()
+    with executorClass(max_workers=min(processes, len(targets))) as executor:
+        outcomes = list(executor.map(runner, targets))
+    summary = mergeSummaries(outcomes, time.perf_counter() - start)
+    for outcome in outcomes:
+        if 'summary' in outcome:
+            logger.info(dict(outcome['summary'], target=outcome['target']))
+    logger.info(summary)
+    return outcomes, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('config', help='JSON file listing the targets')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        help='worker processes (default one per core)')
+    args = parser.parse_args(argv)
+    pruneBuilds.configureLogging()
+
+    if os.environ.get('DELETE_IMAGES') not in ('0', '1'):
+        logger.critical("DELETE_IMAGES must be 0 or 1")
+        return 1
+    try:
+        targets = loadTargets(args.config)
+    except (OSError, ValueError) as e:
+        logger.critical(e)
+        return 1
+    outcomes, summary = runFanout(targets, args.processes)
+    return 1 if summary['failedTargets'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger()
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+# largest page size of a GraphQL connection
+REFS_PER_PAGE = 100
+# repositories aliased into one query, 50 pages of 100 refs stay far below
+# github's node limit
+REPOSITORIES_PER_QUERY = 50
+# seconds a query may take before it is given up
+GITHUB_TIMEOUT = 30
+
+# the next page of branches of the n-th repository of a query
+REPOSITORY_QUERY = (
+    '  r{n}: repository(owner: $owner{n}, name: $name{n}) {{\n'
+    '    refs(refPrefix: "refs/heads/", first: {first}, after: $after{n}) {{\n'
+    '      nodes {{ name }}\n'
+    '      pageInfo {{ hasNextPage endCursor }}\n'
+    '    }}\n'
+    '  }}')
+
+
+def githubRepository(ecrRepository):
+    """
+    (owner, name) of the github repository an ECR repository is built
+    from, None if its name isn't owner/name
+    """
+    owner, sep, name = ecrRepository.strip('\'').partition('/')
+    if not sep or not owner or not name or '/' in name:
+        return None
+    return owner, name
+
+
+def branchesQuery(pages):
+    """
+    the query and variables fetching the next page of branches of every
+    (owner, name, cursor) in pages, the n-th aliased as rn
+    """
+    declarations = []
+    fields = []
+    variables = {}
+    for n, (owner, name, cursor) in enumerate(pages):
+        declarations.append(
+            '$owner{0}: String!, $name{0}: String!, $after{0}: String'.
+            format(n))
+        fields.append(REPOSITORY_QUERY.format(n=n, first=REFS_PER_PAGE))
+        variables['owner{0}'.format(n)] = owner
+        variables['name{0}'.format(n)] = name
+        variables['after{0}'.format(n)] = cursor
+    query = 'query({0}) {{\n  rateLimit {{ cost remaining resetAt }}\n{1}\n}}'
+    return query.format(', '.join(declarations), '\n'.join(fields)), variables
+
+
+class GraphqlBranches(object):
+    """
+    Fetches the branches of many github repositories at once, with one
+    GraphQL query per page of up to REPOSITORIES_PER_QUERY repositories
+    instead of a REST walk per repository. Repositories with more than
+    REFS_PER_PAGE branches carry on with their cursor in the next query.
+    The rate limit cost github reports for every query is added up.
+    """
+
+    def __init__(self, token, session=None, url=GRAPHQL_URL,
+                 repositoriesPerQuery=REPOSITORIES_PER_QUERY,
+                 timeout=GITHUB_TIMEOUT):
+        self.token = token
+        self.session = session or requests.Session()
+        self.url = url
+        self.timeout = timeout
+        self.repositoriesPerQuery = max(1, int(repositoriesPerQuery))
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.cost = 0
+        self.remaining = None
+        self.resetAt = None
+
+    def query(self, pages):
+        """
+        send one query for pages and return its data. repositories github
+        can't resolve come back as None and are logged
+        """
+        query, variables = branchesQuery(pages)
+        headers = {}
+        if self.token:
+            headers['Authorization'] = 'bearer {0}'.format(self.token)
+        response = self.session.post(
+            self.url,
+            json={
+                'query': query,
+                'variables': variables
+            },
+            headers=headers,
+            timeout=self.timeout)
+        response.raise_for_status()
+        content = response.json()
+        for error in content.get('errors') or []:
+            logger.warning("GitHub GraphQL: {0}".format(error.get('message')))
+        data = content.get('data') or {}
+        rateLimit = data.get('rateLimit') or {}
+        with self.lock:
+            self.queries += 1
+            self.cost += rateLimit.get('cost', 0)
+            self.remaining = rateLimit.get('remaining', self.remaining)
+            self.resetAt = rateLimit.get('resetAt', self.resetAt)
+        return data
+
+    def fetch(self, repositories):
+        """
+        {ECR repository: lower cased branch names} of the given repositories.
+        the ones whose github repository can't be named or read are left out
+        """
+        branches = {}
+        pending = []
+        for repository in repositories:
+            github = githubRepository(repository)
+            if github is None:
+                logger.warning(
+                    "{0} doesn't name a github repository".format(repository))
+                continue
+            branches[repository] = []
+            pending.append((repository, github, None))
+        failed = set()
+        while pending:
+            batch = pending[:self.repositoriesPerQuery]
+            pending = pending[self.repositoriesPerQuery:]
+            data = self.query([(github[0], github[1], cursor)
+                               for repository, github, cursor in batch])
+            for n, (repository, github, cursor) in enumerate(batch):
+                refs = (data.get('r{0}'.format(n)) or {}).get('refs')
+                if refs is None:
+                    failed.add(repository)
+                    continue
+                branches[repository] += [
+                    ref['name'].lower() for ref in refs['nodes']
+                ]
+                if refs['pageInfo']['hasNextPage']:
+                    pending.append((repository, github,
+                                    refs['pageInfo']['endCursor']))
+        return dict((repository, names)
+                    for repository, names in branches.items()
+                    if repository not in failed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "GithubGraphqlQueries": self.queries,
+                "GithubGraphqlCost": self.cost,
+                "GithubRateLimitRemaining": self.remaining,
+                "GithubRateLimitResetAt": self.resetAt
+            }
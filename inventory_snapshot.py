@@ -0,0 +1,135 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# a full re-evaluation of every branch group is forced at least this often
+DEFAULT_FULL_SCAN_INTERVAL = 7 * 24 * 3600
+
+
+class InventorySnapshot(object):
+    """
+    SQLite store of the inventory every repository had at the end of its
+    last run, used to diff a fresh listing against it so retention only has
+    to be re-evaluated for what changed.
+
+    A full scan (snapshot ignored) is done when a repository has no
+    snapshot yet, when fullScan is set, when the last full scan is older than
+    fullScanInterval seconds, when the month changed since then, since the
+    version windows of deleteOldBuilds move with the date, or when the
+    retention differs from the one of the last full scan, since the groups
+    that didn't change were only evaluated against that one.
+    """
+
+    def __init__(self,
+                 path,
+                 fullScanInterval=DEFAULT_FULL_SCAN_INTERVAL,
+                 fullScan=False):
+        self.path = path
+        self.fullScanInterval = fullScanInterval
+        self.fullScan = fullScan
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS images (repository TEXT, digest TEXT, "
+                "tag TEXT, PRIMARY KEY (repository, digest, tag))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS scans (repository TEXT PRIMARY KEY, "
+                "lastScan REAL, lastFullScan REAL, keep TEXT)")
+            columns = [
+                row[1] for row in self.connection.execute(
+                    "PRAGMA table_info(scans)")
+            ]
+            if 'keep' not in columns:
+                # snapshots written before the retention was recorded
+                self.connection.execute(
+                    "ALTER TABLE scans ADD COLUMN keep TEXT")
+
+    def imageKeys(self, imageList):
+        # untagged images are stored with an empty tag
+        return set((i.get('imageDigest'), i.get('imageTag', ''))
+                   for i in imageList)
+
+    def imageId(self, key):
+        imageId = {'imageDigest': key[0]}
+        if key[1]:
+            imageId['imageTag'] = key[1]
+        return imageId
+
+    def encodeKeep(self, keep):
+        return json.dumps(keep, sort_keys=True) if keep is not None else None
+
+    def load(self, repository):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT digest, tag FROM images WHERE repository = ?",
+                (repository, )).fetchall()
+        return set(rows)
+
+    def needsFullScan(self, repository, now=None, keep=None):
+        """
+        whether the snapshot of repository can't be used, keep being the
+        retention (builds kept per branch class) of this run
+        """
+        if now is None:
+            now = time.time()
+        if self.fullScan:
+            return True
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT lastFullScan, keep FROM scans WHERE repository = ?",
+                (repository, )).fetchone()
+        if row is None or row[0] is None:
+            return True
+        if keep is not None and self.encodeKeep(keep) != row[1]:
+            return True
+        lastFullScan = datetime.datetime.fromtimestamp(row[0])
+        today = datetime.datetime.fromtimestamp(now)
+        if (lastFullScan.year, lastFullScan.month) != (today.year, today.month):
+            return True
+        return now - row[0] >= self.fullScanInterval
+
+    def diff(self, repository, imageList):
+        """
+        compare a list_images inventory with the snapshot, returning the
+        imageIds added and removed since it was taken
+        """
+        old = self.load(repository)
+        new = self.imageKeys(imageList)
+        return ([self.imageId(k) for k in sorted(new - old)],
+                [self.imageId(k) for k in sorted(old - new)])
+
+    def save(self, repository, imageList, fullScan=False, now=None,
+             keep=None):
+        """
+        make imageList the snapshot of repository, writing only the rows that
+        changed. the keep of a full scan is recorded so a later change of
+        retention forces the next one
+        """
+        if now is None:
+            now = time.time()
+        old = self.load(repository)
+        new = self.imageKeys(imageList)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM images WHERE repository = ? AND digest = ? AND tag = ?",
+                [(repository, d, t) for d, t in old - new])
+            self.connection.executemany(
+                "INSERT INTO images (repository, digest, tag) VALUES (?, ?, ?)",
+                [(repository, d, t) for d, t in new - old])
+            row = self.connection.execute(
+                "SELECT lastFullScan, keep FROM scans WHERE repository = ?",
+                (repository, )).fetchone()
+            if fullScan:
+                lastFullScan, lastKeep = now, self.encodeKeep(keep)
+            else:
+                lastFullScan, lastKeep = row if row else (None, None)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO scans (repository, lastScan, lastFullScan, keep) "
+                "VALUES (?, ?, ?, ?)", (repository, now, lastFullScan, lastKeep))
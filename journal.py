@@ -0,0 +1,153 @@
+import calendar
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# ECR accepts at most 100 imageIds per batch_delete_image request
+BATCH_SIZE = 100
+# plans older than this are dropped instead of resumed, the registry has
+# moved on since they were computed
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+class DeletionJournal(object):
+    """
+    SQLite write-ahead journal of deletion plans.
+
+    A repository's plan is recorded, split into batches, before the first
+    batch_delete_image request goes out and every batch is checkpointed as
+    soon as it completes. A run that was interrupted leaves its unfinished
+    batches behind, which the next run executes before planning anything
+    new. Resuming is safe since deleting an image twice only reports it as
+    ImageNotFound.
+    """
+
+    def __init__(self, path, maxAge=DEFAULT_MAX_AGE):
+        self.path = path
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS batches (repository TEXT, "
+                "batch INTEGER, imageIds TEXT, created REAL, done INTEGER, "
+                "PRIMARY KEY (repository, batch))")
+
+    def record(self, repository, imageIds, now=None):
+        """
+        persist the plan of repository in batches of BATCH_SIZE, replacing
+        whatever was left of a previous one. returns the batches
+        """
+        if now is None:
+            now = time.time()
+        batches = [
+            imageIds[start:start + BATCH_SIZE]
+            for start in range(0, len(imageIds), BATCH_SIZE)
+        ]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM batches WHERE repository = ?", (repository, ))
+            self.connection.executemany(
+                "INSERT INTO batches (repository, batch, imageIds, created, done) "
+                "VALUES (?, ?, ?, ?, 0)",
+                [(repository, n, json.dumps(batch), now)
+                 for n, batch in enumerate(batches)])
+        return list(enumerate(batches))
+
+    def pending(self, repository):
+        """
+        the (batch, imageIds) of repository not checkpointed yet
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT batch, imageIds FROM batches WHERE repository = ? "
+                "AND done = 0 ORDER BY batch", (repository, )).fetchall()
+        return [(batch, json.loads(imageIds)) for batch, imageIds in rows]
+
+    def complete(self, repository, batch):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE batches SET done = 1 WHERE repository = ? AND batch = ?",
+                (repository, batch))
+
+    def finish(self, repository):
+        """
+        forget the plan of repository once every batch is done
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM batches WHERE repository = ?", (repository, ))
+
+    def interrupted(self, now=None):
+        """
+        repositories whose last plan has unfinished batches, dropping the
+        plans older than maxAge
+        """
+        if now is None:
+            now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM batches WHERE created < ?",
+                                    (now - self.maxAge, ))
+            rows = self.connection.execute(
+                "SELECT DISTINCT repository FROM batches WHERE done = 0 "
+                "ORDER BY repository").fetchall()
+        return [r[0] for r in rows]
+
+
+def writePlanFile(path, plans, now=None):
+    """
+    write the plans of a run ({repository: {'condemned': tags,
+    'orphans': digests, 'imageIds': plan}}) for review, atomically. concurrent
+    writers each write their own temporary file
+    """
+    if now is None:
+        now = time.time()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmpPath = tempfile.mkstemp(
+        dir=directory or '.',
+        prefix=os.path.basename(path) + '.',
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                         time.gmtime(now)),
+                'repositories': plans
+            }, f, indent=2, sort_keys=True)
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, path)
+    except Exception:
+        os.remove(tmpPath)
+        raise
+
+
+def readPlanFile(path, maxAge=None, now=None):
+    """
+    the {repository: plan} of a file written by writePlanFile. with maxAge,
+    files written more than maxAge seconds ago are refused: the registry has
+    moved on since, and tags pushed to the planned digests would go with them
+    """
+    with open(path) as f:
+        content = json.load(f)
+    try:
+        plans = dict((repository, plan['imageIds'])
+                     for repository, plan in content['repositories'].items())
+        created = calendar.timegm(
+            time.strptime(content['created'], '%Y-%m-%dT%H:%M:%SZ'))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        raise ValueError("Invalid plan file {0}".format(path))
+    if now is None:
+        now = time.time()
+    if maxAge is not None and now - created > maxAge:
+        raise ValueError(
+            "{0} was written on {1}, plans older than {2} hours aren't applied".
+            format(path, content['created'], maxAge // 3600))
+    return plans
@@ -0,0 +1,215 @@
+"""
+Compile the retention rules of deleteOldBuilds into an ECR lifecycle policy,
+so ECR expires those images server side, and check on a repository's
+describe_images inventory that the policy deletes exactly what
+deleteOldBuilds would.
+
+    python lifecycle_policy.py org/repository [--apply]
+
+Only the develop and master rules (keep the newest N builds of a class) can
+be expressed in the policy language. Feature branches would need a rule per
+branch, and the version/rc windows depend on the date in the tag rather than
+the push date, so those, closed github branches and orphans stay with
+PruneBuilds.
+
+The policy orders images by push time where deleteOldBuilds orders them by
+build number, and a tag prefix also selects tags deleteOldBuilds puts in
+another group (develop-foo-3 is a feature build, c-develop-3 a develop
+build). Hence the equivalence check before a policy is applied.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+
+import pruneBuilds
+import retention
+
+logger = logging.getLogger()
+
+# branch classes whose retention a lifecycle policy can express
+COMPILABLE = ('develop', 'master')
+
+
+def compilePolicy(keep=None):
+    """
+    the lifecycle policy for the retention of keep (DEFAULT_RETENTION
+    overridden by keep) and the retention groups it covers. classes kept at
+    0 builds can't be expressed (countNumber is at least 1) and aren't
+    compiled
+    """
+    keep = dict(retention.DEFAULT_RETENTION, **(keep or {}))
+    rules = []
+    groups = set()
+    for kind in COMPILABLE:
+        if keep[kind] < 1:
+            continue
+        rules.append({
+            "rulePriority": len(rules) + 1,
+            "description": "keep the last {0} {1} builds".format(
+                keep[kind], kind),
+            "selection": {
+                "tagStatus": "tagged",
+                "tagPrefixList": [kind + '-'],
+                "countType": "imageCountMoreThan",
+                "countNumber": keep[kind]
+            },
+            "action": {
+                "type": "expire"
+            }
+        })
+        groups.add((kind, ))
+    return {"rules": rules}, groups
+
+
+def policyText(policy):
+    return json.dumps(policy, sort_keys=True)
+
+
+def tagPattern(pattern):
+    # '*' is the only wildcard of tagPatternList
+    return re.compile('^' + '.*'.join(re.escape(p)
+                                      for p in pattern.split('*')) + '$')
+
+
+def selects(selection, tags):
+    """
+    whether a rule selection matches an image with these tags. every prefix
+    or pattern of the selection has to match one of the tags
+    """
+    status = selection.get('tagStatus', 'any')
+    if status == 'untagged':
+        return not tags
+    if status == 'tagged':
+        if not tags:
+            return False
+        for prefix in selection.get('tagPrefixList', []):
+            if not any(t.startswith(prefix) for t in tags):
+                return False
+        for pattern in selection.get('tagPatternList', []):
+            regexp = tagPattern(pattern)
+            if not any(regexp.match(t) for t in tags):
+                return False
+    return True
+
+
+def simulatePolicy(policy, images, now=None):
+    """
+    the describe_images imageDetails a lifecycle policy expires. rules are
+    applied in rulePriority order and an image selected by a rule (whether
+    it expires or not) isn't considered by the following ones
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    remaining = list(images)
+    expired = []
+    for rule in sorted(policy['rules'], key=lambda r: r['rulePriority']):
+        selection = rule['selection']
+        selected = [
+            i for i in remaining if selects(selection, i.get('imageTags', []))
+        ]
+        selectedIds = set(id(i) for i in selected)
+        remaining = [i for i in remaining if id(i) not in selectedIds]
+        if selection['countType'] == 'imageCountMoreThan':
+            selected.sort(key=lambda i: i['imagePushedAt'], reverse=True)
+            expired += selected[selection['countNumber']:]
+        else:  # sinceImagePushed, counted in days
+            limit = now - datetime.timedelta(days=selection['countNumber'])
+            expired += [i for i in selected if i['imagePushedAt'] < limit]
+    return expired
+
+
+def inventory(images):
+    # describe_images imageDetails as list_images imageIds
+    imageList = []
+    for i in images:
+        for tag in i.get('imageTags', []):
+            imageList.append({'imageTag': tag, 'imageDigest': i['imageDigest']})
+        if not i.get('imageTags'):
+            imageList.append({'imageDigest': i['imageDigest']})
+    return imageList
+
+
+def checkEquivalence(policy, groups, images, keep=None, now=None):
+    """
+    compare the tags a policy expires (every tag of an expired image goes
+    with it) with the tags deleteOldBuilds condemns in the groups the policy
+    covers. the policy is equivalent when both lists are empty
+    """
+    keep = dict(retention.DEFAULT_RETENTION, **(keep or {}))
+    expiredTags = set(
+        t for i in simulatePolicy(policy, images, now)
+        for t in i.get('imageTags', []))
+    parsed = pruneBuilds.parseInventory(inventory(images))
+    condemned = set(retention.selectOldBuilds(parsed, keep, groups=groups))
+    return {
+        "equivalent": expiredTags == condemned,
+        "onlyPolicy": sorted(expiredTags - condemned),
+        "onlyDeleteOldBuilds": sorted(condemned - expiredTags)
+    }
+
+
+def safeGroups(parsed, groups):
+    """
+    the compiled groups that can be left to ECR for a parsed inventory: those
+    whose tags all carry the rule's prefix and whose prefix selects no tag
+    of another group
+    """
+    safe = set(groups)
+    for i in parsed:
+        key = retention.groupKey(i)
+        for group in groups:
+            if (key == group) != i.tag.startswith(group[0] + '-'):
+                safe.discard(group)
+    return safe
+
+
+def describeAllImages(pb, repository):
+    """
+    describe_images of every image of a repository, through the rate
+    limiter of a PruneBuilds object
+    """
+    images = []
+    kwargs = {'repositoryName': repository, 'maxResults': 1000}
+    while True:
+        page = pb.ecrCall('describe_images', **kwargs)
+        images += page['imageDetails']
+        if not page.get('nextToken'):
+            return images
+        kwargs['nextToken'] = page['nextToken']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('repositories', nargs='+')
+    parser.add_argument(
+        '--apply',
+        action='store_true',
+        help='put the policy on every repository it is equivalent for')
+    args = parser.parse_args(argv)
+    pruneBuilds.configureLogging()
+
+    keep = retention.parseRetention(os.environ.get('RETENTION', ''))
+    policy, groups = compilePolicy(keep)
+    print(json.dumps(policy, indent=2))
+    pb = pruneBuilds.PruneBuilds(keep=keep)
+    failed = 0
+    for repository in args.repositories:
+        result = checkEquivalence(policy, groups,
+                                  describeAllImages(pb, repository), keep)
+        print(json.dumps(dict(result, repository=repository)))
+        if not result['equivalent']:
+            failed += 1
+        elif args.apply:
+            pb.ecrCall(
+                'put_lifecycle_policy',
+                repositoryName=repository,
+                lifecyclePolicyText=policyText(policy))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,221 @@
-import boto3
+import json
 import sys
 import os
 import logging
 import re
-import schedule
+import threading
 import time
-import schedule
-from datetime import datetime
-from logstash_formatter import LogstashFormatterV1
 from botocore.exceptions import ClientError
-from itertools import groupby
-import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from github import Github
+import lifecycle_policy
+import quota_planner
+import retention
+from journal import DEFAULT_MAX_AGE, readPlanFile, writePlanFile
+from records import ImageId, ParsedTag
+from rate_limiter import AdaptiveRateLimiter
+from run_metrics import RunMetrics
 
-# Setup logging for logstash
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logHandler = logging.StreamHandler(sys.stdout)
-formatter = LogstashFormatterV1()
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
 
-access_token = os.environ.get('REGISTRY_OPS_ACCESS_TOKEN', 'na')
+# botocore's default connection pool size for a client
+DEFAULT_POOL_CONNECTIONS = 10
+
+# largest page list_images returns (the API defaults to 100)
+LIST_IMAGES_PAGE_SIZE = 1000
+
+# seconds the github branches fetched by prefetchBranches are used for
+PREFETCH_TTL = 3600
+
+# ECR accepts at most 100 imageIds per batch_delete_image request
+BATCH_DELETE_SIZE = 100
+# how many times ids reported back under 'failures' are resubmitted
+BATCH_DELETE_RETRIES = 3
+# seconds to wait before the first resubmission, doubled on every retry
+BATCH_DELETE_BACKOFF = 1
+# failure codes that will not go away by resubmitting the same id
+PERMANENT_FAILURE_CODES = ('RepositoryNotFoundException', 'ImageNotFound',
+                           'InvalidImageDigest', 'InvalidImageTag',
+                           'MissingDigestAndTag',
+                           'ImageTagDoesNotMatchDigest')
+
+
+# branches PyGithub fetches per request (per_page of self.git_obj)
+GITHUB_PAGE_SIZE = 100
+# tags or digests per record of the planned and deleted images, and the most
+# records logged per list of them
+LOG_CHUNK_SIZE = 500
+LOG_MAX_CHUNKS = 10
+
+
+def configureLogging(level=logging.INFO, queued=False):
+    """
+    log to stdout for logstash. called by the entry points rather than on
+    import, so importing this module stays cheap and leaves logging alone.
+    with queued, records are formatted and written on a separate thread (see
+    queued_logging) instead of by the threads logging them
+    """
+    from logstash_formatter import LogstashFormatterV1
+    logger.setLevel(level)
+    if not any(
+            getattr(h, 'logstash', False) for h in logger.handlers):
+        logHandler = logging.StreamHandler(sys.stdout)
+        logHandler.setFormatter(LogstashFormatterV1())
+        if queued:
+            from queued_logging import queuedHandler
+            logHandler = queuedHandler(logHandler)
+        logHandler.logstash = True
+        logger.addHandler(logHandler)
+
+
+def logChunks(log, action, reason, items, chunkSize=LOG_CHUNK_SIZE,
+              maxChunks=LOG_MAX_CHUNKS):
+    """
+    log the tags or digests `action` applies to in records of up to
+    chunkSize items rather than a line per item. at most maxChunks records
+    are logged, a last one counting the items left out; PLAN_FILE has them all
+    """
+    if not items or not log.isEnabledFor(logging.INFO):
+        return
+    chunks = (len(items) + chunkSize - 1) // chunkSize
+    for n in range(0, min(chunks, maxChunks)):
+        log.info({
+            "Plan": reason,
+            "action": action,
+            "count": len(items),
+            "chunk": n + 1,
+            "chunks": chunks,
+            "items": list(items[n * chunkSize:(n + 1) * chunkSize])
+        })
+    if chunks > maxChunks:
+        log.info({
+            "Plan": reason,
+            "action": action,
+            "count": len(items),
+            "omitted": len(items) - maxChunks * chunkSize
+        })
+
+
+# tag classes produced by parseTag
+DEVELOP = 'develop'
+MASTER = 'master'
+FEATURE = 'feature'
+VERSION = 'version'
+RC = 'rc'
+
+#regex for identifying images that are not *-rc-* or versions (12.4.9)
+NON_VERSION_REGEXP = re.compile(
+    r'(c-)?(?P<branch>(?!.*rc).*)-(?P<buildNo>[0-9]+$)')
+
+# regex to identify versions only (12.4.9)
+VERSION_REGEXP = re.compile(
+    r'(c-)?(?P<major>([0-9]*))\.(?P<minor>([0-9]*))\.(?P<patch>[0-9]*$)')
+
+# regex to identify *-rc-* only
+RC_REGEXP = re.compile(
+    r'(c-)?(?P<major>([0-9]*))\.(?P<minor>([0-9]*))\.(?P<patch>([0-9]*))-rc-(?P<buildNo>[0-9]*$)'
+)
+
+#regex for dropping *-rc* and version branches when matching github branches
+GIT_BRANCH_REGEXP = re.compile(
+    r'(?P<branch>((?!.*rc)[-_A-Za-z0-9]*))-(?P<buildNo>[0-9]+$)')
+
+
+def parseTag(tag, digest=None):
+    """
+    classify an image tag once into develop/master/feature/version/rc
+    (kind is None when no pattern matches) along with its parsed fields.
+    gitKey is the name deleteClosedGitBranches compares against github
+    branches, or None for tags it ignores
+    """
+    parsed = ParsedTag(tag, digest)
+    match = NON_VERSION_REGEXP.match(tag)
+    if match:
+        branch = match.group('branch')
+        if branch == DEVELOP:
+            parsed.kind = DEVELOP
+        elif branch == MASTER:
+            parsed.kind = MASTER
+        else:
+            parsed.kind = FEATURE
+        parsed.branch = sys.intern(branch)
+        parsed.buildNo = int(match.group('buildNo'))
+    else:
+        match = VERSION_REGEXP.match(tag)
+        if match:
+            parsed.kind = VERSION
+        else:
+            match = RC_REGEXP.match(tag)
+            if match:
+                parsed.kind = RC
+                parsed.buildNo = int(match.group('buildNo'))
+        if match:
+            parsed.major = int(match.group('major'))
+            parsed.minor = int(match.group('minor'))
+            parsed.patch = int(match.group('patch'))
+
+    if GIT_BRANCH_REGEXP.match(tag):
+        #ecr image names without the build number *-[0-9]$
+        if tag.startswith('c-'):
+            parsed.gitKey = sys.intern(tag.rsplit('-', 1)[1])
+        else:
+            parsed.gitKey = sys.intern(tag.rsplit('-', 1)[0])
+    return parsed
+
+
+def parseInventory(imageList):
+    """
+    parse every tagged image of a list_images inventory (ImageId records or
+    boto's dicts) exactly once. the result is the shared view used by
+    deleteOldBuilds and deleteClosedGitBranches
+    """
+    return [
+        parseTag(i['imageTag'], i.get('imageDigest')) for i in imageList
+        if 'imageTag' in i
+    ]
+
+
+def planDeletion(parsed, tags, digests=()):
+    """
+    turn condemned tags and orphan digests into the imageIds of a single
+    deletion plan. a manifest whose tags are all condemned is deleted once
+    by digest, tags are only deleted one by one when another tag on the same
+    manifest survives. orphan digests are appended so they share batches
+    with the tags
+    """
+    tagsByDigest = {}
+    for i in parsed:
+        if i.digest is not None:
+            tagsByDigest.setdefault(i.digest, set()).add(i.tag)
+    condemned = set(tags)
+    unplanned = set(condemned)
+    imageIds = []
+    planned = set()
+    for i in parsed:
+        if i.tag not in unplanned:
+            continue
+        unplanned.discard(i.tag)
+        digest = i.digest
+        if digest is not None and tagsByDigest[digest] <= condemned:
+            if digest not in planned:
+                planned.add(digest)
+                imageIds.append({'imageDigest': digest})
+        else:
+            imageIds.append({'imageTag': i.tag})
+    # condemned tags missing from parsed can still be deleted by tag
+    imageIds += [{'imageTag': tag} for tag in tags if tag in unplanned]
+    for digest in digests:
+        if digest not in planned:
+            planned.add(digest)
+            imageIds.append({'imageDigest': digest})
+    return imageIds
+
+
+@contextmanager
+def noLease():
+    # stands in for a coordination lease when there is only one replica
+    yield True
 
 
 class PruneBuilds(object):
@@ -30,61 +223,236 @@ class PruneBuilds(object):
     Class that defines methods to clean images
     """
 
-    def __init__(self):
+    def __init__(self,
+                 workers=1,
+                 keep=None,
+                 branchCache=None,
+                 snapshots=None,
+                 streaming=False,
+                 rateLimiter=None,
+                 client=None,
+                 gitClient=None,
+                 prometheusTextfile=None,
+                 journal=None,
+                 planFile=None,
+                 lifecyclePolicy=False,
+                 imageBudget=None,
+                 logChunkSize=LOG_CHUNK_SIZE,
+                 graphqlBranches=None,
+                 coordinator=None,
+                 prefetchTtl=PREFETCH_TTL):
         """
-        initialize object with branch name to prune from
+        initialize object with branch name to prune from. workers is the
+        number of repositories cleaned concurrently by clean_images; the
+        shared ECR client gets a connection pool large enough for all of them.
+        keep overrides how many builds are kept per branch class and
+        branchCache is an optional branch_cache.BranchCache for github lookups
+        and snapshots an optional inventory_snapshot.InventorySnapshot that
+        limits deleteOldBuilds to the groups changed since the last run.
+        with streaming, repositories are planned from list_images pages as
+        they arrive instead of from a complete getAllImages list.
+        rateLimiter (a rate_limiter.AdaptiveRateLimiter, one with the default
+        rates if not given) paces and retries every ECR call. client and
+        gitClient replace the ECR and github clients, e.g. with local
+        stand-ins. every clean_images run collects a run_metrics.RunMetrics
+        in self.metrics, written to prometheusTextfile when one is given.
+        journal (a journal.DeletionJournal) checkpoints every deletion batch
+        so an interrupted run is resumed, and every run writes its plans to
+        planFile, a dry run's for review and applyPlanFile. with
+        lifecyclePolicy, the retention groups a repository's ECR lifecycle
+        policy already enforces (see lifecycle_policy) aren't evaluated here.
+        with an imageBudget, full clean_images runs end with
+        enforceImageBudget. planned and deleted tags and digests are logged
+        logChunkSize at a time (see logChunks). with graphqlBranches (a
+        github_graphql.GraphqlBranches), the github branches of the
+        repositories of a run are fetched in bulk before they are cleaned,
+        unless a prefetchBranches call fetched them less than prefetchTtl
+        seconds ago.
+        with a coordinator (a coordination.Coordinator), no delete request
+        goes out for a repository whose lease was taken over and the image
+        budget only deletes from repositories it could lease
         """
-        self.client = boto3.client('ecr')
-        self.git_obj = Github(access_token)
+        self.workers = max(1, int(workers))
+        self.keep = dict(retention.DEFAULT_RETENTION)
+        if keep:
+            self.keep.update(keep)
+        # the clients (and boto3 and PyGithub) are only set up on first use
+        self._client = client
+        self.rateLimiter = rateLimiter or AdaptiveRateLimiter()
+        self._git_obj = gitClient
+        self.branchCache = branchCache
+        self.snapshots = snapshots
+        self.streaming = streaming
+        self.prometheusTextfile = prometheusTextfile
+        self.metrics = RunMetrics()
+        self.journal = journal
+        self.planFile = planFile
+        self.plans = {}
+        # the scheduler's jobs record and write plans concurrently
+        self.plansLock = threading.Lock()
+        self.lifecyclePolicy = lifecyclePolicy
+        self.imageBudget = imageBudget
+        self.logChunkSize = max(1, int(logChunkSize))
+        self.graphqlBranches = graphqlBranches
+        # {repository: (monotonic time fetched, branches)}
+        self.prefetchedBranches = {}
+        self.prefetchTtl = prefetchTtl
+        self.coordinator = coordinator
 
-    def deleteImageByTag(self, repository, tag):
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+            # throttles are retried by self.rateLimiter, where they are counted
+            self._client = boto3.client(
+                'ecr',
+                config=Config(
+                    max_pool_connections=max(DEFAULT_POOL_CONNECTIONS,
+                                             self.workers * 2),
+                    retries={'max_attempts': 0}))
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def git_obj(self):
+        if self._git_obj is None:
+            from github import Github
+            self._git_obj = Github(
+                os.environ.get('REGISTRY_OPS_ACCESS_TOKEN', 'na'),
+                per_page=GITHUB_PAGE_SIZE)
+        return self._git_obj
+
+    @git_obj.setter
+    def git_obj(self, gitClient):
+        self._git_obj = gitClient
+
+    def ecrCall(self, operation, **kwargs):
+        """
+        call an ECR client operation through the shared rate limiter, which
+        retries throttled requests with backoff. every attempt is counted in
+        self.metrics
+        """
+        method = getattr(self.client, operation)
+        repository = kwargs.get('repositoryName')
+
+        def call(**kwargs):
+            self.metrics.countCall(repository, 'ecr', operation)
+            return method(**kwargs)
+
+        return self.rateLimiter.call(operation, call, **kwargs)
+
+    def deleteImageBatch(self, repository, imageIds):
+        """
+        send a single batch_delete_image request for at most BATCH_DELETE_SIZE
+        imageIds and return the 'imageIds' and 'failures' of the response.
+        if the request itself fails, every id in the batch is reported as a
+        failure carrying the error code. raises coordination.LeaseLost once
+        another replica took over the lease of repository
+        """
+        if self.coordinator is not None:
+            self.coordinator.checkLease(repository)
         try:
-            response = self.client.batch_delete_image(
-                repositoryName=repository, imageIds=[{
-                    'imageTag': tag
-                }])
-            return response
+            response = self.ecrCall(
+                'batch_delete_image',
+                repositoryName=repository,
+                imageIds=imageIds)
         except ClientError as e:
-            if e.response['Error']['Code'] == 'RepositoryNotFoundException':
-                print(
+            code = e.response['Error']['Code']
+            if code == 'RepositoryNotFoundException':
+                logger.error(
                     "Exception Occurred!!! Check REGISTRIES in docker-compose.yml"
                 )
             else:
-                print(e)
+                logger.error(e)
+            return {
+                "imageIds": [],
+                "failures": [{
+                    "imageId": i,
+                    "failureCode": code,
+                    "failureReason": str(e)
+                } for i in imageIds]
+            }
+        return {
+            "imageIds": response.get('imageIds', []),
+            "failures": response.get('failures', [])
+        }
 
-    def deleteImageByDigest(self, repository, digest):
-        try:
-            self.client.batch_delete_image(
-                repositoryName=repository, imageIds=[{
-                    'imageDigest': digest
-                }])
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'RepositoryNotFoundException':
-                print(
-                    "Exception Occurred!!! Check REGISTRIES value in docker-compose.yml"
-                )
-            else:
-                print(e)
+    def batchDeleteImages(self, repository, imageIds):
+        """
+        delete a list of imageIds ({'imageTag': ..} and/or {'imageDigest': ..})
+        in batches of BATCH_DELETE_SIZE. ids that come back under 'failures'
+        with a retryable failure code are resubmitted (and only those), up to
+        BATCH_DELETE_RETRIES times. returns the outcome of every batch sent
+        """
+        outcomes = []
+        pending = list(imageIds)
+        for attempt in range(BATCH_DELETE_RETRIES + 1):
+            if attempt > 0:
+                time.sleep(BATCH_DELETE_BACKOFF * 2**(attempt - 1))
+            retry = []
+            for start in range(0, len(pending), BATCH_DELETE_SIZE):
+                batch = pending[start:start + BATCH_DELETE_SIZE]
+                response = self.deleteImageBatch(repository, batch)
+                outcomes.append({
+                    "repository": repository,
+                    "batch": len(outcomes),
+                    "attempt": attempt,
+                    "requested": len(batch),
+                    "deleted": response['imageIds'],
+                    "failures": response['failures']
+                })
+                retry = retry + [
+                    f['imageId'] for f in response['failures']
+                    if f.get('failureCode') not in PERMANENT_FAILURE_CODES
+                ]
+            if not retry:
+                break
+            pending = retry
+        return outcomes
+
+    def iterImagePages(self, repository):
+        """
+        yield the imageIds of every list_images page as soon as it arrives,
+        every page request going through the rate limiter
+        """
+        kwargs = {
+            'repositoryName': repository,
+            'maxResults': LIST_IMAGES_PAGE_SIZE
+        }
+        while True:
+            page = self.ecrCall('list_images', **kwargs)
+            self.metrics.add(repository, 'pages', 1)
+            self.metrics.add(
+                repository, 'bytes',
+                int(
+                    page.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+                    .get('content-length', 0)))
+            yield page['imageIds']
+            if not page.get('nextToken'):
+                break
+            kwargs['nextToken'] = page['nextToken']
 
     def getAllImages(self, repository):
         """
-        using the paginator to return all the images
+        using the paginator to return all the images, as ImageId records so
+        that boto's dicts only live as long as their page
         """
         try:
-            paginator = self.client.get_paginator('list_images')
-            page_iterator = paginator.paginate(repositoryName=repository)
             images = []
-            for page in page_iterator:
-                for image in page['imageIds']:
-                    images.append(image)
+            for page in self.iterImagePages(repository):
+                images += [ImageId.fromApi(i) for i in page]
             return images
         except ClientError as e:
             if e.response['Error']['Code'] == 'RepositoryNotFoundException':
-                print(
+                logger.error(
                     "Exception Occurred!!! Check REGISTRIES in docker-compose.yml"
                 )
             else:
-                print(e)
+                logger.error(e)
 
     def filterNoTags(self, imageList):
         has_tags = []
@@ -98,238 +466,174 @@ class PruneBuilds(object):
         """
         take an image tag in the format branch-buildNo, and split them out with a regexp
         """
-        splitImages = {}
-
-        #regex for identifying images that are not *-rc-* or versions (12.4.9)
-        nonVersionRegexp = re.compile(
-            r'(c-)?(?P<branch>(?!.*rc).*)-(?P<buildNo>[0-9]+$)')
-
-        # regex to identify versions only (12.4.9)
-        versionRegexp = re.compile(
-            r'(c-)?(?P<major>([0-9]*))\.(?P<minor>([0-9]*))\.(?P<patch>([0-9]*)+$)')
-
-        # regex to identify *-rc-* only
-        rcRegexp = re.compile(
-            r'(c-)?(?P<major>([0-9]*))\.(?P<minor>([0-9]*))\.(?P<patch>([0-9]*))-rc-(?P<buildNo>([0-9]*)+$)'
-        )
-
-        nonVersion_match = nonVersionRegexp.match(tag)
-        version_match = versionRegexp.match(tag)
-        rc_match = rcRegexp.match(tag)
-
-
-        if nonVersion_match:
-            return {
-                "tag": tag,
-                "branch": nonVersion_match.group('branch'),
-                "buildNo": int(nonVersion_match.group('buildNo'))
-            }
-        elif version_match:
-            return {
-                "tag": tag,
-                "major": int(version_match.group('major')),
-                "minor": int(version_match.group('minor')),
-                "patch": int(version_match.group('patch'))
-            }
-        elif rc_match:
-            return {
-                "tag": tag,
-                "major": int(rc_match.group('major')),
-                "minor": int(rc_match.group('minor')),
-                "patch": int(rc_match.group('patch')),
-                "buildNo": int(rc_match.group('buildNo'))
-            }
-        else:
+        parsed = parseTag(tag)
+        if parsed.kind is None:
             return None
+        return parsed
 
-    def deleteOldBuilds(self, imageList):
+    def deleteOldBuilds(self, imageList, parsed=None, groups=None):
         """
-        Given a list of images, keep images based on the following criteria:
+        Given a list of images (or its parseInventory view), keep images based
+        on the following criteria:
         - last 10 images for 'develop' branch
         - last 10 images for 'master' branch
-        - last 2 images for 'feature' branch e.g. pid-543
+        - last image for every 'feature' branch e.g. pid-543
         - last 3 verions builds for both 'rc' and 'versions' i.e. if current release is 12.7.6, 
           we keep 12.7.\*, 12.6.\* and 12.5.\* and discard the rest.
+        the number of builds kept per branch class comes from self.keep.
+        groups limits the evaluation to those retention groups
         """
-        onlyTagged = self.filterNoTags(imageList)
-        # we're only concerned with the tags, drop the digests
-        onlyTagged = [i['imageTag'] for i in onlyTagged]
-        splitImages = [
-            self.splitBranchBuild(i) for i in onlyTagged
-            if self.splitBranchBuild(i) is not None
-        ]
-
-        splitImages_develop = []
-        splitImages_master = []
-        splitImages_feature = []
-        splitImages_version = []
-        splitImages_rc = []
-
-        for i in splitImages:
-            try:
-                if 'branch' in i:
-                    if i['branch'] == 'develop':
-                        splitImages_develop.append(i)
-                    elif i['branch'] == 'master':
-                        splitImages_master.append(i)
-                    else:
-                        splitImages_feature.append(i)
-                else:
-                    if 'buildNo' in i:
-                        splitImages_rc.append(i)
-                    else:
-                        splitImages_version.append(i)
-            except Exception as e:
-                print(e)
-
-        toDeleteOutput_develop = []
-        toDeleteOutput_master = []
-        toDeleteOutput_feature = []
-        toDeleteOutput_version = []
-        toDeleteOutput_rc = []
-
-        #list to maintain individual feature branch's builds count
-        splitImages_feature_branches = []
-
-        if len(splitImages_develop) <= 10:
-            # If there are 10 or less we don't need to do anything
-            toDeleteOutput_develop = []
-        if len(splitImages_develop) > 10:
-            # otherwise order them by latest, send back a list of tags to delete
-            splitImages_develop.sort(key=lambda x: x['buildNo'], reverse=True)
-            toDelete = splitImages_develop[10:]
-            toDeleteOutput_develop = toDeleteOutput_develop + [
-                i['tag'] for i in toDelete
-            ]
-
-        if len(splitImages_master) <= 10:
-            # If there are 10 or less we don't need to do anything
-            toDeleteOutput_master = []
-        if len(splitImages_master) > 10:
-            # otherwise order them by latest, send back a list of tags to delete
-            splitImages_master.sort(key=lambda x: x['buildNo'], reverse=True)
-            toDelete = splitImages_master[10:]
-            toDeleteOutput_master = [i['tag'] for i in toDelete]
-
-        if len(splitImages_feature) <= 1:
-            # If there is 1 image or less we don't need to do anything
-            toDeleteOutput_feature = []
-        if len(splitImages_feature) > 1:
-            # otherwise order them by latest, send back a list of tags to delete
-            for key, group in groupby(splitImages_feature,
-                                      lambda item: item['branch']):
-                splitImages_feature_branches.append(key)
-            splitImages_feature.sort(key=lambda x: x['buildNo'], reverse=True)
-            for i in splitImages_feature_branches:
-                featureBranch = [
-                    k['branch'] for k in splitImages_feature
-                    if k['branch'] == i
-                ]
-                if len(featureBranch) <= 1:
-                    pass
-                else:
-                    toDelete_feature = [
-                        item for item in splitImages_feature
-                        if item['branch'] == i
-                    ]
-                    toDelete = toDelete_feature[1:]
-                    temp = [item['tag'] for item in toDelete]
-                    toDeleteOutput_feature = toDeleteOutput_feature + temp
-
-        # handle version (12.6.2) and RC (12.8.0-rc-2) builds
-        if len(splitImages_version) > 1 and len(splitImages_rc) > 1:
-            splitImages_version.sort(
-                key=lambda x: (x['major'], x['minor'], x['patch']),
-                reverse=True)
-            # new logic to handle new versioning to follow <year>-<month>-<build_number> and
-            # <year>-<month>-<build_number>-rc-<build>
-            todays_date = datetime.datetime.today().strftime('%y-%m-%d')
-            latest_major_ver = int(todays_date.split('-')[0])
-            latest_minor_ver = int(todays_date.split('-')[1])
-            for i in splitImages_version:
-                if latest_minor_ver >= 3:
-                    if i['major'] < latest_major_ver or i['minor'] < (
-                            latest_minor_ver - 2):
-                        toDeleteOutput_version.append(i['tag'])
-                elif latest_minor_ver == 2:
-                    if i['major'] < latest_major_ver and i['minor'] < 12:
-                        toDeleteOutput_version.append(i['tag'])
-                else: #latest_minor_ver == 1
-                    if i['major'] < latest_major_ver and i['minor'] < 11:
-                        toDeleteOutput_version.append(i['tag'])
-
-            # handle release candidate **-rc-** builds
-            # new logic to handle new versioning to follow <year>-<month>-<build_number> and
-            # <year>-<month>-<build_number>-rc-<build>
-            splitImages_rc.sort(
-                key=lambda x: (x['major'], x['minor'], x['patch']),
-                reverse=True)
-            for i in splitImages_rc:
-                if latest_minor_ver >= 3:
-                    if i['major'] < latest_major_ver or i['minor'] < (
-                            latest_minor_ver - 2):
-                        toDeleteOutput_version.append(i['tag'])
-                elif latest_minor_ver == 2:
-                    if i['major'] < latest_major_ver and i['minor'] < 12:
-                        toDeleteOutput_version.append(i['tag'])
-                else: #latest_minor_ver == 1
-                    if i['major'] < latest_major_ver and i['minor'] < 11:
-                        toDeleteOutput_version.append(i['tag'])
-
-        toDeleteOutput = toDeleteOutput_develop + toDeleteOutput_master + toDeleteOutput_feature + toDeleteOutput_version + toDeleteOutput_rc
+        if parsed is None:
+            parsed = parseInventory(imageList)
+        toDeleteOutput = retention.selectOldBuilds(
+            parsed, self.keep, groups=groups)
         return {"Reason": "Old-builds", "ImageTags": toDeleteOutput}
 
     def getGitRepoBranches(self, REPOSITORY):
+        """
+        lower cased names of the github branches of REPOSITORY, through
+        self.branchCache when one is configured. returns None when github
+        can't be reached
+        """
+        import requests
+        from github import GithubException
+        prefetched = self.prefetched(REPOSITORY)
+        if prefetched is not None:
+            return prefetched
         try:
+            if self.branchCache is not None:
+                return self.branchCache.getBranches(
+                    REPOSITORY.strip('\''), lambda: self.metrics.countCall(
+                        REPOSITORY, 'github', 'get_branches'))
             git_repo_obj = self.git_obj.get_repo(REPOSITORY.strip('\''))
+            self.metrics.countCall(REPOSITORY, 'github', 'get_repo')
             git_repo_branches_obj = git_repo_obj.get_branches()
             git_branches = []
             for branch in git_repo_branches_obj:
                 git_branches.append(branch.name.lower())
+            # PyGithub fetches the branches a page at a time
+            self.metrics.countCall(
+                REPOSITORY, 'github', 'get_branches',
+                max(1, -(-len(git_branches) // GITHUB_PAGE_SIZE)))
             return git_branches
-        except Error as e:
-            print(e)
-
-    def deleteClosedGitBranches(self, REPOSITORY, imageList, gitBranches):
-        """
-        method to identify closed github branches in a  repository
-        """
-        #regex for dropping *-rc* and version branches
-        branchRegexp = re.compile(
-            r'(?P<branch>((?!.*rc)[-_A-Za-z0-9]*))-(?P<buildNo>[0-9]+$)')
-        onlyTagged = self.filterNoTags(imageList)
-        imageTags = [i['imageTag'] for i in onlyTagged]
-        #create a list to consider feature branch tags that are not version numbers or *-rc*
-        featureBranchTags = []
-        for tag in imageTags:
-            if branchRegexp.match(tag):
-                featureBranchTags.append(tag)
+        except (GithubException, requests.RequestException) as e:
+            logging.LoggerAdapter(logger, {
+                'repository': REPOSITORY
+            }).warning("Could not list the github branches of {0}: {1}".format(
+                REPOSITORY, e))
+
+    def prefetchBranches(self, repositories, refresh=False):
+        """
+        fetch the github branches of repositories with bulk GraphQL queries
+        for getGitRepoBranches, all of them with refresh and otherwise those
+        not fetched within prefetchTtl. the ones that can't be fetched this
+        way are left to its REST lookup
+        """
+        if self.graphqlBranches is None:
+            return
+        if not refresh:
+            repositories = [
+                r for r in repositories if self.prefetched(r) is None
+            ]
+        if not repositories:
+            return
+        for repository in repositories:
+            self.prefetchedBranches.pop(repository, None)
+        try:
+            branches = self.graphqlBranches.fetch(repositories)
+        except Exception:
+            # besides network errors, a payload not shaped like the query
+            # expects fails with KeyError or TypeError, the REST lookup
+            # stays available either way
+            logger.exception("Could not fetch github branches with GraphQL")
+            return
+        fetched = time.monotonic()
+        self.prefetchedBranches.update(
+            (repository, (fetched, names))
+            for repository, names in branches.items())
+
+    def prefetched(self, REPOSITORY):
+        """
+        the branches prefetchBranches fetched for REPOSITORY less than
+        prefetchTtl seconds ago, None if there are none
+        """
+        entry = self.prefetchedBranches.get(REPOSITORY)
+        if entry is None or time.monotonic() - entry[0] >= self.prefetchTtl:
+            return None
+        return entry[1]
+
+    def deleteClosedGitBranches(self,
+                                REPOSITORY,
+                                imageList,
+                                gitBranches,
+                                parsed=None):
+        """
+        method to identify closed github branches in a  repository. parsed is
+        the parseInventory view of imageList when the caller already has it
+        """
+        if parsed is None:
+            parsed = parseInventory(imageList)
         #ecr_image_set contains unique set of image tags without the build number *-[0-9]$
-        ecr_images_set = []
-        for image in featureBranchTags:
-            if image.startswith('c-'):
-                ecr_images_set.append(image.rsplit('-', 1)[1])
-            else:
-                ecr_images_set.append(image.rsplit('-', 1)[0])
-        ecr_images_set = set(ecr_images_set)
-        unmatched = list(set(ecr_images_set).difference(set(gitBranches)))
+        ecr_images_set = set(
+            [i.gitKey for i in parsed if i.gitKey is not None])
+        unmatched = ecr_images_set.difference(set(gitBranches))
+        #inverted index of closed branch -> tags, a tag is listed under the
+        #name before its last '-' and under the part after it
+        closedBranchIndex = dict((branch, []) for branch in unmatched)
+        for i in parsed:
+            head, sep, tail = i.tag.rpartition('-')
+            if not sep:
+                head, tail = tail, None
+            if head in closedBranchIndex:
+                closedBranchIndex[head].append(i.tag)
+            if tail != head and tail in closedBranchIndex:
+                closedBranchIndex[tail].append(i.tag)
         git_closed_branch_tags = []
-        for branch in unmatched:
-            for tag in onlyTagged:
-                if tag['imageTag'].rsplit('-', 1)[0] == branch or tag['imageTag'].rsplit('-', 1)[1] == branch:
-                    git_closed_branch_tags.append(tag['imageTag'])
+        for branch in sorted(unmatched):
+            git_closed_branch_tags += closedBranchIndex[branch]
         return {
             "Reason": "ClosedGitBranches",
             "ImageTags": git_closed_branch_tags
         }
 
+    def streamInventory(self, repository, onOrphans=None, flush=True):
+        """
+        list a repository page by page, parsing tagged images and collecting
+        untagged digests as each page arrives, so boto's page is the only
+        per-image dict held at any time. when onOrphans is given it is called
+        with every BATCH_DELETE_SIZE untagged digests (and, with flush, the
+        remainder at the end) while listing continues.
+        returns the parseInventory view, the orphan digests and the number
+        of images listed
+        """
+        parsed = []
+        orphans = []
+        pending = []
+        count = 0
+        for page in self.iterImagePages(repository):
+            count += len(page)
+            for image in page:
+                if 'imageTag' in image:
+                    parsed.append(
+                        parseTag(image['imageTag'], image.get('imageDigest')))
+                else:
+                    orphans.append(image['imageDigest'])
+                    pending.append(image['imageDigest'])
+            if onOrphans is not None and len(pending) >= BATCH_DELETE_SIZE:
+                ready = len(pending) - len(pending) % BATCH_DELETE_SIZE
+                onOrphans(pending[:ready])
+                pending = pending[ready:]
+        if onOrphans is not None and flush and pending:
+            onOrphans(pending)
+        return parsed, orphans, count
+
     def getOrphans(self, imageList):
         """
         Given a list of images, identify the ones without Tags (orphans)
         """
         images_to_delete = []
         if len(imageList) == 0:
-            return {"Reason": "ImageNoTag", "Images": []}
+            return {"Reason": "ImageNoTag", "ImageDigests": []}
         else:
             for image in imageList:
                 try:
@@ -338,78 +642,551 @@ class PruneBuilds(object):
                     images_to_delete.append(image['imageDigest'])
             return {"Reason": "ImageNoTag", "ImageDigests": images_to_delete}
 
-    def clean_images(self):
+    def clean_images(self, repositories=None):
+        """
+        clean the REGISTRIES repositories, or only the given ones when
+        called by the scheduler for a single repository. such partial runs
+        keep the metrics and plans of the other repositories, are timed and
+        summarized on their own and only resume the interrupted plans of
+        their repositories
+        """
         try:
             DELETE = int(os.environ.get("DELETE_IMAGES"))
         except:
             logger.critical("Invalid value for DELETE_IMAGES")
             sys.exit(1)
 
-        toScan = os.environ.get("REGISTRIES").split(',')
+        if repositories is not None:
+            toScan = list(repositories)
+            for REPOSITORY in toScan:
+                self.metrics.start(REPOSITORY)
+                with self.plansLock:
+                    self.plans.pop(REPOSITORY, None)
+            if DELETE == 1:
+                self.resumeInterrupted(toScan)
+        else:
+            toScan = os.environ.get("REGISTRIES").split(',')
 
-        if len(toScan) < 1:
-            logger.critical("Invalid registries")
-            sys.exit(1)
+            if len(toScan) < 1:
+                logger.critical("Invalid registries")
+                sys.exit(1)
 
-        for REPOSITORY in toScan:
-            toDeleteTags = []
-            images = self.getAllImages(REPOSITORY)
-            logger.info(
-                "There are {0} images in {1}".format(len(images), REPOSITORY))
+            self.metrics = RunMetrics()
+            with self.plansLock:
+                self.plans = {}
+            if DELETE == 1:
+                self.resumeInterrupted()
 
-            #deleteClosedGitBranches
-            logger.info(
-                "Now looking at closed github branches detected by deleteClosedGitBranches"
-            )
-            gitBranches = self.getGitRepoBranches(REPOSITORY)
-            gitBranchResult = self.deleteClosedGitBranches(
-                REPOSITORY, images, gitBranches)
-            toDeleteTags = toDeleteTags + [
-                i for i in gitBranchResult['ImageTags']
+        # the scheduler's jobs use the branches its prefetch job fetched for
+        # every repository of the round
+        self.prefetchBranches(toScan, refresh=repositories is None)
+        if self.workers <= 1:
+            results = [
+                self.safeCleanRepository(REPOSITORY, DELETE)
+                for REPOSITORY in toScan
             ]
-            logger.info(gitBranchResult)
-            if int(DELETE) == 0:
-                for tag in toDeleteTags:
-                    logger.info(
-                        "Would have deleted {0}/{1} identified by deleteClosedGitBranches".
-                        format(REPOSITORY, tag))
-
-            #deleteOldBuilds
-            logger.info("Now looking at images identified by deleteOldBuilds")
-            imagesResult = self.deleteOldBuilds(images)
-            toDeleteTags = toDeleteTags + [
-                i for i in imagesResult['ImageTags']
-            ]
-            toDeleteTags = list(set(toDeleteTags))
-            logger.info(imagesResult)
-
-            if (DELETE) == 0:
-                for tag in imagesResult['ImageTags']:
-                    logger.info(
-                        "Would have deleted {0}/{1} identified by deleteOldBuilds".
-                        format(REPOSITORY, tag))
-
-            #Now proceeding to delete images if DELETE flag is set
-            if (DELETE) == 1:
-                logger.info(
-                    "Now deleting images identified by deleteOldBuilds & deleteClosedGitBranches"
-                )
-                for tag in toDeleteTags:
-                    logger.info(
-                        "Deleting {0}/{1} identifiled by deleteOldBuilds or deleteClosedGitBranches".
-                        format(REPOSITORY, tag))
-                    result = self.deleteImageByTag(REPOSITORY, tag)
-
-            #Orphan Digests
-            logger.info("Now looking at images identified by getOrphans")
-            orphanResult = self.getOrphans(images)
-            logger.info(orphanResult['ImageDigests'])
-            for digest in orphanResult['ImageDigests']:
-                if int(DELETE) == 1:
-                    logger.info("Deleting {0}/{1} identified by getOrphans".
-                                format(REPOSITORY, digest))
-                    result = self.deleteImageByDigest(REPOSITORY, digest)
-                else:
-                    logger.info(
-                        "Would have deleted {0}/{1} identified by getOrphans".
-                        format(REPOSITORY, digest))
+        else:
+            logger.info("Scanning {0} repositories with {1} workers".format(
+                len(toScan), self.workers))
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(
+                    executor.map(
+                        lambda REPOSITORY: self.safeCleanRepository(REPOSITORY, DELETE),
+                        toScan))
+
+        if self.imageBudget is not None and repositories is None:
+            try:
+                self.enforceImageBudget(toScan, DELETE)
+            except Exception:
+                logger.exception("Failed to enforce the image budget")
+
+        if self.branchCache is not None:
+            self.branchCache.save()
+        # the branch cache, GraphQL and rate limiter counters are shared by
+        # the scheduler's concurrent partial runs, which only report their
+        # repositories' own calls (in self.metrics)
+        if repositories is None:
+            if self.branchCache is not None:
+                logger.info(self.branchCache.stats())
+                self.branchCache.resetStats()
+            if self.graphqlBranches is not None:
+                logger.info(self.graphqlBranches.stats())
+            logger.info({"EcrCalls": self.rateLimiter.stats()})
+        if self.planFile:
+            with self.plansLock:
+                writePlanFile(self.planFile, dict(self.plans))
+                count = len(self.plans)
+            logger.info("Wrote the plans of {0} repositories to {1}".format(
+                count, self.planFile))
+        logger.info(self.metrics.runSummary(repositories))
+        if self.prometheusTextfile:
+            try:
+                self.metrics.writePrometheus(self.prometheusTextfile,
+                                             repositories)
+            except OSError as e:
+                logger.error("Could not write {0}: {1}".format(
+                    self.prometheusTextfile, e))
+        return results
+
+    def safeCleanRepository(self, REPOSITORY, DELETE):
+        """
+        run cleanRepository, making sure one failing repository doesn't stop
+        the others from being pruned
+        """
+        try:
+            return self.cleanRepository(REPOSITORY, DELETE)
+        except Exception as e:
+            logging.LoggerAdapter(logger, {
+                'repository': REPOSITORY
+            }).exception("Failed to clean {0}".format(REPOSITORY))
+            return {"repository": REPOSITORY, "error": str(e)}
+
+    def cleanRepository(self, REPOSITORY, DELETE):
+        """
+        list, plan and (if DELETE is 1) prune a single repository. every log
+        record carries the repository name so that interleaved output from
+        concurrent workers stays attributable. the listing, github, planning
+        and deletes phases are timed in self.metrics
+        """
+        log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+        result = {"repository": REPOSITORY, "deleted": 0, "failures": 0}
+        metrics = self.metrics
+
+        toDeleteTags = []
+        if self.streaming:
+            # the orphans go out with the rest of the plan, so the journal
+            # and the plan file have every delete of the run
+            with metrics.phase(REPOSITORY, 'listing'):
+                parsed, orphanDigests, imageCount = self.streamInventory(
+                    REPOSITORY)
+            # the snapshot gets the same inventory as a full listing, orphans
+            # included
+            images = [ImageId(i.tag, i.digest) for i in parsed] + [
+                ImageId(None, d) for d in orphanDigests
+            ] if self.snapshots is not None else None
+        else:
+            with metrics.phase(REPOSITORY, 'listing'):
+                images = self.getAllImages(REPOSITORY)
+            with metrics.phase(REPOSITORY, 'planning'):
+                parsed = parseInventory(images)
+                orphanDigests = self.getOrphans(images)['ImageDigests']
+            imageCount = len(images)
+        log.info(
+            "There are {0} images in {1}".format(imageCount, REPOSITORY))
+        result['images'] = imageCount
+        metrics.add(REPOSITORY, 'images', imageCount)
+
+        #deleteClosedGitBranches
+        log.info(
+            "Now looking at closed github branches detected by deleteClosedGitBranches"
+        )
+        with metrics.phase(REPOSITORY, 'github'):
+            gitBranches = self.getGitRepoBranches(REPOSITORY)
+        if gitBranches is None:
+            log.warning(
+                "Could not list github branches of {0}, skipping deleteClosedGitBranches".
+                format(REPOSITORY))
+            gitBranchResult = {"Reason": "ClosedGitBranches", "ImageTags": []}
+        else:
+            with metrics.phase(REPOSITORY, 'planning'):
+                gitBranchResult = self.deleteClosedGitBranches(
+                    REPOSITORY, images, gitBranches, parsed)
+        toDeleteTags = toDeleteTags + [
+            i for i in gitBranchResult['ImageTags']
+        ]
+        action = 'delete' if int(DELETE) == 1 else 'would delete'
+        logChunks(log, action, 'deleteClosedGitBranches',
+                  gitBranchResult['ImageTags'], self.logChunkSize)
+
+        #deleteOldBuilds
+        log.info("Now looking at images identified by deleteOldBuilds")
+        groups = None
+        with metrics.phase(REPOSITORY, 'planning'):
+            if int(DELETE) == 1:
+                groups = self.changedGroups(REPOSITORY, images, parsed, log)
+            imagesResult = self.deleteOldBuilds(
+                images, parsed,
+                self.withoutServerSideGroups(REPOSITORY, parsed, groups, log))
+        toDeleteTags = toDeleteTags + [
+            i for i in imagesResult['ImageTags']
+        ]
+        toDeleteTags = list(set(toDeleteTags))
+        result['condemned'] = len(toDeleteTags)
+        logChunks(log, action, 'deleteOldBuilds', imagesResult['ImageTags'],
+                  self.logChunkSize)
+
+        #Orphan Digests
+        log.info("Now looking at images identified by getOrphans")
+        result['orphans'] = len(orphanDigests)
+        metrics.add(REPOSITORY, 'planned',
+                    len(toDeleteTags) + len(orphanDigests))
+        logChunks(log, action, 'getOrphans', orphanDigests, self.logChunkSize)
+
+        #tags and orphans in one plan
+        with metrics.phase(REPOSITORY, 'planning'):
+            plan = planDeletion(parsed, toDeleteTags, orphanDigests)
+        log.info("{0} tags and {1} orphans go out as {2} imageIds".format(
+            len(toDeleteTags), len(orphanDigests), len(plan)))
+        with self.plansLock:
+            self.plans[REPOSITORY] = {
+                'condemned': sorted(toDeleteTags),
+                'orphans': orphanDigests,
+                'imageIds': plan
+            }
+
+        #Now proceeding to delete images if DELETE flag is set
+        if int(DELETE) == 1:
+            log.info(
+                "Now deleting images identified by deleteOldBuilds, deleteClosedGitBranches & getOrphans"
+            )
+            with metrics.phase(REPOSITORY, 'deletes'):
+                outcomes = self.executePlan(REPOSITORY, plan)
+            self.recordOutcomes(result, outcomes, log)
+        metrics.add(REPOSITORY, 'deleted', result['deleted'])
+
+        if self.snapshots is not None and int(DELETE) == 1:
+            # condemned images are left out of the snapshot whether or not
+            # their deletion succeeded, anything that survived shows up as
+            # added on the next run and gets its group re-evaluated
+            self.snapshots.save(
+                REPOSITORY,
+                self.remainingImages(images, toDeleteTags, orphanDigests),
+                fullScan=groups is None,
+                keep=self.keep)
+
+        log.info(result)
+        log.info(metrics.repositorySummary(REPOSITORY))
+        return result
+
+    def executePlan(self, REPOSITORY, imageIds):
+        """
+        delete the imageIds of a plan. with a journal the plan is recorded
+        before the first request and every batch checkpointed once done.
+        returns the batch outcomes
+        """
+        if self.journal is None:
+            return self.batchDeleteImages(REPOSITORY, imageIds)
+        return self.runJournalBatches(
+            REPOSITORY, self.journal.record(REPOSITORY, imageIds))
+
+    def runJournalBatches(self, REPOSITORY, batches):
+        outcomes = []
+        for batch, imageIds in batches:
+            batchOutcomes = self.batchDeleteImages(REPOSITORY, imageIds)
+            for outcome in batchOutcomes:
+                outcome['batch'] = batch
+            outcomes += batchOutcomes
+            self.journal.complete(REPOSITORY, batch)
+        self.journal.finish(REPOSITORY)
+        return outcomes
+
+    def resumeInterrupted(self, repositories=None):
+        """
+        finish the journaled plans a previous run didn't get to complete, of
+        every repository or only of the given ones
+        """
+        if self.journal is None:
+            return
+        for REPOSITORY in self.journal.interrupted():
+            if repositories is not None and REPOSITORY not in repositories:
+                continue
+            log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+            batches = self.journal.pending(REPOSITORY)
+            log.info(
+                "Resuming the interrupted plan of {0}, {1} batches left".
+                format(REPOSITORY, len(batches)))
+            self.logBatchOutcomes(
+                self.runJournalBatches(REPOSITORY, batches), log)
+
+    def applyPlanFile(self, path):
+        """
+        delete exactly the imageIds of a dry run's plan file as it was
+        reviewed, without listing or planning again. plan files older than
+        the journal's maxAge (a day without a journal) are refused. with a
+        coordinator, only the repositories this replica is assigned and can
+        lease are applied, the others are reported as skipped
+        """
+        maxAge = DEFAULT_MAX_AGE
+        if self.journal is not None:
+            maxAge = self.journal.maxAge
+        plans = readPlanFile(path, maxAge=maxAge)
+        self.metrics = RunMetrics()
+        results = []
+        for REPOSITORY, imageIds in sorted(plans.items()):
+            if self.coordinator is None:
+                result = self.applyPlan(REPOSITORY, imageIds, path)
+            else:
+                result = self.coordinator.run(
+                    REPOSITORY, lambda: self.applyPlan(REPOSITORY, imageIds,
+                                                       path))
+            if result is None:
+                logging.LoggerAdapter(logger, {
+                    'repository': REPOSITORY
+                }).warning("Skipping the plan of {0}, it is another replica's".
+                           format(REPOSITORY))
+                result = {
+                    "repository": REPOSITORY,
+                    "deleted": 0,
+                    "failures": 0,
+                    "planned": len(imageIds),
+                    "skipped": True
+                }
+            results.append(result)
+        logger.info(self.metrics.runSummary())
+        return results
+
+    def applyPlan(self, REPOSITORY, imageIds, path):
+        log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+        result = {
+            "repository": REPOSITORY,
+            "deleted": 0,
+            "failures": 0,
+            "planned": len(imageIds)
+        }
+        log.info("Applying {0} imageIds of {1} from {2}".format(
+            len(imageIds), REPOSITORY, path))
+        with self.metrics.phase(REPOSITORY, 'deletes'):
+            outcomes = self.executePlan(REPOSITORY, imageIds)
+        self.recordOutcomes(result, outcomes, log)
+        self.metrics.add(REPOSITORY, 'planned', len(imageIds))
+        self.metrics.add(REPOSITORY, 'deleted', result['deleted'])
+        log.info(result)
+        return result
+
+    def enforceImageBudget(self, repositories, DELETE):
+        """
+        list every repository and delete (or, on a dry run, add to the plans)
+        the images quota_planner picks to bring them down to
+        self.imageBudget. on a dry run the images the repositories' own plans
+        already condemn don't count
+        """
+        inventories = {}
+        for REPOSITORY in repositories:
+            parsed, orphans, count = self.streamInventory(REPOSITORY)
+            with self.plansLock:
+                repositoryPlan = self.plans.get(REPOSITORY)
+            if DELETE == 0 and repositoryPlan is not None:
+                condemned = set(repositoryPlan['condemned'])
+                parsed = [i for i in parsed if i.tag not in condemned]
+                orphans = []
+            inventories[REPOSITORY] = (parsed, orphans)
+        plan, total = quota_planner.planQuota(inventories, self.imageBudget)
+        summary = {
+            "images": total,
+            "budget": self.imageBudget,
+            "planned": len(plan),
+            "deleted": 0,
+            "failures": 0
+        }
+        if total - len(plan) > self.imageBudget:
+            logger.warning(
+                "Only {0} of the {1} images over the budget of {2} can be deleted".
+                format(len(plan), total - self.imageBudget, self.imageBudget))
+        # the batches of a repository go out together, under its lease
+        toDelete = {}
+        for REPOSITORY, imageIds in quota_planner.batches(
+                plan, BATCH_DELETE_SIZE):
+            log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+            logChunks(log, 'delete' if DELETE == 1 else 'would delete',
+                      'imageBudget',
+                      [list(imageId.values())[0] for imageId in imageIds],
+                      self.logChunkSize)
+            with self.plansLock:
+                repositoryPlan = self.plans.setdefault(
+                    REPOSITORY, {
+                        'condemned': [],
+                        'orphans': [],
+                        'imageIds': []
+                    })
+                repositoryPlan['imageIds'] = (
+                    repositoryPlan['imageIds'] + imageIds)
+            if DELETE == 1:
+                toDelete.setdefault(REPOSITORY, []).append(imageIds)
+        for REPOSITORY in sorted(toDelete):
+            log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+            with self.lease(REPOSITORY) as acquired:
+                if not acquired:
+                    log.warning(
+                        "Skipping the image budget deletes of {0}, another replica holds its lease".
+                        format(REPOSITORY))
+                    continue
+                for imageIds in toDelete[REPOSITORY]:
+                    log.info(
+                        "Deleting {0} images of {1} to stay within the image budget".
+                        format(len(imageIds), REPOSITORY))
+                    self.recordOutcomes(summary,
+                                        self.executePlan(REPOSITORY, imageIds),
+                                        log)
+        logger.info({"ImageBudget": summary})
+        return summary
+
+    def lease(self, REPOSITORY):
+        """
+        the coordinator's lease of REPOSITORY for a with block, yielding
+        whether it was acquired (always without a coordinator)
+        """
+        if self.coordinator is None:
+            return noLease()
+        return self.coordinator.lease(REPOSITORY)
+
+    def prunePushed(self, REPOSITORY, tags, DELETE):
+        """
+        re-evaluate the deleteOldBuilds rules for the retention groups of
+        tags just pushed to REPOSITORY only, and prune them if DELETE is 1.
+        closed branches and orphans are left to the scheduled runs. raises
+        when REPOSITORY can't be listed, so its pushes aren't acknowledged
+        """
+        log = logging.LoggerAdapter(logger, {'repository': REPOSITORY})
+        result = {
+            "repository": REPOSITORY,
+            "pushed": len(tags),
+            "deleted": 0,
+            "failures": 0
+        }
+        with self.metrics.phase(REPOSITORY, 'listing'):
+            images = self.getAllImages(REPOSITORY)
+        if images is None:
+            raise ValueError("Could not list {0}".format(REPOSITORY))
+        with self.metrics.phase(REPOSITORY, 'planning'):
+            parsed = parseInventory(images)
+            groups = retention.affectedGroups(
+                parsed, [parseTag(tag) for tag in tags], [])
+            toDeleteTags = self.deleteOldBuilds(
+                images, parsed,
+                self.withoutServerSideGroups(REPOSITORY, parsed, groups,
+                                             log))['ImageTags']
+            plan = planDeletion(parsed, toDeleteTags)
+        result['images'] = len(images)
+        result['condemned'] = len(toDeleteTags)
+        log.info("{0} pushed to {1}, re-evaluating {2} groups".format(
+            ', '.join(tags), REPOSITORY, len(groups)))
+        if int(DELETE) == 1:
+            with self.metrics.phase(REPOSITORY, 'deletes'):
+                outcomes = self.executePlan(REPOSITORY, plan)
+            self.recordOutcomes(result, outcomes, log)
+        else:
+            logChunks(log, 'would delete', 'deleteOldBuilds', toDeleteTags,
+                      self.logChunkSize)
+        log.info(result)
+        return result
+
+    def serverSideGroups(self, REPOSITORY, parsed, log=logger):
+        """
+        retention groups ECR expires itself for REPOSITORY: the ones of the
+        compiled lifecycle policy if that is the policy installed on the
+        repository, its tags don't trip the policy's prefixes and, simulated
+        on the pushed order of its images, it expires what deleteOldBuilds
+        condemns. whatever can't be checked is evaluated here
+        """
+        if not self.lifecyclePolicy:
+            return set()
+        policy, groups = lifecycle_policy.compilePolicy(self.keep)
+        try:
+            installed = self.ecrCall(
+                'get_lifecycle_policy',
+                repositoryName=REPOSITORY)['lifecyclePolicyText']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'LifecyclePolicyNotFoundException':
+                log.warning(
+                    "{0} has no lifecycle policy, evaluating every group".
+                    format(REPOSITORY))
+            else:
+                log.warning(
+                    "Could not read the lifecycle policy of {0}, evaluating every group: {1}".
+                    format(REPOSITORY, e))
+            return set()
+        if json.loads(installed) != policy:
+            log.warning(
+                "The lifecycle policy of {0} isn't the compiled one, evaluating every group".
+                format(REPOSITORY))
+            return set()
+        safe = lifecycle_policy.safeGroups(parsed, groups)
+        if safe != groups:
+            log.warning(
+                "Tags of {0} don't fit the lifecycle policy prefixes, evaluating {1} here".
+                format(REPOSITORY, sorted(g[0] for g in groups - safe)))
+        if not safe:
+            return safe
+        # the policy counts images by push time, deleteOldBuilds by build
+        # number: a rebuilt or re-pushed old build sets them apart
+        try:
+            details = lifecycle_policy.describeAllImages(self, REPOSITORY)
+        except ClientError as e:
+            log.warning(
+                "Could not describe the images of {0}, evaluating every group: {1}".
+                format(REPOSITORY, e))
+            return set()
+        check = lifecycle_policy.checkEquivalence(policy, safe, details,
+                                                  self.keep)
+        if not check['equivalent']:
+            log.warning(
+                "The lifecycle policy of {0} expires {1} tags deleteOldBuilds keeps and keeps {2} it condemns, evaluating every group".
+                format(REPOSITORY, len(check['onlyPolicy']),
+                       len(check['onlyDeleteOldBuilds'])))
+            return set()
+        return safe
+
+    def withoutServerSideGroups(self, REPOSITORY, parsed, groups, log=logger):
+        """
+        the retention groups to evaluate (None for all) once the ones left to
+        the lifecycle policy are taken out
+        """
+        serverSide = self.serverSideGroups(REPOSITORY, parsed, log)
+        if not serverSide:
+            return groups
+        if groups is None:
+            groups = set(retention.groupKey(i) for i in parsed)
+        return set(groups) - serverSide
+
+    def changedGroups(self, REPOSITORY, images, parsed, log=logger):
+        """
+        retention groups to re-evaluate for REPOSITORY: None (all of them)
+        without snapshots or when a full scan is due, otherwise the groups
+        touched by the images added or removed since the previous run
+        """
+        if self.snapshots is None:
+            return None
+        if self.snapshots.needsFullScan(REPOSITORY, keep=self.keep):
+            log.info("Full rescan of {0}".format(REPOSITORY))
+            return None
+        added, removed = self.snapshots.diff(REPOSITORY, images)
+        groups = retention.affectedGroups(parsed, parseInventory(added),
+                                          parseInventory(removed))
+        log.info(
+            "{0} images added to and {1} removed from {2} since the last run, re-evaluating {3} groups".
+            format(len(added), len(removed), REPOSITORY, len(groups)))
+        return groups
+
+    def remainingImages(self, images, tags, digests):
+        """
+        images of a listing once the given tags and digests are removed
+        """
+        tags = set(tags)
+        digests = set(digests)
+        return [
+            i for i in images if i.get('imageTag') not in tags
+            and i.get('imageDigest') not in digests
+        ]
+
+    def recordOutcomes(self, result, outcomes, log=logger):
+        """
+        add the batch outcomes to a repository result and log them
+        """
+        result['deleted'] += sum(len(o['deleted']) for o in outcomes)
+        result['failures'] += sum(len(o['failures']) for o in outcomes)
+        self.logBatchOutcomes(outcomes, log)
+
+    def logBatchOutcomes(self, outcomes, log=logger):
+        """
+        log one line per batch_delete_image request, plus every failure
+        """
+        for outcome in outcomes:
+            log.info(
+                "Batch {0} (attempt {1}) on {2}: deleted {3} of {4} images, {5} failures".
+                format(outcome['batch'], outcome['attempt'],
+                       outcome['repository'], len(outcome['deleted']),
+                       outcome['requested'], len(outcome['failures'])))
+            for failure in outcome['failures']:
+                log.warning("Failed to delete {0}/{1}: {2} {3}".format(
+                    outcome['repository'], failure.get('imageId'),
+                    failure.get('failureCode'), failure.get('failureReason')))
@@ -0,0 +1,156 @@
+"""
+One-shot command line for planning and applying the pruning of a single
+repository, for cron jobs and CI.
+
+    python prune_cli.py plan --inventory images.json [--branches branches.json]
+    python prune_cli.py plan --repository org/a --output plan.json
+    python prune_cli.py apply plan.json
+    python prune_cli.py orphans --repository org/a
+
+An inventory file holds list_images imageIds, as a list or as a page
+({"imageIds": [...]}), and --repository then only names the plan; a
+branches file holds the list of open github branches.
+Planning from files touches neither ECR nor github, so boto3 and PyGithub are
+never imported and the command starts in tens of milliseconds. plan writes
+the plan file format of PLAN_FILE, which apply deletes as is.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import pruneBuilds
+import retention
+from journal import writePlanFile
+
+logger = logging.getLogger()
+
+# name of the plan of an inventory file given without --repository
+INVENTORY_REPOSITORY = 'inventory'
+
+
+def readJson(path):
+    if path == '-':
+        return json.load(sys.stdin)
+    with open(path) as f:
+        return json.load(f)
+
+
+def readInventory(path):
+    content = readJson(path)
+    if isinstance(content, dict):
+        content = content.get('imageIds')
+    if not isinstance(content, list):
+        raise ValueError("{0} holds no imageIds".format(path))
+    return content
+
+
+def planInventory(pb, repository, images, gitBranches=None):
+    """
+    the dry run plan of a repository from its listing: tags of closed
+    github branches (when gitBranches is given) and old builds, plus orphans
+    """
+    parsed = pruneBuilds.parseInventory(images)
+    condemned = set(pb.deleteOldBuilds(images, parsed)['ImageTags'])
+    if gitBranches is not None:
+        condemned.update(
+            pb.deleteClosedGitBranches(repository, images, gitBranches,
+                                       parsed)['ImageTags'])
+    orphans = pb.getOrphans(images)['ImageDigests']
+    return {
+        'condemned': sorted(condemned),
+        'orphans': orphans,
+        'imageIds': pruneBuilds.planDeletion(parsed, condemned, orphans)
+    }
+
+
+def listing(pb, args):
+    """
+    the repository name and listing the command works on
+    """
+    if not args.inventory and not args.repository:
+        raise ValueError("Either --repository or --inventory is needed")
+    if args.inventory:
+        return args.repository or INVENTORY_REPOSITORY, readInventory(
+            args.inventory)
+    images = pb.getAllImages(args.repository)
+    if images is None:
+        raise ValueError("Could not list {0}".format(args.repository))
+    return args.repository, images
+
+
+def plan(pb, args):
+    repository, images = listing(pb, args)
+    gitBranches = None
+    if args.branches:
+        gitBranches = [b.lower() for b in readJson(args.branches)]
+    elif not args.inventory and not args.no_github:
+        gitBranches = pb.getGitRepoBranches(repository)
+    plans = {repository: planInventory(pb, repository, images, gitBranches)}
+    if args.output:
+        writePlanFile(args.output, plans)
+    else:
+        json.dump({'repositories': plans}, sys.stdout, indent=2,
+                  sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
+
+
+def orphans(pb, args):
+    repository, images = listing(pb, args)
+    json.dump(pb.getOrphans(images)['ImageDigests'], sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+def apply(pb, args):
+    results = pb.applyPlanFile(args.plan)
+    return 1 if any(r['failures'] for r in results) else 0
+
+
+def parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    planCommand = commands.add_parser(
+        'plan', help='print or write the plan of a repository')
+    planCommand.set_defaults(fn=plan)
+    planCommand.add_argument(
+        '--branches', help='read the open github branches from a file')
+    planCommand.add_argument(
+        '--no-github',
+        action='store_true',
+        help="don't look for closed github branches")
+    planCommand.add_argument('--output', help='write the plan to this file')
+
+    orphansCommand = commands.add_parser(
+        'orphans', help='print the untagged images of a repository')
+    orphansCommand.set_defaults(fn=orphans)
+
+    for command in (planCommand, orphansCommand):
+        command.add_argument('--repository', help='the ECR repository')
+        command.add_argument(
+            '--inventory', help='read list_images imageIds from this file')
+
+    applyCommand = commands.add_parser(
+        'apply', help='delete the imageIds of a plan file')
+    applyCommand.set_defaults(fn=apply)
+    applyCommand.add_argument('plan')
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    pruneBuilds.configureLogging(logging.WARNING)
+    try:
+        keep = retention.parseRetention(os.environ.get('RETENTION', ''))
+        return args.fn(pruneBuilds.PruneBuilds(keep=keep), args)
+    except (OSError, ValueError) as e:
+        logger.critical(e)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+import functools
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger()
+
+# seconds a repository's pushes are collected before it is pruned, so a
+# burst of pushes costs one listing
+DEFAULT_COALESCE_WINDOW = 5
+# longest an SQS receive_message call may wait for messages
+MAX_WAIT = 20
+
+
+def parseEvent(body):
+    """
+    (repository, tag, digest) of a successful ECR image push event as
+    EventBridge delivers it (possibly wrapped in an SNS notification), None
+    for any other message
+    """
+    try:
+        event = json.loads(body)
+        if 'Message' in event and 'detail' not in event:
+            event = json.loads(event['Message'])
+        detail = event['detail']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(detail, dict) or detail.get(
+            'action-type') != 'PUSH' or detail.get('result') != 'SUCCESS':
+        return None
+    if not detail.get('repository-name') or not detail.get('image-tag'):
+        return None
+    return (detail['repository-name'], detail['image-tag'],
+            detail.get('image-digest'))
+
+
+class FileQueue(object):
+    """
+    Local stand-in for an SQS queue: one message per line of a file that
+    other processes append to. The offset up to which every message has
+    been acknowledged is remembered in path + '.offset': a message that
+    isn't acknowledged holds it back, so it and the messages after it are
+    delivered again after a restart
+    """
+
+    def __init__(self, path, sleep=time.sleep):
+        self.path = path
+        self.sleep = sleep
+        self.offsetPath = path + '.offset'
+        self.committed = 0
+        if os.path.exists(self.offsetPath):
+            with open(self.offsetPath) as f:
+                self.committed = int(f.read() or 0)
+        self.position = self.committed
+        # handles (end offsets) of the messages read but not committed yet,
+        # in file order, and the acknowledged ones among them
+        self.unacked = []
+        self.acked = set()
+
+    def receive(self, maxMessages=10, wait=0):
+        """
+        up to maxMessages (handle, body) pairs, waiting up to `wait` seconds
+        when there are none
+        """
+        messages = self.read(maxMessages)
+        if not messages and wait:
+            self.sleep(min(wait, 1))
+            messages = self.read(maxMessages)
+        return messages
+
+    def read(self, maxMessages):
+        if not os.path.exists(self.path):
+            return []
+        messages = []
+        with open(self.path) as f:
+            f.seek(self.position)
+            while len(messages) < maxMessages:
+                line = f.readline()
+                # a line without its newline is still being written
+                if not line.endswith('\n'):
+                    break
+                self.position = f.tell()
+                self.unacked.append(self.position)
+                if line.strip():
+                    messages.append((self.position, line))
+                else:
+                    self.acked.add(self.position)
+        return messages
+
+    def delete(self, handles):
+        self.acked.update(handles)
+        committed = self.committed
+        while self.unacked and self.unacked[0] in self.acked:
+            committed = self.unacked.pop(0)
+            self.acked.discard(committed)
+        if committed == self.committed:
+            return
+        self.committed = committed
+        tmpPath = self.offsetPath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(str(self.committed))
+        os.replace(tmpPath, self.offsetPath)
+
+
+class SqsQueue(object):
+    """
+    SQS queue receiving the ECR push events of an EventBridge rule, read
+    with long polling
+    """
+
+    def __init__(self, url, client=None):
+        self.url = url
+        if client is None:
+            import boto3
+            client = boto3.client('sqs')
+        self.client = client
+
+    def receive(self, maxMessages=10, wait=MAX_WAIT):
+        response = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=min(10, maxMessages),
+            WaitTimeSeconds=int(min(MAX_WAIT, math.ceil(wait))))
+        return [(m['ReceiptHandle'], m['Body'])
+                for m in response.get('Messages', [])]
+
+    def delete(self, handles):
+        handles = list(handles)
+        for start in range(0, len(handles), 10):
+            self.client.delete_message_batch(
+                QueueUrl=self.url,
+                Entries=[{
+                    'Id': str(n),
+                    'ReceiptHandle': handle
+                } for n, handle in enumerate(handles[start:start + 10])])
+
+
+def openQueue(value):
+    """
+    the queue PUSH_EVENT_QUEUE names: an SQS queue url or a local file
+    """
+    if value.startswith('https://'):
+        return SqsQueue(value)
+    return FileQueue(value)
+
+
+class PushConsumer(object):
+    """
+    Consumes ECR push events and prunes the pushed repositories.
+
+    Pushes are coalesced per repository for `window` seconds after the
+    first one, then PruneBuilds.prunePushed re-evaluates only the retention
+    groups of the pushed tags. Messages are acknowledged once their
+    repository has been pruned, so a failed prune is delivered again.
+    Events of repositories outside `repositories` are dropped. With a
+    coordinator (a coordination.Coordinator), a repository is only pruned
+    by the replica it is assigned to, under its lease; the events another
+    replica should prune stay unacknowledged for it to receive them.
+    """
+
+    def __init__(self,
+                 pb,
+                 queue,
+                 DELETE,
+                 repositories=None,
+                 window=DEFAULT_COALESCE_WINDOW,
+                 clock=time.monotonic,
+                 coordinator=None):
+        self.pb = pb
+        self.queue = queue
+        self.DELETE = DELETE
+        self.repositories = set(repositories) if repositories else None
+        self.window = window
+        self.clock = clock
+        self.coordinator = coordinator
+        self.pending = {}
+        self.stopped = False
+
+    def poll(self):
+        """
+        receive one batch of messages and prune the repositories whose
+        coalescing window is over. returns the prune results
+        """
+        wait = MAX_WAIT
+        if self.pending:
+            first = min(p['first'] for p in self.pending.values())
+            wait = max(0, first + self.window - self.clock())
+        ignored = []
+        for handle, body in self.queue.receive(10, wait):
+            event = parseEvent(body)
+            if event is None or (self.repositories is not None
+                                 and event[0] not in self.repositories):
+                ignored.append(handle)
+                continue
+            repository, tag, digest = event
+            entry = self.pending.setdefault(repository, {
+                'first': self.clock(),
+                'tags': set(),
+                'handles': []
+            })
+            entry['tags'].add(tag)
+            entry['handles'].append(handle)
+        self.queue.delete(ignored)
+        return self.flush()
+
+    def flush(self, force=False):
+        results = []
+        now = self.clock()
+        for repository in sorted(self.pending):
+            entry = self.pending[repository]
+            if not force and now - entry['first'] < self.window:
+                continue
+            del self.pending[repository]
+            prune = functools.partial(self.pb.prunePushed, repository,
+                                      sorted(entry['tags']), self.DELETE)
+            try:
+                if self.coordinator is None:
+                    result = prune()
+                else:
+                    result = self.coordinator.run(repository, prune)
+            except Exception:
+                logging.LoggerAdapter(logger, {
+                    'repository': repository
+                }).exception("Failed to prune pushes to {0}".format(
+                    repository))
+                continue
+            if result is None:
+                # another replica prunes repository
+                continue
+            results.append(result)
+            self.queue.delete(entry['handles'])
+        return results
+
+    def run(self):
+        """
+        consume events until stop is called
+        """
+        while not self.stopped:
+            self.poll()
+        self.flush(force=True)
+
+    def stop(self):
+        self.stopped = True
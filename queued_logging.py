@@ -0,0 +1,47 @@
+"""
+Logging through a queue, so the threads that log only enqueue their records
+and a listener thread formats (LogstashFormatterV1 serializes every record
+to JSON) and writes them.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+class DictQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves dict messages for the listener's formatter
+    instead of formatting them into strings like the stock prepare() does.
+    they are copied, as the caller may change them once logged
+    """
+
+    def prepare(self, record):
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        elif record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def close(self):
+        """
+        stop the listener, once it has written every queued record
+        """
+        listener, self.listener = getattr(self, 'listener', None), None
+        if listener is not None:
+            listener.stop()
+        logging.handlers.QueueHandler.close(self)
+
+
+def queuedHandler(handler):
+    """
+    a handler that passes the records to `handler` on a listener thread. the
+    records still queued are written when it is closed, at the latest at exit
+    """
+    records = queue.Queue()
+    queueHandler = DictQueueHandler(records)
+    queueHandler.listener = logging.handlers.QueueListener(records, handler)
+    queueHandler.listener.start()
+    atexit.register(queueHandler.close)
+    return queueHandler
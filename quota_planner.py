@@ -0,0 +1,131 @@
+"""
+Plan the deletions that keep a whole fleet of repositories under an
+account-wide image budget.
+
+The per-repository retention rules don't know how many images the other
+repositories hold. This planner sees every repository's inventory at once
+and, when the fleet is over budget, picks the fewest and least valuable
+images to remove: untagged images first, then builds by how far they are
+from the newest build of their retention group (so every group is trimmed
+evenly rather than one repository being emptied), the branch class breaking
+ties. The newest build of every group and tags retention doesn't classify
+are never planned.
+
+Deleting an image removes all of its tags, so images are counted and
+planned by digest.
+"""
+import heapq
+
+import retention
+
+# image budget when none is configured
+DEFAULT_IMAGE_BUDGET = 1000
+# branch classes, the cheapest to lose first
+CLASS_ORDER = {'feature': 0, 'rc': 1, 'version': 2, 'develop': 3, 'master': 4}
+# tiers of the cost keys
+ORPHAN = 0
+BUILD = 1
+
+
+def recency(parsedTag):
+    # a version line orders its releases by patch, an rc coming before the
+    # release it leads to
+    if parsedTag.kind in ('version', 'rc'):
+        return (parsedTag.patch, parsedTag.buildNo
+                if parsedTag.buildNo is not None else float('inf'))
+    return (parsedTag.buildNo, )
+
+
+def buildRanks(parsed):
+    """
+    rank of every build in its retention group, 0 being the newest. ties go
+    to the earlier tag like they do in retention.olderThanNewest
+    """
+    groups = {}
+    for i in parsed:
+        key = retention.groupKey(i)
+        if key is not None:
+            groups.setdefault(key, []).append(i)
+    ranks = {}
+    for builds in groups.values():
+        builds.sort(key=recency, reverse=True)
+        for rank, i in enumerate(builds):
+            ranks[id(i)] = rank
+    return ranks
+
+
+def imageCosts(parsed, orphans=()):
+    """
+    (cost key, imageId) of every image of a repository that may be deleted,
+    cheapest first, and the number of images the repository holds. an image
+    with several tags costs as much as its most valuable tag and is kept if
+    any of them is protected
+    """
+    ranks = buildRanks(parsed)
+    images = {}
+    for i in parsed:
+        # tags pushed without a digest (stand-ins) are images of their own
+        key = i.digest if i.digest is not None else (None, i.tag)
+        rank = ranks.get(id(i))
+        cost = None if rank in (None, 0) else (BUILD, -rank,
+                                               CLASS_ORDER[i.kind], i.tag)
+        if cost is None or (key in images and images[key] is None):
+            images[key] = None
+        else:
+            images[key] = max(images.get(key, cost), cost)
+    costs = [((ORPHAN, 0, 0, digest), {'imageDigest': digest})
+             for digest in orphans]
+    for key, cost in images.items():
+        if cost is None:
+            continue
+        if isinstance(key, tuple):
+            costs.append((cost, {'imageTag': key[1]}))
+        else:
+            costs.append((cost, {'imageDigest': key}))
+    costs.sort(key=lambda c: c[0])
+    return costs, len(images) + len(orphans)
+
+
+def planQuota(inventories, budget=DEFAULT_IMAGE_BUDGET):
+    """
+    the imageIds to delete to bring the fleet down to `budget` images, as
+    an ordered list of (repository, imageId), cheapest first across
+    repositories. inventories maps every repository to its parsed tags and
+    orphan digests. returns the plan and the number of images in the fleet;
+    the plan is short of the excess when too few images may be deleted
+    """
+    queues = []
+    total = 0
+    for repository in sorted(inventories):
+        parsed, orphans = inventories[repository]
+        costs, count = imageCosts(parsed, orphans)
+        total += count
+        queues.append([(cost, repository, imageId)
+                       for cost, imageId in costs])
+    excess = total - budget
+    plan = []
+    if excess <= 0:
+        return plan, total
+    # one priority queue over the already sorted repository queues
+    for cost, repository, imageId in heapq.merge(
+            *queues, key=lambda c: (c[0], c[1])):
+        plan.append((repository, imageId))
+        if len(plan) == excess:
+            break
+    return plan, total
+
+
+def batches(plan, size):
+    """
+    split an ordered plan into (repository, imageIds) batches of up to size
+    imageIds. a batch goes out when it is full, the partial ones at the end
+    in the order their first imageId was planned
+    """
+    pending = {}
+    for repository, imageId in plan:
+        batch = pending.setdefault(repository, [])
+        batch.append(imageId)
+        if len(batch) == size:
+            yield repository, pending.pop(repository)
+    for repository, batch in pending.items():
+        yield repository, batch
@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# error codes ECR answers with when we're calling it too fast
+THROTTLING_CODES = ('ThrottlingException', 'Throttling',
+                    'TooManyRequestsException', 'RequestLimitExceeded')
+# server side errors that are worth another try
+TRANSIENT_CODES = ('ServerException', 'InternalFailure', 'InternalError',
+                   'ServiceUnavailable', 'ServiceUnavailableException')
+
+# requests per second allowed by default for every ECR operation
+DEFAULT_RATE = 10
+DEFAULT_RATES = {
+    'list_images': 20,
+    'describe_images': 10,
+    'batch_delete_image': 10
+}
+
+
+def parseRates(value):
+    """
+    parse an ECR_RATE_LIMITS setting such as
+    'list_images=10,batch_delete_image=5' into requests per second per
+    operation, on top of DEFAULT_RATES
+    """
+    rates = dict(DEFAULT_RATES)
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        operation, _, rate = item.partition('=')
+        try:
+            rates[operation.strip()] = float(rate)
+        except ValueError:
+            raise ValueError("Invalid rate limit '{0}'".format(item))
+        if rates[operation.strip()] <= 0:
+            raise ValueError("Invalid rate limit '{0}'".format(item))
+    return rates
+
+
+class TokenBucket(object):
+    """
+    thread safe token bucket refilled at `rate` tokens per second, holding
+    at most `burst` tokens
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.maxRate = rate
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        take a token and return how long the caller has to wait before it
+        may use it. tokens can go negative, which queues callers in order
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def throttled(self, factor=0.5, minRate=0.1):
+        # multiplicative decrease on every throttle response
+        with self.lock:
+            self.rate = max(minRate, self.rate * factor)
+
+    def succeeded(self, step=0.1):
+        # additive increase back up to the configured rate
+        with self.lock:
+            self.rate = min(self.maxRate, self.rate + step)
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Client side rate limiter and retry scheduler shared by every ECR call of
+    a PruneBuilds object.
+
+    Every operation gets its own token bucket, whose rate is halved on every
+    throttle response and slowly raised back to the configured rate on
+    success. Throttled and transient errors are retried with exponential
+    backoff and full jitter, up to maxRetries times.
+    """
+
+    def __init__(self,
+                 rates=None,
+                 maxRetries=6,
+                 baseDelay=0.5,
+                 maxDelay=30,
+                 sleep=time.sleep):
+        self.rates = dict(DEFAULT_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.sleep = sleep
+        self.buckets = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, operation):
+        with self.lock:
+            if operation not in self.buckets:
+                self.buckets[operation] = TokenBucket(
+                    self.rates.get(operation, DEFAULT_RATE))
+                self.counts[operation] = {
+                    'calls': 0,
+                    'throttles': 0,
+                    'retries': 0
+                }
+            return self.buckets[operation]
+
+    def count(self, operation, key):
+        with self.lock:
+            self.counts[operation][key] += 1
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.maxDelay,
+                                     self.baseDelay * 2**attempt))
+
+    def call(self, operation, fn, **kwargs):
+        """
+        call fn(**kwargs) once a token for operation is available, retrying
+        throttled and transient failures
+        """
+        bucket = self.bucket(operation)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait > 0:
+                self.sleep(wait)
+            self.count(operation, 'calls')
+            try:
+                response = fn(**kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code in THROTTLING_CODES:
+                    self.count(operation, 'throttles')
+                    bucket.throttled()
+                elif code not in TRANSIENT_CODES:
+                    raise
+                if attempt >= self.maxRetries:
+                    raise
+            except (ConnectionError, HTTPClientError):
+                if attempt >= self.maxRetries:
+                    raise
+            else:
+                bucket.succeeded()
+                return response
+            self.count(operation, 'retries')
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def stats(self):
+        """
+        calls, throttles, retries and current rate of every operation
+        """
+        with self.lock:
+            stats = {}
+            for operation, counts in self.counts.items():
+                stats[operation] = dict(counts)
+                stats[operation]['rate'] = round(
+                    self.buckets[operation].rate, 2)
+            return stats
@@ -0,0 +1,128 @@
+"""
+Compact records for the images of a listing and their parsed tags.
+
+A repository can hold a million images, and the planners keep every one of
+them in memory twice: as listed and parsed. A dict costs a few hundred bytes
+before its values, so both are __slots__ classes instead, and the strings
+repeated across builds (branch names, github keys) are interned so every
+build of a branch shares one copy.
+"""
+import sys
+
+
+class ImageId(object):
+    """
+    an image of a list_images listing: its tag (None when untagged) and its
+    digest. it reads like the imageId dict it replaces (image['imageTag'],
+    image.get('imageDigest'), 'imageTag' in image), so code written against
+    boto's dicts takes either
+    """
+    __slots__ = ('tag', 'digest')
+
+    KEYS = {'imageTag': 'tag', 'imageDigest': 'digest'}
+
+    def __init__(self, tag=None, digest=None):
+        self.tag = tag
+        self.digest = digest
+
+    @classmethod
+    def fromApi(cls, imageId):
+        return cls(imageId.get('imageTag'), imageId.get('imageDigest'))
+
+    def asApi(self):
+        """
+        the imageId dict ECR requests take
+        """
+        return dict((key, getattr(self, name))
+                    for key, name in self.KEYS.items()
+                    if getattr(self, name) is not None)
+
+    def __getitem__(self, key):
+        value = getattr(self, self.KEYS[key])
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        name = self.KEYS.get(key)
+        value = getattr(self, name) if name is not None else None
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key in self.KEYS and getattr(self, self.KEYS[key]) is not None
+
+    def keys(self):
+        return self.asApi().keys()
+
+    def __eq__(self, other):
+        if isinstance(other, ImageId):
+            return (self.tag, self.digest) == (other.tag, other.digest)
+        if isinstance(other, dict):
+            return self.asApi() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash((self.tag, self.digest))
+
+    def __repr__(self):
+        return 'ImageId({0!r}, {1!r})'.format(self.tag, self.digest)
+
+
+class ParsedTag(object):
+    """
+    an image tag classified by parseTag. kind is develop, master, feature,
+    version, rc or None; branch and buildNo are set for develop, master and
+    feature builds, major/minor/patch for versions and rc's (which have a
+    buildNo too). gitKey is the name deleteClosedGitBranches compares
+    against github branches. it reads like the dict parseTag used to return
+    (parsed['branch'], parsed.get('buildNo'), 'major' in parsed): tag,
+    digest, kind and gitKey are always there, the other fields only when set
+    """
+    __slots__ = ('tag', 'digest', 'kind', 'gitKey', 'branch', 'buildNo',
+                 'major', 'minor', 'patch')
+
+    ALWAYS = ('tag', 'digest', 'kind', 'gitKey')
+
+    def __init__(self,
+                 tag,
+                 digest=None,
+                 kind=None,
+                 gitKey=None,
+                 branch=None,
+                 buildNo=None,
+                 major=None,
+                 minor=None,
+                 patch=None):
+        self.tag = tag
+        self.digest = digest
+        self.kind = kind
+        self.gitKey = sys.intern(gitKey) if gitKey is not None else None
+        self.branch = sys.intern(branch) if branch is not None else None
+        self.buildNo = buildNo
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+    def __contains__(self, key):
+        return key in self.ALWAYS or (key in self.__slots__
+                                      and getattr(self, key) is not None)
+
+    def keys(self):
+        return [name for name in self.__slots__ if name in self]
+
+    def __repr__(self):
+        return 'ParsedTag({0})'.format(', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__ if getattr(self, name) is not None))
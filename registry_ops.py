@@ -1,11 +1,21 @@
+import atexit
 import sys
 import os
-import schedule
-import time
+import threading
 from datetime import datetime
 import pruneBuilds
+import retention
+from branch_cache import BranchCache
+from rate_limiter import AdaptiveRateLimiter, parseRates
+from inventory_snapshot import InventorySnapshot, DEFAULT_FULL_SCAN_INTERVAL
+from journal import DeletionJournal
+from scheduler import Scheduler, DEFAULT_INTERVAL, parseIntervals
+from push_events import PushConsumer, DEFAULT_COALESCE_WINDOW, openQueue
+from coordination import Coordinator, LeaseStore, DEFAULT_LEASE_TTL
+from pruneBuilds import LOG_CHUNK_SIZE, PREFETCH_TTL
 import logging
-from logstash_formatter import LogstashFormatterV1
+
+logger = logging.getLogger()
 
 
 def checkenv():
@@ -36,16 +46,196 @@ def checkenv():
         logger.critical("REGISTRY_OPS_ACCESS_TOKEN is not defined")
         sys.exit(1)
 
+    if os.environ.get('APPLY_PLAN') and os.environ['DELETE_IMAGES'] != '1':
+        logger.critical("APPLY_PLAN only deletes with DELETE_IMAGES=1")
+        sys.exit(1)
+
+    workers = os.environ.get('REPOSITORY_WORKERS', '1')
+    if not workers.isdigit() or int(workers) == 0:
+        logger.critical("REPOSITORY_WORKERS must be a positive number")
+        sys.exit(1)
+
+    for name in ('SCHEDULE_STAGGER', 'SCHEDULE_JITTER',
+                 'PUSH_COALESCE_WINDOW'):
+        if not os.environ.get(name, '0').isdigit():
+            logger.critical("{0} must be a number of seconds".format(name))
+            sys.exit(1)
+
+    if not os.environ.get('IMAGE_BUDGET', '0').isdigit():
+        logger.critical("IMAGE_BUDGET must be a number of images")
+        sys.exit(1)
+
+    chunkSize = os.environ.get('LOG_CHUNK_SIZE', str(LOG_CHUNK_SIZE))
+    if not chunkSize.isdigit() or int(chunkSize) == 0:
+        logger.critical("LOG_CHUNK_SIZE must be a positive number")
+        sys.exit(1)
+
+    interval = os.environ.get('SCHEDULE_INTERVAL', str(DEFAULT_INTERVAL))
+    if not interval.isdigit() or int(interval) == 0:
+        logger.critical("SCHEDULE_INTERVAL must be a positive number of seconds")
+        sys.exit(1)
+
+    ttl = os.environ.get('LEASE_TTL', str(DEFAULT_LEASE_TTL))
+    if not ttl.isdigit() or int(ttl) == 0:
+        logger.critical("LEASE_TTL must be a positive number of seconds")
+        sys.exit(1)
+
+    prefetchTtl = os.environ.get('GITHUB_PREFETCH_TTL', str(PREFETCH_TTL))
+    if not prefetchTtl.isdigit() or int(prefetchTtl) == 0:
+        logger.critical(
+            "GITHUB_PREFETCH_TTL must be a positive number of seconds")
+        sys.exit(1)
+
+    try:
+        retention.parseRetention(os.environ.get('RETENTION', ''))
+        parseRates(os.environ.get('ECR_RATE_LIMITS', ''))
+        parseIntervals(os.environ.get('REPOSITORY_INTERVALS', ''))
+    except ValueError as e:
+        logger.critical(e)
+        sys.exit(1)
+
 
 def main():
+    pruneBuilds.configureLogging(
+        queued=os.environ.get('LOG_QUEUE', '0') == '1')
     checkenv()
 
-    pb = pruneBuilds.PruneBuilds()
-    pb.clean_images()
-    schedule.every().day.at('01:00').do(pb.clean_images)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    branchCache = None
+    if os.environ.get('BRANCH_CACHE_PATH'):
+        branchCache = BranchCache(
+            os.environ['BRANCH_CACHE_PATH'],
+            os.environ['REGISTRY_OPS_ACCESS_TOKEN'],
+            ttl=int(os.environ.get('BRANCH_CACHE_TTL', '3600')),
+            maxEntries=int(os.environ.get('BRANCH_CACHE_MAX_ENTRIES', '1000')))
+
+    snapshots = None
+    if os.environ.get('INVENTORY_SNAPSHOT_PATH'):
+        snapshots = InventorySnapshot(
+            os.environ['INVENTORY_SNAPSHOT_PATH'],
+            fullScanInterval=int(
+                os.environ.get('FULL_RESCAN_INTERVAL',
+                               str(DEFAULT_FULL_SCAN_INTERVAL))),
+            fullScan=os.environ.get('FULL_RESCAN', '0') == '1')
+
+    graphqlBranches = None
+    if os.environ.get('GITHUB_GRAPHQL', '0') == '1':
+        from github_graphql import GraphqlBranches
+        graphqlBranches = GraphqlBranches(
+            os.environ['REGISTRY_OPS_ACCESS_TOKEN'])
+
+    journal = None
+    if os.environ.get('JOURNAL_PATH'):
+        journal = DeletionJournal(os.environ['JOURNAL_PATH'])
+
+    coordinator = None
+    if os.environ.get('COORDINATION_PATH'):
+        coordinator = Coordinator(
+            LeaseStore(os.environ['COORDINATION_PATH']),
+            replica=os.environ.get('REPLICA_ID'),
+            ttl=int(os.environ.get('LEASE_TTL', str(DEFAULT_LEASE_TTL))))
+
+    pb = pruneBuilds.PruneBuilds(
+        workers=int(os.environ.get('REPOSITORY_WORKERS', '1')),
+        keep=retention.parseRetention(os.environ.get('RETENTION', '')),
+        branchCache=branchCache,
+        snapshots=snapshots,
+        streaming=os.environ.get('STREAM_INVENTORY', '0') == '1',
+        rateLimiter=AdaptiveRateLimiter(
+            parseRates(os.environ.get('ECR_RATE_LIMITS', ''))),
+        prometheusTextfile=os.environ.get('PROMETHEUS_TEXTFILE'),
+        journal=journal,
+        planFile=os.environ.get('PLAN_FILE'),
+        lifecyclePolicy=os.environ.get('LIFECYCLE_POLICY', '0') == '1',
+        imageBudget=int(os.environ['IMAGE_BUDGET'])
+        if os.environ.get('IMAGE_BUDGET') else None,
+        logChunkSize=int(
+            os.environ.get('LOG_CHUNK_SIZE', str(LOG_CHUNK_SIZE))),
+        graphqlBranches=graphqlBranches,
+        coordinator=coordinator,
+        prefetchTtl=int(
+            os.environ.get('GITHUB_PREFETCH_TTL', str(PREFETCH_TTL))))
+    if os.environ.get('APPLY_PLAN'):
+        # with several replicas, each applies the repositories it is
+        # assigned, under their leases
+        if coordinator is not None:
+            atexit.register(coordinator.leave)
+        try:
+            pb.applyPlanFile(os.environ['APPLY_PLAN'])
+        except ValueError as e:
+            logger.critical(e)
+            sys.exit(1)
+        return
+
+    # every repository is cleaned at its own interval, the first runs are
+    # spread out so they don't all hit ECR at once. a repository's
+    # interrupted plan is resumed by its own job, under its lease
+    repositories = os.environ['REGISTRIES'].split(',')
+    interval = int(os.environ.get('SCHEDULE_INTERVAL', str(DEFAULT_INTERVAL)))
+    stagger = int(os.environ.get('SCHEDULE_STAGGER', '60'))
+    scheduler = Scheduler(workers=pb.workers)
+
+    # with several replicas, every one of them only runs the jobs of the
+    # repositories it is assigned and holds the lease of
+    if coordinator is not None:
+        coordinator.heartbeat()
+        atexit.register(coordinator.leave)
+        scheduler.add('heartbeat', coordinator.heartbeat,
+                      interval=coordinator.ttl / 3.0,
+                      delay=coordinator.ttl / 3.0)
+
+    def coordinated(name, fn):
+        if coordinator is None:
+            return fn
+        return lambda: coordinator.run(name, fn)
+
+    # the branches of every repository are fetched with a few bulk queries
+    # ahead of their jobs, which use them as long as they are fresh
+    if pb.graphqlBranches is not None:
+
+        def prefetch():
+            pb.prefetchBranches(
+                [r for r in repositories
+                 if coordinator is None or coordinator.assigned(r)],
+                refresh=True)
+
+        scheduler.add('github-branches', prefetch, interval=pb.prefetchTtl)
+
+    scheduler.addStaggered(
+        [(REPOSITORY,
+          coordinated(
+              REPOSITORY,
+              lambda REPOSITORY=REPOSITORY: pb.clean_images([REPOSITORY])))
+         for REPOSITORY in repositories],
+        interval=interval,
+        intervals=parseIntervals(os.environ.get('REPOSITORY_INTERVALS', '')),
+        stagger=stagger,
+        jitter=int(os.environ.get('SCHEDULE_JITTER', '300')))
+    # the fleet-wide budget is enforced once every repository had its turn
+    if pb.imageBudget is not None:
+        scheduler.add(
+            'image-budget',
+            coordinated(
+                'image-budget', lambda: pb.enforceImageBudget(
+                    repositories, int(os.environ['DELETE_IMAGES']))),
+            interval=interval,
+            delay=len(repositories) * stagger)
+
+    if not os.environ.get('PUSH_EVENT_QUEUE'):
+        scheduler.run()
+        return
+
+    # pushes are pruned as they come in, the scheduled runs still take care
+    # of closed branches and orphans
+    threading.Thread(target=scheduler.run, daemon=True).start()
+    PushConsumer(
+        pb,
+        openQueue(os.environ['PUSH_EVENT_QUEUE']),
+        int(os.environ['DELETE_IMAGES']),
+        repositories=repositories,
+        window=int(
+            os.environ.get('PUSH_COALESCE_WINDOW',
+                           str(DEFAULT_COALESCE_WINDOW))),
+        coordinator=coordinator).run()
 
 
 if __name__ == '__main__':
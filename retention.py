@@ -0,0 +1,145 @@
+import datetime
+import heapq
+
+# number of newest builds kept for every branch of a class
+DEFAULT_RETENTION = {'develop': 10, 'master': 10, 'feature': 1}
+
+
+def parseRetention(value):
+    """
+    parse a RETENTION setting such as 'develop=10,master=10,feature=2' into a
+    dict of builds to keep per branch class, on top of DEFAULT_RETENTION
+    """
+    retention = dict(DEFAULT_RETENTION)
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        branchClass, _, count = item.partition('=')
+        branchClass = branchClass.strip()
+        if branchClass not in DEFAULT_RETENTION or not count.strip().isdigit():
+            raise ValueError("Invalid retention '{0}'".format(item))
+        retention[branchClass] = int(count)
+    return retention
+
+
+def indexByBranch(parsed):
+    """
+    walk a parseInventory view once and index it by class: develop, master,
+    version and rc as lists, feature as a dict of branch name to builds
+    """
+    index = {
+        'develop': [],
+        'master': [],
+        'feature': {},
+        'version': [],
+        'rc': []
+    }
+    for i in parsed:
+        kind = i.kind
+        if kind == 'feature':
+            index['feature'].setdefault(i.branch, []).append(i)
+        elif kind is not None:
+            index[kind].append(i)
+    return index
+
+
+def olderThanNewest(builds, keep):
+    """
+    tags of every build in the group except the `keep` highest buildNo's.
+    heapq.nlargest keeps the same builds a stable descending sort would, so
+    ties are broken by inventory order exactly like the previous full sorts
+    """
+    if len(builds) <= keep:
+        return []
+    kept = set(
+        id(i) for i in heapq.nlargest(keep, builds, key=lambda x: x.buildNo))
+    return [i.tag for i in builds if id(i) not in kept]
+
+
+def isExpiredVersion(major, minor, today=None):
+    """
+    versions follow <year>.<month>.<build_number>; keep the current and the
+    two previous months' lines and discard the rest
+    """
+    if today is None:
+        today = datetime.datetime.today()
+    latest_major_ver = int(today.strftime('%y'))
+    latest_minor_ver = today.month
+    if latest_minor_ver >= 3:
+        return major < latest_major_ver or minor < (latest_minor_ver - 2)
+    elif latest_minor_ver == 2:
+        return major < latest_major_ver and minor < 12
+    else:  #latest_minor_ver == 1
+        return major < latest_major_ver and minor < 11
+
+
+def groupKey(parsedTag):
+    """
+    the retention group a parsed tag belongs to: its class for develop and
+    master, its branch for feature builds and its year.month line for
+    versions and rc's. None for tags retention ignores
+    """
+    kind = parsedTag.kind
+    if kind in ('develop', 'master'):
+        return (kind, )
+    elif kind == 'feature':
+        return (kind, parsedTag.branch)
+    elif kind in ('version', 'rc'):
+        return ('version', parsedTag.major, parsedTag.minor)
+    return None
+
+
+def affectedGroups(parsed, added, removed):
+    """
+    groups of a parsed inventory whose retention can change because of the
+    parsed tags added to / removed from it since the previous run
+    """
+    groups = set(groupKey(i) for i in added + removed)
+    groups.discard(None)
+
+    # the version/rc guard of selectOldBuilds depends on the whole inventory,
+    # when it flips every version line is affected
+    def counts(tags):
+        return (len([i for i in tags if i.kind == 'version']),
+                len([i for i in tags if i.kind == 'rc']))
+
+    versions, rcs = counts(parsed)
+    addedVersions, addedRcs = counts(added)
+    removedVersions, removedRcs = counts(removed)
+    before = (versions - addedVersions + removedVersions > 1
+              and rcs - addedRcs + removedRcs > 1)
+    if before != (versions > 1 and rcs > 1):
+        groups.update(
+            groupKey(i) for i in parsed if i.kind in ('version', 'rc'))
+    return groups
+
+
+def selectOldBuilds(parsed, retention=None, today=None, groups=None):
+    """
+    return the tags deleteOldBuilds condemns from a parseInventory view, in
+    time linear in the number of tags. when groups is given only those
+    retention groups (see groupKey) are evaluated
+    """
+    if retention is None:
+        retention = DEFAULT_RETENTION
+    index = indexByBranch(parsed)
+
+    def selected(key):
+        return groups is None or key in groups
+
+    toDelete = []
+    for kind in ('develop', 'master'):
+        if selected((kind, )):
+            toDelete += olderThanNewest(index[kind], retention[kind])
+    for branch, builds in index['feature'].items():
+        if selected(('feature', branch)):
+            toDelete += olderThanNewest(builds, retention['feature'])
+
+    # version (12.6.2) and RC (12.8.0-rc-2) lines are only pruned when
+    # there is more than one of each
+    if len(index['version']) > 1 and len(index['rc']) > 1:
+        for i in index['version'] + index['rc']:
+            if selected(('version', i.major, i.minor)) and \
+                    isExpiredVersion(i.major, i.minor, today):
+                toDelete.append(i.tag)
+    return toDelete
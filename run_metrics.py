@@ -0,0 +1,207 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# counters kept for every repository besides phase times and api calls
+COUNTERS = ('pages', 'bytes', 'images', 'planned', 'deleted')
+
+
+class RunMetrics(object):
+    """
+    Wall time per phase and per repository, ECR/github calls by operation,
+    pages and bytes listed and images planned versus actually deleted, for
+    one clean_images run. Thread safe, so concurrent repository workers can
+    share it. Every repository is also timed on its own, from its start to
+    the summary of the run that cleaned it, so the scheduler's jobs for
+    single repositories can share one RunMetrics too.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.finished = None
+        self.lock = threading.Lock()
+        self.repositories = {}
+
+    def repository(self, repository):
+        # caller holds the lock
+        if repository not in self.repositories:
+            metrics = {
+                'phases': {},
+                'calls': {},
+                'started': self.clock(),
+                'finished': None
+            }
+            for counter in COUNTERS:
+                metrics[counter] = 0
+            self.repositories[repository] = metrics
+        return self.repositories[repository]
+
+    @contextmanager
+    def phase(self, repository, name):
+        """
+        time the enclosed block as phase `name` of repository, repeated
+        phases add up
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                phases = self.repository(repository)['phases']
+                phases[name] = phases.get(name, 0) + elapsed
+
+    def start(self, repository):
+        """
+        forget the figures of repository and time it from now, when it is
+        cleaned again
+        """
+        with self.lock:
+            self.repositories.pop(repository, None)
+            self.repository(repository)
+
+    def countCall(self, repository, service, operation, count=1):
+        key = '{0}.{1}'.format(service, operation)
+        with self.lock:
+            calls = self.repository(repository)['calls']
+            calls[key] = calls.get(key, 0) + count
+
+    def add(self, repository, counter, value):
+        with self.lock:
+            self.repository(repository)[counter] += value
+
+    def repositorySummary(self, repository):
+        with self.lock:
+            metrics = self.repository(repository)
+            summary = {
+                "Summary": "repository",
+                "repository": repository,
+                "phases": dict((p, round(t, 6))
+                               for p, t in metrics['phases'].items()),
+                "calls": dict(metrics['calls'])
+            }
+            for counter in COUNTERS:
+                summary[counter] = metrics[counter]
+            return summary
+
+    def runSummary(self, repositories=None):
+        """
+        totals over every repository of the run, or only over the given
+        repositories of a partial run, timed from the first of them starting
+        """
+        with self.lock:
+            self.finished = self.clock()
+            if repositories is None:
+                selected = list(self.repositories.values())
+                started = self.started
+            else:
+                selected = [self.repository(r) for r in repositories]
+                started = min([m['started'] for m in selected] +
+                              [self.finished])
+            phases = {}
+            calls = {}
+            summary = {
+                "Summary": "run",
+                "repositories": len(selected),
+                "seconds": round(self.finished - started, 6)
+            }
+            for counter in COUNTERS:
+                summary[counter] = 0
+            for metrics in selected:
+                metrics['finished'] = self.finished
+                for p, t in metrics['phases'].items():
+                    phases[p] = phases.get(p, 0) + t
+                for c, n in metrics['calls'].items():
+                    calls[c] = calls.get(c, 0) + n
+                for counter in COUNTERS:
+                    summary[counter] += metrics[counter]
+            summary['phases'] = dict((p, round(t, 6)) for p, t in phases.items())
+            summary['calls'] = calls
+            return summary
+
+    def prometheus(self, repositories=None):
+        """
+        the run (of the given repositories only for a partial run) in
+        prometheus text exposition format. every repository's figures are
+        the ones of the last run that cleaned it, labelled with when that was
+        """
+        run = self.runSummary(repositories)
+        lines = [
+            '# HELP registry_ops_run_seconds Wall time of the last prune run.',
+            '# TYPE registry_ops_run_seconds gauge',
+            'registry_ops_run_seconds {0}'.format(run['seconds']),
+            '# HELP registry_ops_last_run_timestamp_seconds End of the last prune run.',
+            '# TYPE registry_ops_last_run_timestamp_seconds gauge',
+            'registry_ops_last_run_timestamp_seconds {0}'.format(
+                self.finished),
+            '# HELP registry_ops_phase_seconds Wall time per phase and repository.',
+            '# TYPE registry_ops_phase_seconds gauge'
+        ]
+        with self.lock:
+            repositories = sorted(self.repositories.items())
+        for repository, metrics in repositories:
+            for p, t in sorted(metrics['phases'].items()):
+                lines.append(
+                    'registry_ops_phase_seconds{{repository="{0}",phase="{1}"}} {2}'.
+                    format(repository, p, round(t, 6)))
+        lines += [
+            '# HELP registry_ops_repository_seconds Wall time of the last run per repository.',
+            '# TYPE registry_ops_repository_seconds gauge'
+        ]
+        for repository, metrics in repositories:
+            if metrics['finished'] is not None:
+                lines.append(
+                    'registry_ops_repository_seconds{{repository="{0}"}} {1}'.
+                    format(repository,
+                           round(metrics['finished'] - metrics['started'], 6)))
+        lines += [
+            '# HELP registry_ops_repository_last_run_timestamp_seconds End of the last run per repository.',
+            '# TYPE registry_ops_repository_last_run_timestamp_seconds gauge'
+        ]
+        for repository, metrics in repositories:
+            if metrics['finished'] is not None:
+                lines.append(
+                    'registry_ops_repository_last_run_timestamp_seconds{{repository="{0}"}} {1}'.
+                    format(repository, metrics['finished']))
+        lines += [
+            '# HELP registry_ops_api_calls Requests sent per service and operation.',
+            '# TYPE registry_ops_api_calls gauge'
+        ]
+        for repository, metrics in repositories:
+            for c, n in sorted(metrics['calls'].items()):
+                service, operation = c.split('.', 1)
+                lines.append(
+                    'registry_ops_api_calls{{repository="{0}",service="{1}",operation="{2}"}} {3}'.
+                    format(repository, service, operation, n))
+        for counter in COUNTERS:
+            lines += [
+                '# HELP registry_ops_{0} {0} per repository in the last run.'.
+                format(counter),
+                '# TYPE registry_ops_{0} gauge'.format(counter)
+            ]
+            for repository, metrics in repositories:
+                lines.append('registry_ops_{0}{{repository="{1}"}} {2}'.format(
+                    counter, repository, metrics[counter]))
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheus(self, path, repositories=None):
+        """
+        write the textfile for node_exporter's textfile collector, atomically
+        so it never scrapes a partial file. concurrent runs each write their
+        own temporary file
+        """
+        fd, tmpPath = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.',
+            prefix=os.path.basename(path) + '.',
+            suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.prometheus(repositories))
+            os.chmod(tmpPath, 0o644)
+            os.replace(tmpPath, path)
+        except Exception:
+            os.remove(tmpPath)
+            raise
@@ -0,0 +1,175 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# seconds between two runs of a job unless configured otherwise
+DEFAULT_INTERVAL = 24 * 3600
+
+
+def parseIntervals(value):
+    """
+    parse a REPOSITORY_INTERVALS setting such as 'org/a=3600,org/b=86400'
+    into seconds per repository
+    """
+    intervals = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        repository, _, interval = item.rpartition('=')
+        try:
+            intervals[repository.strip()] = float(interval)
+        except ValueError:
+            raise ValueError("Invalid interval '{0}'".format(item))
+        if not repository.strip() or intervals[repository.strip()] <= 0:
+            raise ValueError("Invalid interval '{0}'".format(item))
+    return intervals
+
+
+class Job(object):
+    """
+    a function run every `interval` seconds, along with its run statistics
+    """
+
+    def __init__(self, name, fn, interval, nextRun):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.nextRun = nextRun
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.lastDuration = None
+        self.totalDuration = 0
+
+    def stats(self):
+        return {
+            "job": self.name,
+            "interval": self.interval,
+            "nextRun": self.nextRun,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "lastDuration": self.lastDuration,
+            "meanDuration": self.totalDuration / self.runs if self.runs else None
+        }
+
+
+class Scheduler(object):
+    """
+    Runs jobs at their own interval on a pool of `workers` threads.
+
+    Due times are kept in a heap and the scheduler thread sleeps until the
+    earliest one (or until a job is added or stop is called) instead of
+    polling. A job that is still running when it comes due again is skipped
+    for that round, and due times that went by while the scheduler couldn't
+    start the job (e.g. the host was suspended) are counted as missed rather
+    than run in a burst.
+    """
+
+    def __init__(self, workers=1, clock=time.time):
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self.jobs = {}
+        self.heap = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    def add(self, name, fn, interval=DEFAULT_INTERVAL, delay=0, jitter=0):
+        """
+        run fn every interval seconds, the first time after delay plus a
+        random jitter of up to `jitter` seconds
+        """
+        job = Job(name, fn, interval,
+                  self.clock() + delay + random.uniform(0, jitter))
+        with self.lock:
+            self.jobs[name] = job
+            heapq.heappush(self.heap, (job.nextRun, name))
+        self.wakeup.set()
+        return job
+
+    def addStaggered(self, jobs, interval=DEFAULT_INTERVAL, intervals=None,
+                     stagger=60, jitter=0):
+        """
+        add (name, fn) jobs whose first runs are `stagger` seconds apart,
+        intervals overriding the interval of some of them
+        """
+        intervals = intervals or {}
+        for n, (name, fn) in enumerate(jobs):
+            self.add(name, fn,
+                     intervals.get(name, interval),
+                     delay=n * stagger,
+                     jitter=jitter)
+
+    def runPending(self):
+        """
+        start every job that is due and return the seconds until the next
+        one (None without jobs)
+        """
+        now = self.clock()
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                nextRun, name = heapq.heappop(self.heap)
+                job = self.jobs[name]
+                # due times that passed more than an interval ago are missed
+                late = int((now - nextRun) // job.interval)
+                job.missed += late
+                job.nextRun = nextRun + (late + 1) * job.interval
+                heapq.heappush(self.heap, (job.nextRun, name))
+                if job.running:
+                    job.skipped += 1
+                    logger.warning(
+                        "Skipping {0}, its previous run is still going".format(
+                            name))
+                    continue
+                job.running = True
+                self.executor.submit(self.runJob, job)
+            if not self.heap:
+                return None
+            return max(0, self.heap[0][0] - now)
+
+    def runJob(self, job):
+        start = time.monotonic()
+        try:
+            job.fn()
+        except Exception:
+            job.failures += 1
+            logger.exception("Job {0} failed".format(job.name))
+        finally:
+            duration = time.monotonic() - start
+            with self.lock:
+                job.runs += 1
+                job.lastDuration = duration
+                job.totalDuration += duration
+                job.running = False
+                stats = job.stats()
+            logger.info({"Scheduler": stats})
+
+    def run(self):
+        """
+        run jobs until stop is called
+        """
+        while True:
+            self.wakeup.clear()
+            # checked after clearing, so a stop can't be cleared unseen
+            if self.stopped:
+                break
+            self.wakeup.wait(self.runPending())
+
+    def stop(self, wait=True):
+        self.stopped = True
+        self.wakeup.set()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            return [self.jobs[name].stats() for name in sorted(self.jobs)]
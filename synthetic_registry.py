@@ -0,0 +1,280 @@
+import datetime
+import hashlib
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from pruneBuilds import PruneBuilds
+from rate_limiter import AdaptiveRateLimiter
+
+# the stand-ins aren't throttled, don't let the ECR rate limits pace them
+UNLIMITED = 1e9
+
+
+def fakeDigest(seed):
+    return 'sha256:' + hashlib.sha256(str(seed).encode()).hexdigest()
+
+
+def generateInventory(images=1000, branches=100, seed=0, today=None):
+    """
+    generate a realistic list_images inventory of about `images` images:
+    develop/master builds, feature branch builds spread over `branches`
+    branches, <year>.<month>.<build> versions and rc's, some of them with a
+    'c-' prefix, a few images carrying a second tag and ~5% untagged digests.
+    returns the inventory and the github branches still open (two thirds of
+    the feature branches plus develop and master)
+    """
+    rand = random.Random(seed)
+    if today is None:
+        today = time.localtime()
+    year = today.tm_year % 100
+    featureBranches = [
+        rand.choice(['pw', 'cw', 'bw', 'pid']) + '-{0}'.format(i)
+        for i in range(0, branches)
+    ]
+    openBranches = ['develop', 'master'] + [
+        b for n, b in enumerate(featureBranches) if n % 3 != 0
+    ]
+
+    inventory = []
+    for i in range(0, images):
+        digest = fakeDigest('{0}-{1}'.format(seed, i))
+        kind = rand.random()
+        prefix = 'c-' if rand.random() < 0.3 else ''
+        if kind < 0.05:
+            inventory.append({'imageDigest': digest})
+            continue
+        elif kind < 0.15:
+            tag = '{0}develop-{1}'.format(prefix, i)
+        elif kind < 0.22:
+            tag = '{0}master-{1}'.format(prefix, i)
+        elif kind < 0.80:
+            tag = '{0}{1}-{2}'.format(prefix, rand.choice(featureBranches), i)
+        elif kind < 0.90:
+            tag = '{0}{1}.{2}.{3}'.format(prefix, rand.randint(
+                year - 2, year), rand.randint(1, 12), i)
+        else:
+            tag = '{0}{1}.{2}.{3}-rc-{4}'.format(
+                prefix, rand.randint(year - 2, year), rand.randint(1, 12), i,
+                rand.randint(1, 20))
+        inventory.append({'imageDigest': digest, 'imageTag': tag})
+        if rand.random() < 0.05:
+            inventory.append({
+                'imageDigest': digest,
+                'imageTag': 'build-{0}'.format(i)
+            })
+    return inventory, openBranches
+
+
+# push time of the first image of a FakeRepository
+PUSHED_AT = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeRepository(object):
+    """
+    images of one fake repository, indexed by tag and digest so deletes stay
+    cheap on million image inventories
+    """
+
+    def __init__(self, images):
+        self.order = [(i['imageDigest'], i.get('imageTag')) for i in images]
+        self.alive = set(self.order)
+        self.byTag = {}
+        self.byDigest = {}
+        for key in self.order:
+            if key[1] is not None:
+                self.byTag[key[1]] = key
+            self.byDigest.setdefault(key[0], []).append(key)
+
+    def imageId(self, key):
+        imageId = {'imageDigest': key[0]}
+        if key[1] is not None:
+            imageId['imageTag'] = key[1]
+        return imageId
+
+    def images(self):
+        return [self.imageId(k) for k in self.order if k in self.alive]
+
+    def imageDetails(self):
+        """
+        describe_images details of the live images, pushed one second
+        apart in inventory order
+        """
+        details = {}
+        for n, key in enumerate(self.order):
+            if key not in self.alive:
+                continue
+            if key[0] not in details:
+                details[key[0]] = {
+                    'imageDigest': key[0],
+                    'imagePushedAt': PUSHED_AT + datetime.timedelta(seconds=n)
+                }
+            if key[1] is not None:
+                details[key[0]].setdefault('imageTags', []).append(key[1])
+        return list(details.values())
+
+    def delete(self, imageId):
+        if 'imageTag' in imageId:
+            keys = [self.byTag[imageId['imageTag']]
+                    ] if imageId['imageTag'] in self.byTag else []
+        else:
+            keys = self.byDigest.get(imageId.get('imageDigest'), [])
+        keys = [k for k in keys if k in self.alive]
+        for key in keys:
+            self.alive.discard(key)
+            if key[1] is not None:
+                del self.byTag[key[1]]
+        return [self.imageId(k) for k in keys]
+
+
+class FakeEcrClient(object):
+    """
+    Local stand-in for the boto3 ECR client calls PruneBuilds makes, over
+    in-memory inventories, with an optional latency injected in every call
+    """
+
+    def __init__(self, inventories, pageSize=1000, latency=0):
+        self.repositories = dict(
+            (r, FakeRepository(images)) for r, images in inventories.items())
+        self.pageSize = pageSize
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.policies = {}
+
+    def call(self, operation, repositoryName):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if repositoryName not in self.repositories:
+            raise ClientError({
+                'Error': {
+                    'Code': 'RepositoryNotFoundException',
+                    'Message': repositoryName
+                }
+            }, operation)
+        return self.repositories[repositoryName]
+
+    def images(self, repositoryName):
+        with self.lock:
+            return self.repositories[repositoryName].images()
+
+    def list_images(self, repositoryName, nextToken=None, maxResults=None):
+        repository = self.call('ListImages', repositoryName)
+        pageSize = min(maxResults or 100, self.pageSize)
+        start = int(nextToken or 0)
+        with self.lock:
+            keys = repository.order[start:start + pageSize]
+            page = {
+                'imageIds':
+                [repository.imageId(k) for k in keys if k in repository.alive]
+            }
+        if start + pageSize < len(repository.order):
+            page['nextToken'] = str(start + pageSize)
+        return page
+
+    def describe_images(self, repositoryName, nextToken=None, maxResults=None):
+        repository = self.call('DescribeImages', repositoryName)
+        pageSize = min(maxResults or 100, self.pageSize)
+        start = int(nextToken or 0)
+        with self.lock:
+            details = repository.imageDetails()
+        page = {'imageDetails': details[start:start + pageSize]}
+        if start + pageSize < len(details):
+            page['nextToken'] = str(start + pageSize)
+        return page
+
+    def get_lifecycle_policy(self, repositoryName):
+        self.call('GetLifecyclePolicy', repositoryName)
+        if repositoryName not in self.policies:
+            raise ClientError({
+                'Error': {
+                    'Code': 'LifecyclePolicyNotFoundException',
+                    'Message': repositoryName
+                }
+            }, 'GetLifecyclePolicy')
+        return {
+            'repositoryName': repositoryName,
+            'lifecyclePolicyText': self.policies[repositoryName]
+        }
+
+    def put_lifecycle_policy(self, repositoryName, lifecyclePolicyText):
+        self.call('PutLifecyclePolicy', repositoryName)
+        self.policies[repositoryName] = lifecyclePolicyText
+        return {
+            'repositoryName': repositoryName,
+            'lifecyclePolicyText': lifecyclePolicyText
+        }
+
+    def batch_delete_image(self, repositoryName, imageIds):
+        repository = self.call('BatchDeleteImage', repositoryName)
+        if len(imageIds) > 100:
+            raise ClientError({
+                'Error': {
+                    'Code': 'InvalidParameterException',
+                    'Message': 'at most 100 imageIds'
+                }
+            }, 'BatchDeleteImage')
+        deleted = []
+        failures = []
+        with self.lock:
+            for imageId in imageIds:
+                matches = repository.delete(imageId)
+                if not matches:
+                    failures.append({
+                        'imageId': imageId,
+                        'failureCode': 'ImageNotFound',
+                        'failureReason': 'Requested image not found'
+                    })
+                deleted += matches
+        return {'imageIds': deleted, 'failures': failures}
+
+
+class FakeBranch(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeGithubRepository(object):
+    def __init__(self, branches, latency):
+        self.branches = branches
+        self.latency = latency
+
+    def get_branches(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return [FakeBranch(b) for b in self.branches]
+
+
+class FakeGithub(object):
+    """
+    Local stand-in for the PyGithub client, serving fixed branch lists
+    """
+
+    def __init__(self, branches, latency=0):
+        self.branches = branches
+        self.latency = latency
+
+    def get_repo(self, name):
+        return FakeGithubRepository(self.branches[name], self.latency)
+
+
+def localPruneBuilds(inventories, branches, latency=0, **kwargs):
+    """
+    a PruneBuilds working on stand-ins of the {repository: imageIds}
+    inventories and {repository: open branches}, with `latency` seconds
+    injected in every request and rate limits that never hold it back.
+    kwargs go to PruneBuilds, a client given there replaces the ECR stand-in
+    """
+    if 'client' not in kwargs:
+        kwargs['client'] = FakeEcrClient(inventories, latency=latency)
+    return PruneBuilds(
+        gitClient=FakeGithub(branches, latency=latency),
+        rateLimiter=AdaptiveRateLimiter(
+            rates=dict((operation, UNLIMITED)
+                       for operation in ('list_images', 'describe_images',
+                                         'batch_delete_image'))),
+        **kwargs)
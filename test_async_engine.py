@@ -0,0 +1,90 @@
+import threading
+import unittest
+
+from async_engine import AsyncEngine
+from synthetic_registry import (FakeEcrClient, generateInventory,
+                                localPruneBuilds)
+from testcase import PruneBuildsTestCase
+
+REPOSITORIES = ['org/a', 'org/b', 'org/c']
+
+
+class InFlightEcrClient(FakeEcrClient):
+    """
+    FakeEcrClient keeping track of the most requests in flight at once
+    """
+
+    def __init__(self, *args, **kwargs):
+        FakeEcrClient.__init__(self, *args, **kwargs)
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.inFlightLock = threading.Lock()
+
+    def call(self, operation, repositoryName):
+        with self.inFlightLock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            return FakeEcrClient.call(self, operation, repositoryName)
+        finally:
+            with self.inFlightLock:
+                self.inFlight -= 1
+
+
+class asyncEngineTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the asyncio engine
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.inventories = {}
+        self.branches = {}
+        for seed, repository in enumerate(REPOSITORIES):
+            self.inventories[repository], self.branches[
+                repository] = generateInventory(1500, 20, seed=seed)
+
+    def pruneBuilds(self, latency=0):
+        return localPruneBuilds(
+            self.inventories,
+            self.branches,
+            latency=latency,
+            client=InFlightEcrClient(
+                self.inventories, pageSize=500, latency=latency))
+
+    def test_samePlansAsCleanImages(self):
+        sequential = self.pruneBuilds()
+        self.cleanImages(sequential, 0, REPOSITORIES)
+        engine = AsyncEngine(self.pruneBuilds())
+        results = engine.run(REPOSITORIES, 0)
+        assert [r['repository'] for r in results] == REPOSITORIES
+        assert engine.pb.plans == sequential.plans
+        assert all(r['condemned'] > 0 for r in results)
+
+    def test_deletesLikeCleanImages(self):
+        sequential = self.pruneBuilds()
+        self.cleanImages(sequential, 1, REPOSITORIES)
+        engine = AsyncEngine(self.pruneBuilds(), ecrConcurrency=3)
+        results = engine.run(REPOSITORIES, 1)
+        assert all(r['deleted'] > 0 and r['failures'] == 0 for r in results)
+        for repository in REPOSITORIES:
+            assert engine.pb.client.images(repository) == \
+                sequential.client.images(repository)
+        assert engine.pb.client.maxInFlight <= 3
+
+    def test_failingRepository(self):
+        engine = AsyncEngine(self.pruneBuilds())
+        results = engine.run(['org/missing', 'org/a'], 0)
+        assert 'error' in results[0]
+        assert results[1]['repository'] == 'org/a' and 'error' not in results[1]
+
+    def test_concurrentRequestsWithLatency(self):
+        # the wall time against a sequential run is measured by the
+        # async_engine-latency benchmark of bench_registry_ops.py
+        engine = AsyncEngine(self.pruneBuilds(latency=0.01), ecrConcurrency=8)
+        engine.run(REPOSITORIES, 1)
+        assert engine.pb.client.maxInFlight > 1
+
+
+if __name__ == "__main__":
+    unittest.main()
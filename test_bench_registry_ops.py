@@ -0,0 +1,73 @@
+import logging
+import unittest
+
+import bench_registry_ops
+from synthetic_registry import FakeEcrClient, generateInventory
+
+
+class benchRegistryOpsTestCase(unittest.TestCase):
+    """
+    Class with test cases for the synthetic registry and benchmark suite
+    """
+
+    def test_generateInventory(self):
+        inventory, openBranches = generateInventory(2000, 50, seed=1)
+        tags = [i['imageTag'] for i in inventory if 'imageTag' in i]
+        assert len(tags) == len(set(tags))
+        assert len(inventory) > len(tags)
+        assert any(t.startswith('c-') for t in tags)
+        assert any('-rc-' in t for t in tags)
+        assert 'develop' in openBranches and len(openBranches) == 35
+        assert generateInventory(2000, 50, seed=1) == (inventory, openBranches)
+
+    def test_fakeEcrClient(self):
+        inventory = [{
+            'imageDigest': 'a',
+            'imageTag': 'develop-1'
+        }, {
+            'imageDigest': 'a',
+            'imageTag': 'build-1'
+        }, {
+            'imageDigest': 'b'
+        }]
+        client = FakeEcrClient({'repository': inventory})
+        page = client.list_images(repositoryName='repository', maxResults=2)
+        assert len(page['imageIds']) == 2 and page['nextToken'] == '2'
+        response = client.batch_delete_image(
+            repositoryName='repository',
+            imageIds=[{
+                'imageDigest': 'a'
+            }, {
+                'imageTag': 'develop-1'
+            }])
+        assert len(response['imageIds']) == 2
+        assert response['failures'][0]['failureCode'] == 'ImageNotFound'
+        assert client.images('repository') == [{'imageDigest': 'b'}]
+
+    def test_runBenchmarks(self):
+        logging.disable(logging.INFO)
+        try:
+            results = bench_registry_ops.runBenchmarks([500], repeat=1)
+        finally:
+            logging.disable(logging.NOTSET)
+        names = [r['benchmark'] for r in results['results']]
+        assert names == [
+            'parseInventory', 'deleteOldBuilds', 'deleteClosedGitBranches',
+            'getOrphans', 'clean_images', 'clean_images-streaming',
+            'clean_images-latency', 'async_engine-latency',
+            'selectOldBuilds-fleet', 'fleetOldBuilds', 'memory-dicts',
+            'memory-records'
+        ]
+        assert all(r['best'] >= 0 for r in results['results']
+                   if 'bytes' not in r)
+        engine = names.index('async_engine-latency')
+        assert results['results'][engine]['speedup'] > 0
+        memory = dict((r['benchmark'], r['bytes']) for r in results['results']
+                      if 'bytes' in r)
+        assert memory['memory-records'] < memory['memory-dicts']
+        rows = bench_registry_ops.compare(results, results)
+        assert [r['ratio'] for r in rows] == [1.0] * len(names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import responses
+
+from branch_cache import BranchCache, GITHUB_API
+
+BRANCHES_URL = GITHUB_API + '/repos/org/app/branches'
+
+
+class branchCacheTestCase(unittest.TestCase):
+    """
+    Class with test cases for the github branch cache
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'branches.json')
+        self.etag = '"v1"'
+        self.branches = ['develop', 'Master', 'PW-123']
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def branchesCallback(self, request):
+        if request.headers.get('If-None-Match') == self.etag:
+            return (304, {}, '')
+        return (200, {
+            'ETag': self.etag
+        }, json.dumps([{
+            'name': b
+        } for b in self.branches]))
+
+    @responses.activate
+    def test_getBranchesHitRevalidateMiss(self):
+        """
+        fresh entries are served from memory, stale ones are revalidated and
+        only refetched when github reports a change
+        """
+        responses.add_callback(
+            responses.GET, BRANCHES_URL, callback=self.branchesCallback)
+        cache = BranchCache(self.path, 'token', ttl=3600)
+        assert cache.getBranches('org/app') == ['develop', 'master', 'pw-123']
+        assert cache.getBranches('org/app') == ['develop', 'master', 'pw-123']
+        assert len(responses.calls) == 1
+        assert responses.calls[0].request.headers[
+            'Authorization'] == 'token token'
+
+        cache.ttl = 0
+        assert cache.getBranches('org/app') == ['develop', 'master', 'pw-123']
+        assert len(responses.calls) == 2
+
+        self.etag = '"v2"'
+        self.branches = ['develop']
+        assert cache.getBranches('org/app') == ['develop']
+        assert cache.stats() == {
+            "BranchCacheHits": 1,
+            "BranchCacheRevalidated": 1,
+            "BranchCacheMisses": 2,
+            "GithubRequests": 3,
+            "BranchCacheEntries": 1
+        }
+        cache.resetStats()
+        assert cache.stats()['GithubRequests'] == 0
+        assert cache.stats()['BranchCacheEntries'] == 1
+
+    @responses.activate
+    def test_savedCacheIsReused(self):
+        responses.add_callback(
+            responses.GET, BRANCHES_URL, callback=self.branchesCallback)
+        cache = BranchCache(self.path, 'token', ttl=3600)
+        cache.getBranches('org/app')
+        cache.save()
+
+        reloaded = BranchCache(self.path, 'token', ttl=3600)
+        assert reloaded.getBranches('org/app') == [
+            'develop', 'master', 'pw-123'
+        ]
+        assert len(responses.calls) == 1
+        assert reloaded.stats()['BranchCacheHits'] == 1
+
+    @responses.activate
+    def test_evictLeastRecentlyUsed(self):
+        for name in ['a', 'b', 'c']:
+            responses.add(
+                responses.GET,
+                GITHUB_API + '/repos/org/{0}/branches'.format(name),
+                json=[{
+                    'name': 'develop'
+                }])
+        cache = BranchCache(self.path, 'token', maxEntries=2)
+        cache.getBranches('org/a')
+        cache.getBranches('org/b')
+        cache.getBranches('org/a')
+        cache.getBranches('org/c')
+        assert sorted(cache.entries) == ['org/a', 'org/c']
+
+
+if __name__ == "__main__":
+    unittest.main()
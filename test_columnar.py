@@ -0,0 +1,59 @@
+import datetime
+import unittest
+
+import numpy
+
+import columnar
+import retention
+from pruneBuilds import parseInventory
+from synthetic_registry import generateInventory
+
+TODAY = datetime.datetime(2019, 6, 15)
+
+
+class columnarTestCase(unittest.TestCase):
+    """
+    Class with test cases for the columnar fleet evaluation of the retention
+    """
+
+    def setUp(self):
+        self.inventories = {}
+        for n in range(0, 4):
+            inventory, openBranches = generateInventory(
+                2000, 30, seed=n, today=TODAY.timetuple())
+            self.inventories['org/repository-{0}'.format(n)] = parseInventory(
+                inventory)
+        # builds numbered alike keep their inventory order
+        self.inventories['org/ties'] = parseInventory([{
+            'imageTag': tag
+        } for tag in ['develop-3', 'c-develop-3', 'develop-2', 'develop-3',
+                      'pw-1-1', 'pw-1-1', 'pw-1-0', '19.1.1', '19.1.1-rc']])
+        self.inventories['org/empty'] = []
+
+    def test_fleetOldBuilds(self):
+        for keep in (None, {'develop': 1, 'master': 0, 'feature': 1}):
+            for today in (TODAY, datetime.datetime(2019, 1, 2),
+                          datetime.datetime(2019, 2, 2)):
+                results = columnar.fleetOldBuilds(self.inventories, keep,
+                                                  today)
+                assert sorted(results) == sorted(self.inventories)
+                for repository, parsed in self.inventories.items():
+                    assert results[repository] == {
+                        "Reason": "Old-builds",
+                        "ImageTags": retention.selectOldBuilds(
+                            parsed, keep, today)
+                    }
+
+    def test_expiredVersions(self):
+        major = numpy.array([18, 19, 19, 19])
+        minor = numpy.array([12, 1, 10, 12])
+        for today in (TODAY, datetime.datetime(2019, 1, 2),
+                      datetime.datetime(2019, 2, 2)):
+            assert list(columnar.expiredVersions(major, minor, today)) == [
+                retention.isExpiredVersion(int(a), int(b), today)
+                for a, b in zip(major, minor)
+            ]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from coordination import Coordinator, HashRing, LeaseLost, LeaseStore
+
+
+class coordinationTestCase(unittest.TestCase):
+    """
+    Class with test cases for the coordination of registry-ops replicas
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'leases.db')
+        self.now = [1000.0]
+        self.repositories = ['org/repository-{0}'.format(n)
+                             for n in range(0, 300)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def coordinator(self, replica):
+        # every replica has its own connection to the shared file
+        return Coordinator(
+            LeaseStore(self.path), replica, ttl=60, clock=lambda: self.now[0])
+
+    def test_hashRing(self):
+        ring = HashRing(['a', 'b', 'c'])
+        owners = dict((r, ring.owner(r)) for r in self.repositories)
+        for replica in ('a', 'b', 'c'):
+            assert list(owners.values()).count(replica) > 60
+        # only the repositories of the replica that left move
+        smaller = HashRing(['a', 'c'])
+        for repository, owner in owners.items():
+            if owner != 'b':
+                assert smaller.owner(repository) == owner
+        assert HashRing([]).owner('org/a') is None
+
+    def test_assignment(self):
+        a = self.coordinator('a')
+        b = self.coordinator('b')
+        a.heartbeat()
+        b.heartbeat()
+        mine = [r for r in self.repositories if a.assigned(r)]
+        theirs = [r for r in self.repositories if b.assigned(r)]
+        assert mine and theirs
+        assert sorted(mine + theirs) == sorted(self.repositories)
+
+        # b crashed: once its heartbeat expires a gets everything
+        self.now[0] += 30
+        a.heartbeat()
+        assert not all(a.assigned(r) for r in self.repositories)
+        self.now[0] += 31
+        assert all(a.assigned(r) for r in self.repositories)
+
+        b.heartbeat()
+        b.leave()
+        assert all(a.assigned(r) for r in self.repositories)
+
+    def test_leases(self):
+        a = self.coordinator('a')
+        b = self.coordinator('b')
+        with a.lease('org/a') as acquired:
+            assert acquired
+            with b.lease('org/a') as acquired:
+                assert not acquired
+            assert b.store.owner('org/a', self.now[0]) == 'a'
+            # a lease that wasn't renewed can be taken over
+            self.now[0] += 61
+            with b.lease('org/a') as acquired:
+                assert acquired
+        with b.lease('org/a') as acquired:
+            assert acquired
+
+    def test_lostLease(self):
+        """
+        a replica that finds its lease taken over stops deleting
+        """
+        a = self.coordinator('a')
+        b = self.coordinator('b')
+        with a.lease('org/a') as acquired:
+            assert acquired and a.renew('org/a')
+            a.checkLease('org/a')
+            # a stalled past the ttl and b took over
+            self.now[0] += 61
+            with b.lease('org/a') as acquired:
+                assert acquired
+                assert not a.renew('org/a')
+                with self.assertRaises(LeaseLost):
+                    a.checkLease('org/a')
+        a.checkLease('org/a')
+
+    def test_sharedLease(self):
+        """
+        blocks of one replica share a lease, the last one releases it
+        """
+        a = self.coordinator('a')
+        with a.lease('org/a') as outer:
+            with a.lease('org/a') as inner:
+                assert outer and inner
+            assert a.store.owner('org/a', self.now[0]) == 'a'
+        assert a.store.owner('org/a', self.now[0]) is None
+
+    def test_run(self):
+        a = self.coordinator('a')
+        b = self.coordinator('b')
+        b.heartbeat()
+        a.heartbeat()
+        ran = []
+        for repository in self.repositories[:20]:
+            for replica in (a, b):
+                replica.run(repository,
+                            lambda: ran.append((repository, replica.replica)))
+        assert sorted(r for r, replica in ran) == sorted(
+            self.repositories[:20])
+
+        # the assigned replica skips a repository another one still holds
+        repository = next(r for r in self.repositories if a.assigned(r))
+        b.store.acquire(repository, 'b', self.now[0] + 60, self.now[0])
+        assert a.run(repository, lambda: 'ran') is None
+        self.now[0] += 61
+        assert a.run(repository, lambda: 'ran') == 'ran'
+        assert a.store.owner(repository, self.now[0]) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
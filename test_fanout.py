@@ -0,0 +1,115 @@
+import functools
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fanout
+from pruneBuilds import PruneBuilds
+from synthetic_registry import FakeEcrClient, FakeGithub
+from testcase import PruneBuildsTestCase
+
+
+def fakePruneBuilds(target):
+    # a stand-in registry per target, built in the worker process
+    if target['region'] == 'nowhere':
+        raise ValueError('no such region')
+    inventory = [{
+        'imageTag': 'develop-{0}'.format(i),
+        'imageDigest': 'sha256:{0}'.format(i)
+    } for i in range(0, 12)]
+    return PruneBuilds(
+        client=FakeEcrClient(
+            dict((r, list(inventory)) for r in target['repositories'])),
+        gitClient=FakeGithub(
+            dict((r, ['develop']) for r in target['repositories'])))
+
+
+class fakeSts(object):
+
+    def assume_role(self, **kwargs):
+        self.kwargs = kwargs
+        return {
+            'Credentials': {
+                'AccessKeyId': 'AKIA' + kwargs['RoleArn'][-4:],
+                'SecretAccessKey': 'secret',
+                'SessionToken': 'token'
+            }
+        }
+
+
+class fanoutTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the multi-account fan-out
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        PruneBuildsTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def writeConfig(self, config):
+        path = os.path.join(self.directory, 'targets.json')
+        with open(path, 'w') as f:
+            json.dump(config, f)
+        return path
+
+    def test_loadTargets(self):
+        targets = [{'region': 'us-west-2', 'repositories': ['org/a']}]
+        assert fanout.loadTargets(self.writeConfig({
+            'targets': targets
+        })) == targets
+        for config in ({}, {'targets': []}, {
+                'targets': [{'region': 'us-west-2', 'repositories': []}]
+        }, {'targets': [{'repositories': ['org/a']}]}):
+            with self.assertRaises(ValueError):
+                fanout.loadTargets(self.writeConfig(config))
+
+    def test_targetSession(self):
+        sts = fakeSts()
+        session = fanout.targetSession({
+            'region': 'eu-west-1',
+            'role': 'arn:aws:iam::123456789012:role/prune',
+            'externalId': 'shared'
+        }, sts)
+        assert session.region_name == 'eu-west-1'
+        assert session.get_credentials().access_key == 'AKIArune'
+        assert sts.kwargs['ExternalId'] == 'shared'
+        assert sts.kwargs['RoleSessionName'] == fanout.ROLE_SESSION_NAME
+
+    def test_runFanout(self):
+        targets = [{
+            'account': '1',
+            'region': 'us-west-2',
+            'repositories': ['org/a', 'org/b']
+        }, {
+            'account': '2',
+            'region': 'eu-west-1',
+            'repositories': ['org/c']
+        }, {
+            'account': '3',
+            'region': 'nowhere',
+            'repositories': ['org/d']
+        }]
+        with self.environ(1):
+            outcomes, summary = fanout.runFanout(
+                targets,
+                processes=2,
+                runner=functools.partial(
+                    fanout.runTarget, makePruneBuilds=fakePruneBuilds))
+        assert [o['target'] for o in outcomes] == [
+            '1/us-west-2', '2/eu-west-1', '3/nowhere'
+        ]
+        assert [r['deleted'] for r in outcomes[0]['results']] == [2, 2]
+        assert summary['failedTargets'] == ['3/nowhere']
+        assert summary['repositories'] == 3
+        assert summary['images'] == 36 and summary['deleted'] == 6
+        assert summary['calls']['ecr.list_images'] == 3
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+import json
+import logging
+import unittest
+from unittest.mock import Mock
+
+import responses
+
+from github_graphql import (GRAPHQL_URL, GraphqlBranches, branchesQuery,
+                            githubRepository)
+from pruneBuilds import PruneBuilds
+from testcase import PruneBuildsTestCase
+
+BRANCHES_A = ['develop', 'master'] + ['PW-{0}'.format(n) for n in range(0, 148)]
+
+
+def refs(names, endCursor=None):
+    return {
+        'refs': {
+            'nodes': [{
+                'name': name
+            } for name in names],
+            'pageInfo': {
+                'hasNextPage': endCursor is not None,
+                'endCursor': endCursor
+            }
+        }
+    }
+
+
+# responses github sent to the queries of fetch(['org/a', 'org/b',
+# 'org/missing']), by query variables
+RECORDED = [({
+    'owner0': 'org',
+    'name0': 'a',
+    'after0': None,
+    'owner1': 'org',
+    'name1': 'b',
+    'after1': None,
+    'owner2': 'org',
+    'name2': 'missing',
+    'after2': None
+}, {
+    'data': {
+        'rateLimit': {
+            'cost': 1,
+            'remaining': 4999,
+            'resetAt': '2019-06-01T12:00:00Z'
+        },
+        'r0': refs(BRANCHES_A[:100], 'Y3Vyc29yOnYyOpHOAA=='),
+        'r1': refs(['develop', 'master', 'PW-7']),
+        'r2': None
+    },
+    'errors': [{
+        'type': 'NOT_FOUND',
+        'path': ['r2'],
+        'message': "Could not resolve to a Repository with the name 'org/missing'."
+    }]
+}), ({
+    'owner0': 'org',
+    'name0': 'a',
+    'after0': 'Y3Vyc29yOnYyOpHOAA=='
+}, {
+    'data': {
+        'rateLimit': {
+            'cost': 1,
+            'remaining': 4998,
+            'resetAt': '2019-06-01T12:00:00Z'
+        },
+        'r0': refs(BRANCHES_A[100:])
+    }
+})]
+
+
+def replay(request):
+    """
+    answer a query with its recorded response
+    """
+    body = json.loads(request.body)
+    for variables, response in RECORDED:
+        if body['variables'] == variables:
+            assert body['query'] == branchesQuery(
+                [(variables['owner{0}'.format(n)],
+                  variables['name{0}'.format(n)],
+                  variables['after{0}'.format(n)])
+                 for n in range(0, len(variables) // 3)])[0]
+            return (200, {}, json.dumps(response))
+    return (502, {}, json.dumps({'message': 'not recorded'}))
+
+
+class githubGraphqlTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the bulk GraphQL branch fetcher
+    """
+
+    # the lookups of missing repositories warn
+    quietLevel = logging.WARNING
+
+    def test_githubRepository(self):
+        assert githubRepository("'org/app'") == ('org', 'app')
+        assert githubRepository('app') is None
+        assert githubRepository('org/app/extra') is None
+
+    @responses.activate
+    def test_fetchPaginatesWithCursors(self):
+        responses.add_callback(responses.POST, GRAPHQL_URL, callback=replay)
+        fetcher = GraphqlBranches('token')
+        branches = fetcher.fetch(["'org/a'", 'org/b', 'org/missing', 'app'])
+        assert branches == {
+            "'org/a'": [b.lower() for b in BRANCHES_A],
+            'org/b': ['develop', 'master', 'pw-7']
+        }
+        assert len(responses.calls) == 2
+        assert responses.calls[0].request.headers[
+            'Authorization'] == 'bearer token'
+        assert fetcher.stats() == {
+            "GithubGraphqlQueries": 2,
+            "GithubGraphqlCost": 2,
+            "GithubRateLimitRemaining": 4998,
+            "GithubRateLimitResetAt": '2019-06-01T12:00:00Z'
+        }
+
+    @responses.activate
+    def test_prefetchedBranches(self):
+        """
+        getGitRepoBranches serves prefetched repositories without the REST
+        client and falls back to it for the others
+        """
+        responses.add_callback(responses.POST, GRAPHQL_URL, callback=replay)
+        gitClient = Mock()
+        gitClient.get_repo.return_value.get_branches.return_value = []
+        pb = PruneBuilds(
+            gitClient=gitClient, graphqlBranches=GraphqlBranches('token'))
+        pb.prefetchBranches(['org/a', 'org/b', 'org/missing'])
+        assert pb.getGitRepoBranches('org/b') == ['develop', 'master', 'pw-7']
+        assert not gitClient.get_repo.called
+        assert pb.getGitRepoBranches('org/missing') == []
+        gitClient.get_repo.assert_called_once_with('org/missing')
+
+        pb.prefetchBranches(['org/unrecorded'])
+        assert 'org/unrecorded' not in pb.prefetchedBranches
+
+    @responses.activate
+    def test_prefetchTtl(self):
+        """
+        the branches of a prefetch serve every run within prefetchTtl, and
+        runs of single repositories only fetch the ones that went stale
+        """
+        responses.add_callback(responses.POST, GRAPHQL_URL, callback=replay)
+        gitClient = Mock()
+        gitClient.get_repo.return_value.get_branches.return_value = []
+        pb = PruneBuilds(
+            gitClient=gitClient,
+            graphqlBranches=GraphqlBranches('token'),
+            prefetchTtl=60)
+        pb.prefetchBranches(['org/a', 'org/b', 'org/missing'], refresh=True)
+        assert len(responses.calls) == 2
+        pb.prefetchBranches(['org/b'])
+        assert len(responses.calls) == 2
+        assert pb.getGitRepoBranches('org/b') == ['develop', 'master', 'pw-7']
+        assert pb.getGitRepoBranches('org/b') == ['develop', 'master', 'pw-7']
+        assert not gitClient.get_repo.called
+
+        fetched, branches = pb.prefetchedBranches['org/b']
+        pb.prefetchedBranches['org/b'] = (fetched - 60, branches)
+        assert pb.prefetched('org/b') is None
+        assert pb.getGitRepoBranches('org/b') == []
+        gitClient.get_repo.assert_called_once_with('org/b')
+
+    @responses.activate
+    def test_malformedPrefetch(self):
+        """
+        a GraphQL response not shaped like the query leaves every repository
+        to the REST lookup instead of failing the run
+        """
+        responses.add(
+            responses.POST,
+            GRAPHQL_URL,
+            json={
+                'data': {
+                    'r0': {
+                        'refs': {
+                            'nodes': [{
+                                'name': 'develop'
+                            }]
+                        }
+                    },
+                    'r1': {
+                        'refs': {
+                            'nodes': None
+                        }
+                    }
+                }
+            })
+        gitClient = Mock()
+        gitClient.get_repo.return_value.get_branches.return_value = []
+        pb = PruneBuilds(
+            gitClient=gitClient, graphqlBranches=GraphqlBranches('token'))
+        logging.disable(logging.CRITICAL)
+        try:
+            pb.prefetchBranches(['org/a', 'org/b'])
+        finally:
+            logging.disable(logging.NOTSET)
+        assert pb.prefetchedBranches == {}
+        assert pb.getGitRepoBranches('org/a') == []
+        gitClient.get_repo.assert_called_once_with('org/a')
+
+    def test_queryTimeout(self):
+        session = Mock()
+        session.post.return_value.json.return_value = {'data': {}}
+        GraphqlBranches('token', session=session, timeout=5).query(
+            [('org', 'a', None)])
+        assert session.post.call_args[1]['timeout'] == 5
+
+
+if __name__ == "__main__":
+    unittest.main()
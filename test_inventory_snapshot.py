@@ -0,0 +1,172 @@
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import retention
+from inventory_snapshot import InventorySnapshot
+from pruneBuilds import parseInventory
+from synthetic_registry import generateInventory, localPruneBuilds
+from testcase import PruneBuildsTestCase
+
+
+class inventorySnapshotTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for incremental inventory snapshots
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.snapshots = InventorySnapshot(
+            os.path.join(self.directory, 'state', 'inventory.db'))
+
+    def tearDown(self):
+        self.snapshots.connection.close()
+        shutil.rmtree(self.directory)
+        PruneBuildsTestCase.tearDown(self)
+
+    def generateImages(self, start, count):
+        rand = random.Random(start)
+        images = []
+        for i in range(start, start + count):
+            tag = rand.choice([
+                "develop-{0}", "master-{0}", "pw-{1}-{0}", "c-cw-{1}-{0}",
+                "19.{1}.{0}", "19.{1}.{0}-rc-1"
+            ]).format(i, rand.randint(1, 12))
+            images.append({'imageTag': tag, 'imageDigest': 'sha256:' + str(i)})
+        images.append({'imageDigest': 'sha256:untagged' + str(start)})
+        return images
+
+    def test_diffAndSave(self):
+        images = self.generateImages(0, 20)
+        assert self.snapshots.needsFullScan('repository')
+        added, removed = self.snapshots.diff('repository', images)
+        assert len(added) == 21 and removed == []
+
+        self.snapshots.save('repository', images, fullScan=True)
+        assert not self.snapshots.needsFullScan('repository')
+        assert self.snapshots.diff('repository', images) == ([], [])
+
+        changed = images[5:] + [{'imageTag': 'develop-99', 'imageDigest': 'x'}]
+        added, removed = self.snapshots.diff('repository', changed)
+        assert added == [{'imageTag': 'develop-99', 'imageDigest': 'x'}]
+        assert sorted(i['imageDigest'] for i in removed) == sorted(
+            i['imageDigest'] for i in images[0:5])
+        assert self.snapshots.load('other-repository') == set()
+
+    def test_fullScanCadence(self):
+        self.snapshots.save('repository', [], fullScan=True)
+        now = time.time()
+        assert not self.snapshots.needsFullScan('repository', now)
+        assert self.snapshots.needsFullScan(
+            'repository', now + self.snapshots.fullScanInterval)
+        self.snapshots.save('other-repository', [])
+        assert self.snapshots.needsFullScan('other-repository')
+        self.snapshots.fullScan = True
+        assert self.snapshots.needsFullScan('repository', now)
+
+    def test_incrementalMatchesFullScan(self):
+        """
+        once the previous run's condemned images are gone, evaluating only
+        the changed groups condemns the same tags as a full evaluation
+        """
+        today = datetime.datetime(2019, 5, 10)
+        images = self.generateImages(0, 500)
+        condemned = set(
+            retention.selectOldBuilds(parseInventory(images), today=today))
+        remaining = [i for i in images if i.get('imageTag') not in condemned]
+        self.snapshots.save('repository', remaining, fullScan=True)
+
+        images = remaining[50:] + self.generateImages(1000, 40)
+        parsed = parseInventory(images)
+        added, removed = self.snapshots.diff('repository', images)
+        groups = retention.affectedGroups(parsed, parseInventory(added),
+                                          parseInventory(removed))
+        assert sorted(
+            retention.selectOldBuilds(parsed, today=today,
+                                      groups=groups)) == sorted(
+                                          retention.selectOldBuilds(
+                                              parsed, today=today))
+
+    def test_retentionChangeForcesFullScan(self):
+        keep = dict(retention.DEFAULT_RETENTION)
+        tighter = dict(keep, develop=2)
+        self.snapshots.save('repository', [], fullScan=True, keep=keep)
+        assert not self.snapshots.needsFullScan('repository', keep=keep)
+        assert self.snapshots.needsFullScan('repository', keep=tighter)
+        # incremental runs don't replace the retention of the full scan
+        self.snapshots.save('repository', [], keep=tighter)
+        assert self.snapshots.needsFullScan('repository', keep=tighter)
+        self.snapshots.save('repository', [], fullScan=True, keep=tighter)
+        assert not self.snapshots.needsFullScan('repository', keep=tighter)
+
+        inventory, openBranches = generateInventory(300, 10, seed=3)
+        pb = localPruneBuilds({'repository': inventory},
+                              {'repository': openBranches},
+                              snapshots=self.snapshots,
+                              keep=tighter)
+        parsed = parseInventory(inventory)
+        assert pb.changedGroups('repository', inventory, parsed) is not None
+        pb.keep = dict(tighter, master=3)
+        assert pb.changedGroups('repository', inventory, parsed) is None
+
+    def test_snapshotWithoutRetention(self):
+        """
+        snapshots written before the retention was recorded are fully
+        rescanned once
+        """
+        path = os.path.join(self.directory, 'old.db')
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE scans (repository TEXT PRIMARY KEY, "
+                "lastScan REAL, lastFullScan REAL)")
+            connection.execute("INSERT INTO scans VALUES (?, ?, ?)",
+                               ('repository', time.time(), time.time()))
+        connection.close()
+        snapshots = InventorySnapshot(path)
+        try:
+            assert not snapshots.needsFullScan('repository')
+            assert snapshots.needsFullScan(
+                'repository', keep=retention.DEFAULT_RETENTION)
+        finally:
+            snapshots.connection.close()
+
+    def test_streamingSavesSameSnapshot(self):
+        """
+        streamed and fully listed runs leave the same snapshot, untagged
+        images included
+        """
+        inventory, openBranches = generateInventory(1500, 20, seed=4)
+        assert any('imageTag' not in i for i in inventory)
+        listed = []
+        loaded = []
+        for streaming in (False, True):
+            snapshots = InventorySnapshot(
+                os.path.join(self.directory, '{0}.db'.format(streaming)))
+            pb = localPruneBuilds({'repository': list(inventory)},
+                                  {'repository': openBranches},
+                                  snapshots=snapshots,
+                                  streaming=streaming)
+            with mock.patch.object(
+                    pb, 'remainingImages',
+                    wraps=pb.remainingImages) as remainingImages:
+                with self.environ(1):
+                    pb.clean_images(['repository'])
+            listed.append(
+                snapshots.imageKeys(remainingImages.call_args[0][0]))
+            loaded.append(snapshots.load('repository'))
+            snapshots.connection.close()
+        assert listed[0] == listed[1] == snapshots.imageKeys(inventory)
+        assert loaded[0] == loaded[1]
+        assert loaded[0]
+
+
+if __name__ == "__main__":
+    unittest.main()
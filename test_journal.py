@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from coordination import Coordinator, LeaseStore
+from journal import DeletionJournal, readPlanFile, writePlanFile
+from synthetic_registry import generateInventory, localPruneBuilds
+from testcase import PruneBuildsTestCase
+
+REPOSITORY = 'org/journaled'
+
+
+def journalPruneBuilds(inventory, openBranches, **kwargs):
+    return localPruneBuilds({REPOSITORY: inventory},
+                            {REPOSITORY: openBranches}, **kwargs)
+
+
+class deletionJournalTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the deletion journal and plan files
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.journal = DeletionJournal(
+            os.path.join(self.directory, 'state', 'journal.db'))
+
+    def tearDown(self):
+        PruneBuildsTestCase.tearDown(self)
+        self.journal.connection.close()
+        shutil.rmtree(self.directory)
+
+    def cleanImages(self, pb, delete):
+        return PruneBuildsTestCase.cleanImages(self, pb, delete,
+                                               [REPOSITORY])[0]
+
+    def test_checkpoints(self):
+        imageIds = [{'imageDigest': str(i)} for i in range(0, 250)]
+        batches = self.journal.record('repository', imageIds, now=1000)
+        assert [len(b) for n, b in batches] == [100, 100, 50]
+        self.journal.complete('repository', 0)
+        assert [n for n, b in self.journal.pending('repository')] == [1, 2]
+        assert self.journal.interrupted(now=1000) == ['repository']
+        self.journal.finish('repository')
+        assert self.journal.pending('repository') == []
+
+        self.journal.record('repository', imageIds, now=1000)
+        assert self.journal.interrupted(
+            now=1000 + self.journal.maxAge + 1) == []
+
+    def test_resumeInterruptedRun(self):
+        """
+        a run killed after its first batch leaves the rest to the next run,
+        which ends up with the same registry as an uninterrupted run
+        """
+        inventory, openBranches = generateInventory(2000, 20, seed=4)
+        reference = journalPruneBuilds(inventory, openBranches)
+        self.cleanImages(reference, '1')
+
+        pb = journalPruneBuilds(inventory, openBranches, journal=self.journal)
+        batchDeleteImages = pb.batchDeleteImages
+        sent = []
+
+        def interrupt(repository, imageIds):
+            if sent:
+                raise KeyboardInterrupt()
+            sent.append(imageIds)
+            return batchDeleteImages(repository, imageIds)
+
+        with mock.patch.object(pb, 'batchDeleteImages', side_effect=interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.cleanImages(pb, '1')
+        assert len(self.journal.pending(REPOSITORY)) > 0
+
+        pb.resumeInterrupted()
+        assert self.journal.interrupted() == []
+        assert pb.client.images(REPOSITORY) == reference.client.images(
+            REPOSITORY)
+
+    def test_resumeWithTheRepositoryJob(self):
+        """
+        the scheduler's job for a repository resumes its interrupted plan,
+        the jobs of other repositories leave it alone
+        """
+        inventory, openBranches = generateInventory(2000, 20, seed=4)
+        pb = journalPruneBuilds(inventory, openBranches, journal=self.journal)
+        self.journal.record(REPOSITORY, [{'imageTag': 'missing'}])
+        with self.environ(1):
+            pb.clean_images(['org/other'])
+            assert self.journal.interrupted() == [REPOSITORY]
+            pb.clean_images([REPOSITORY])
+        assert self.journal.interrupted() == []
+
+    def test_streamedOrphansJournaled(self):
+        """
+        with streaming, untagged images are journaled with the rest of the
+        plan before any of them is deleted
+        """
+        inventory, openBranches = generateInventory(2000, 20, seed=8)
+        orphans = [i['imageDigest'] for i in inventory if 'imageTag' not in i]
+        assert orphans
+        pb = journalPruneBuilds(
+            inventory, openBranches, journal=self.journal, streaming=True)
+        recorded = []
+
+        def record(repository, imageIds):
+            recorded.append(pb.client.calls.get('BatchDeleteImage', 0))
+            return DeletionJournal.record(self.journal, repository, imageIds)
+
+        with mock.patch.object(self.journal, 'record', side_effect=record):
+            self.cleanImages(pb, '1')
+        assert recorded == [0]
+        planned = set(
+            i.get('imageDigest') for i in pb.plans[REPOSITORY]['imageIds'])
+        assert set(orphans) <= planned
+        assert not any('imageTag' not in i
+                       for i in pb.client.images(REPOSITORY))
+
+    def test_applyPlanFile(self):
+        """
+        a dry run writes its plan, applying it deletes exactly what the
+        equivalent DELETE_IMAGES=1 run would
+        """
+        inventory, openBranches = generateInventory(1500, 20, seed=5)
+        reference = journalPruneBuilds(inventory, openBranches)
+        self.cleanImages(reference, '1')
+
+        path = os.path.join(self.directory, 'plan.json')
+        pb = journalPruneBuilds(inventory, openBranches, planFile=path)
+        result = self.cleanImages(pb, '0')
+        assert pb.client.images(REPOSITORY) == inventory
+        plans = readPlanFile(path)
+        assert list(plans) == [REPOSITORY]
+        assert len(plans[REPOSITORY]) <= result['condemned'] + result[
+            'orphans']
+
+        results = pb.applyPlanFile(path)
+        assert results[0]['planned'] == len(plans[REPOSITORY])
+        assert pb.client.images(REPOSITORY) == reference.client.images(
+            REPOSITORY)
+
+    def test_stalePlanFile(self):
+        """
+        plan files older than the journal's maxAge aren't applied
+        """
+        inventory, openBranches = generateInventory(500, 10, seed=6)
+        pb = journalPruneBuilds(inventory, openBranches, journal=self.journal)
+        path = os.path.join(self.directory, 'plan.json')
+        writePlanFile(path, {
+            REPOSITORY: {
+                'condemned': [],
+                'orphans': [],
+                'imageIds': [{'imageDigest': inventory[0]['imageDigest']}]
+            }
+        }, now=time.time() - self.journal.maxAge - 60)
+        with self.assertRaises(ValueError):
+            pb.applyPlanFile(path)
+        assert pb.client.images(REPOSITORY) == inventory
+        assert readPlanFile(path)[REPOSITORY] == [{
+            'imageDigest': inventory[0]['imageDigest']
+        }]
+
+    def test_coordinatedPlanFile(self):
+        """
+        with coordination, a plan is only applied to the repositories the
+        replica can lease
+        """
+        inventory, openBranches = generateInventory(500, 10, seed=7)
+        store = LeaseStore(os.path.join(self.directory, 'leases.db'))
+        pb = journalPruneBuilds(
+            inventory, openBranches, coordinator=Coordinator(store, 'a'))
+        path = os.path.join(self.directory, 'plan.json')
+        writePlanFile(path, {
+            REPOSITORY: {
+                'condemned': [],
+                'orphans': [],
+                'imageIds': [{'imageDigest': inventory[0]['imageDigest']}]
+            }
+        })
+        with Coordinator(store, 'b').lease(REPOSITORY):
+            assert pb.applyPlanFile(path)[0]['skipped']
+        assert pb.client.images(REPOSITORY) == inventory
+        assert pb.applyPlanFile(path)[0]['deleted'] == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
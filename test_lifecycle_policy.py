@@ -0,0 +1,165 @@
+import datetime
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+import lifecycle_policy
+from pruneBuilds import PruneBuilds, parseInventory
+from synthetic_registry import FakeEcrClient, FakeGithub
+from testcase import PruneBuildsTestCase
+
+REPOSITORY = 'org/lifecycle'
+
+
+def generateImages(count=30):
+    images = []
+    for i in range(0, count):
+        tag = ['develop-{0}', 'master-{0}', 'pw-{1}-{0}'][i % 3].format(i, i % 4)
+        images.append({'imageTag': tag, 'imageDigest': 'sha256:{0}'.format(i)})
+    return images
+
+
+class lifecyclePolicyTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the lifecycle policy compiler and simulator
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.policy, self.groups = lifecycle_policy.compilePolicy({
+            'develop': 4,
+            'master': 2
+        })
+
+    def details(self, images):
+        client = FakeEcrClient({REPOSITORY: images})
+        return client.describe_images(
+            repositoryName=REPOSITORY, maxResults=1000)['imageDetails']
+
+    def test_compilePolicy(self):
+        assert self.groups == {('develop', ), ('master', )}
+        assert [(r['rulePriority'], r['selection']['tagPrefixList'],
+                 r['selection']['countNumber'])
+                for r in self.policy['rules']] == [(1, ['develop-'], 4),
+                                                   (2, ['master-'], 2)]
+        policy, groups = lifecycle_policy.compilePolicy({'master': 0})
+        assert groups == {('develop', )}
+        assert len(policy['rules']) == 1
+
+    def test_simulatePolicy(self):
+        now = datetime.datetime(2019, 1, 11, tzinfo=datetime.timezone.utc)
+        images = self.details([{'imageTag': 'a-1', 'imageDigest': 'a'},
+                               {'imageTag': 'b-1', 'imageDigest': 'b'},
+                               {'imageDigest': 'c'}])
+        policy = {
+            'rules': [{
+                'rulePriority': 1,
+                'selection': {
+                    'tagStatus': 'tagged',
+                    'tagPatternList': ['a*'],
+                    'countType': 'imageCountMoreThan',
+                    'countNumber': 1
+                },
+                'action': {'type': 'expire'}
+            }, {
+                'rulePriority': 2,
+                'selection': {
+                    'tagStatus': 'any',
+                    'countType': 'sinceImagePushed',
+                    'countUnit': 'days',
+                    'countNumber': 5
+                },
+                'action': {'type': 'expire'}
+            }]
+        }
+        # a is kept by the first rule, so the second one never expires it
+        assert [i['imageDigest'] for i in lifecycle_policy.simulatePolicy(
+            policy, images, now)] == ['b', 'c']
+
+    def test_checkEquivalence(self):
+        images = generateImages()
+        result = lifecycle_policy.checkEquivalence(
+            self.policy, self.groups, self.details(images), {
+                'develop': 4,
+                'master': 2
+            })
+        assert result['equivalent']
+
+        # c-develop builds are develop builds the develop- prefix misses, the
+        # policy keeps develop- builds deleteOldBuilds condemns
+        images.append({'imageTag': 'c-develop-100', 'imageDigest': 'c100'})
+        images.append({'imageTag': 'c-develop-101', 'imageDigest': 'c101'})
+        images.append({'imageTag': 'c-develop-102', 'imageDigest': 'c102'})
+        images.append({'imageTag': 'c-develop-103', 'imageDigest': 'c103'})
+        result = lifecycle_policy.checkEquivalence(
+            self.policy, self.groups, self.details(images), {
+                'develop': 4,
+                'master': 2
+            })
+        assert not result['equivalent']
+        assert result['onlyPolicy'] == []
+        assert result['onlyDeleteOldBuilds'] == [
+            'develop-18', 'develop-21', 'develop-24', 'develop-27'
+        ]
+
+        # pushed in an other order than their build numbers
+        images = list(reversed(generateImages()))
+        assert not lifecycle_policy.checkEquivalence(
+            self.policy, self.groups, self.details(images), {
+                'develop': 4,
+                'master': 2
+            })['equivalent']
+
+    def test_serverSideGroups(self):
+        """
+        with the compiled policy installed, develop and master are left to
+        ECR and only the feature builds are condemned here
+        """
+        images = generateImages()
+        keep = {'develop': 4, 'master': 2}
+        client = FakeEcrClient({REPOSITORY: images})
+        pb = PruneBuilds(
+            keep=keep,
+            client=client,
+            gitClient=FakeGithub({REPOSITORY: ['develop', 'master', 'pw-0',
+                                               'pw-1', 'pw-2', 'pw-3']}),
+            lifecyclePolicy=True)
+        with self.environ(0, [REPOSITORY]):
+            assert pb.clean_images()[0]['condemned'] == 20
+            client.put_lifecycle_policy(
+                repositoryName=REPOSITORY,
+                lifecyclePolicyText=lifecycle_policy.policyText(
+                    lifecycle_policy.compilePolicy(keep)[0]))
+            pb.clean_images()
+        assert all(t.startswith('pw-') for t in pb.plans[REPOSITORY]['condemned'])
+        assert len(pb.plans[REPOSITORY]['condemned']) == 6
+
+    def test_serverSideGroupsChecked(self):
+        """
+        every group is evaluated here when the images were pushed out of
+        build order or the policy can't be read
+        """
+        keep = {'develop': 4, 'master': 2}
+        client = FakeEcrClient({REPOSITORY: list(reversed(generateImages()))})
+        client.put_lifecycle_policy(
+            repositoryName=REPOSITORY,
+            lifecyclePolicyText=lifecycle_policy.policyText(
+                lifecycle_policy.compilePolicy(keep)[0]))
+        pb = PruneBuilds(keep=keep, client=client, lifecyclePolicy=True)
+        parsed = parseInventory(client.images(REPOSITORY))
+        assert pb.serverSideGroups(REPOSITORY, parsed) == set()
+
+        denied = ClientError({
+            'Error': {
+                'Code': 'AccessDeniedException',
+                'Message': REPOSITORY
+            }
+        }, 'GetLifecyclePolicy')
+        with mock.patch.object(client, 'get_lifecycle_policy',
+                               side_effect=denied):
+            assert pb.serverSideGroups(REPOSITORY, parsed) == set()
+
+
+if __name__ == "__main__":
+    unittest.main()
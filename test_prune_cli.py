@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import prune_cli
+from pruneBuilds import PruneBuilds
+from synthetic_registry import FakeEcrClient, FakeGithub
+from testcase import PruneBuildsTestCase
+
+REPOSITORY = 'org/cli'
+
+
+class pruneCliTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the one-shot command line
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.inventory = [{
+            'imageTag': 'develop-{0}'.format(i),
+            'imageDigest': 'sha256:d{0}'.format(i)
+        } for i in range(0, 12)] + [{
+            'imageTag': 'pw-1-0',
+            'imageDigest': 'sha256:p0'
+        }, {
+            'imageDigest': 'sha256:orphan'
+        }]
+        self.inventoryPath = self.write('images.json',
+                                        {'imageIds': self.inventory})
+        self.branchesPath = self.write('branches.json', ['develop'])
+
+    def tearDown(self):
+        PruneBuildsTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump(content, f)
+        return path
+
+    def test_planFromFilesSkipsClients(self):
+        """
+        planning from files neither imports boto3 and PyGithub nor configures
+        clients
+        """
+        output = os.path.join(self.directory, 'plan.json')
+        script = ("import sys, prune_cli\n"
+                  "code = prune_cli.main(sys.argv[1:])\n"
+                  "print(code, 'boto3' in sys.modules, 'github' in sys.modules)")
+        result = subprocess.check_output(
+            [sys.executable, '-c', script, 'plan', '--inventory',
+             self.inventoryPath, '--branches', self.branchesPath,
+             '--repository', REPOSITORY, '--output', output],
+            cwd=os.path.dirname(os.path.abspath(prune_cli.__file__)))
+        assert result.decode().split() == ['0', 'False', 'False']
+        with open(output) as f:
+            plan = json.load(f)['repositories'][REPOSITORY]
+        assert plan['condemned'] == ['develop-0', 'develop-1', 'pw-1-0']
+        assert plan['orphans'] == ['sha256:orphan']
+        assert plan['imageIds'] == [{
+            'imageDigest': 'sha256:d0'
+        }, {
+            'imageDigest': 'sha256:d1'
+        }, {
+            'imageDigest': 'sha256:p0'
+        }, {
+            'imageDigest': 'sha256:orphan'
+        }]
+
+    def test_planAndApply(self):
+        pb = PruneBuilds(
+            client=FakeEcrClient({REPOSITORY: self.inventory}),
+            gitClient=FakeGithub({REPOSITORY: ['develop', 'pw-1']}))
+        output = os.path.join(self.directory, 'plan.json')
+        parser = prune_cli.parser()
+        assert prune_cli.plan(
+            pb,
+            parser.parse_args(
+                ['plan', '--repository', REPOSITORY, '--output',
+                 output])) == 0
+        assert prune_cli.apply(pb, parser.parse_args(['apply', output])) == 0
+        assert [i.get('imageTag') for i in pb.client.images(REPOSITORY)] == [
+            'develop-{0}'.format(i) for i in range(2, 12)
+        ] + ['pw-1-0']
+
+    def test_missingSource(self):
+        with self.assertRaises(ValueError):
+            prune_cli.listing(None, argparse.Namespace(
+                inventory=None, repository=None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from coordination import Coordinator, LeaseStore
+from pruneBuilds import PruneBuilds
+from push_events import FileQueue, PushConsumer, parseEvent
+from synthetic_registry import FakeEcrClient, FakeGithub
+from testcase import PruneBuildsTestCase
+
+REPOSITORY = 'org/pushed'
+
+
+def pushEvent(tag, repository=REPOSITORY, result='SUCCESS'):
+    return json.dumps({
+        'detail-type': 'ECR Image Action',
+        'source': 'aws.ecr',
+        'detail': {
+            'action-type': 'PUSH',
+            'result': result,
+            'repository-name': repository,
+            'image-digest': 'sha256:' + tag,
+            'image-tag': tag
+        }
+    })
+
+
+class pushEventsTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the push event consumer
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'events')
+        self.now = [0.0]
+
+    def tearDown(self):
+        PruneBuildsTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def push(self, *events):
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(event + '\n')
+
+    def test_parseEvent(self):
+        assert parseEvent(pushEvent('develop-1')) == (REPOSITORY, 'develop-1',
+                                                      'sha256:develop-1')
+        assert parseEvent(json.dumps({
+            'Message': pushEvent('develop-1')
+        }))[1] == 'develop-1'
+        assert parseEvent(pushEvent('develop-1', result='FAILURE')) is None
+        assert parseEvent('not json') is None
+        assert parseEvent(json.dumps({'detail': 'x'})) is None
+
+    def test_fileQueue(self):
+        self.push(pushEvent('develop-1'), pushEvent('develop-2'))
+        with open(self.path, 'a') as f:
+            f.write(pushEvent('develop-3'))
+        queue = FileQueue(self.path, sleep=lambda s: None)
+        messages = queue.receive(10)
+        assert [parseEvent(b)[1] for h, b in messages] == [
+            'develop-1', 'develop-2'
+        ]
+        queue.delete([messages[0][0]])
+        with open(self.path, 'a') as f:
+            f.write('\n')
+        assert [parseEvent(b)[1] for h, b in queue.receive(10)
+                ] == ['develop-3']
+        # a restarted consumer picks up after the last acknowledged message
+        restarted = FileQueue(self.path)
+        assert [parseEvent(b)[1] for h, b in restarted.receive(10)] == [
+            'develop-2', 'develop-3'
+        ]
+
+    def test_fileQueueAcknowledgesInOrder(self):
+        """
+        acknowledging a message doesn't acknowledge the ones before it
+        """
+        self.push(pushEvent('develop-1'), pushEvent('develop-2'),
+                  pushEvent('develop-3'))
+        queue = FileQueue(self.path)
+        messages = queue.receive(10)
+        queue.delete([messages[2][0]])
+        assert queue.committed == 0
+        queue.delete([messages[0][0]])
+        assert queue.committed == messages[0][0]
+        assert [parseEvent(b)[1] for h, b in FileQueue(self.path).receive(10)
+                ] == ['develop-2', 'develop-3']
+        queue.delete([messages[1][0]])
+        assert FileQueue(self.path).receive(10) == []
+
+    def test_failedPruneStaysUnacknowledged(self):
+        """
+        a repository that can't be listed keeps its pushes in the queue,
+        even once a later push to another repository is pruned
+        """
+        pb = PruneBuilds(
+            client=FakeEcrClient({
+                'org/listed': [{
+                    'imageTag': 'develop-1',
+                    'imageDigest': 'sha256:d1'
+                }]
+            }),
+            gitClient=FakeGithub({}))
+        queue = FileQueue(self.path, sleep=lambda s: None)
+        consumer = PushConsumer(pb, queue, 1, clock=lambda: self.now[0])
+        self.push(
+            pushEvent('develop-1', repository='org/missing'),
+            pushEvent('develop-1', repository='org/listed'))
+        consumer.poll()
+        self.now[0] = 10
+        results = consumer.poll()
+        assert [r['repository'] for r in results] == ['org/listed']
+        assert queue.committed == 0
+        assert [parseEvent(b)[0] for h, b in FileQueue(self.path).receive(10)
+                ] == ['org/missing', 'org/listed']
+
+    def test_coordinatedPrune(self):
+        """
+        pushes to a repository another replica holds the lease of are left
+        in the queue
+        """
+        store = LeaseStore(os.path.join(self.directory, 'leases.db'))
+        a = Coordinator(store, 'a')
+        a.heartbeat()
+        pb = PruneBuilds(
+            client=FakeEcrClient({REPOSITORY: []}), gitClient=FakeGithub({}))
+        queue = FileQueue(self.path, sleep=lambda s: None)
+        consumer = PushConsumer(
+            pb, queue, 1, clock=lambda: self.now[0], coordinator=a)
+        self.push(pushEvent('develop-1'))
+        with Coordinator(store, 'b').lease(REPOSITORY):
+            consumer.poll()
+            self.now[0] = 10
+            assert consumer.poll() == []
+        assert queue.committed == 0
+
+        self.push(pushEvent('develop-2'))
+        self.now[0] = 20
+        consumer.poll()
+        self.now[0] = 30
+        assert [r['repository'] for r in consumer.poll()] == [REPOSITORY]
+
+    def test_noBoto3Import(self):
+        script = ("import sys, push_events\n"
+                  "print('boto3' in sys.modules)")
+        result = subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert result.decode().split() == ['False']
+
+    def test_coalescedPrune(self):
+        """
+        a burst of pushes prunes the repository once, and only the pushed
+        branch group
+        """
+        inventory = [{
+            'imageTag': 'develop-{0}'.format(i),
+            'imageDigest': 'sha256:d{0}'.format(i)
+        } for i in range(0, 14)] + [{
+            'imageTag': 'pw-1-{0}'.format(i),
+            'imageDigest': 'sha256:p{0}'.format(i)
+        } for i in range(0, 3)]
+        pb = PruneBuilds(
+            client=FakeEcrClient({REPOSITORY: inventory}),
+            gitClient=FakeGithub({}))
+        consumer = PushConsumer(
+            pb,
+            FileQueue(self.path, sleep=lambda s: None),
+            1,
+            repositories=[REPOSITORY],
+            clock=lambda: self.now[0])
+
+        self.push(
+            pushEvent('develop-12'), pushEvent('develop-13'),
+            pushEvent('develop-1', repository='org/other'))
+        assert consumer.poll() == []
+        assert sorted(consumer.pending[REPOSITORY]['tags']) == [
+            'develop-12', 'develop-13'
+        ]
+        self.now[0] = 10
+        results = consumer.poll()
+        assert len(results) == 1
+        assert results[0]['condemned'] == 4 and results[0]['deleted'] == 4
+        assert pb.client.calls['ListImages'] == 1
+        tags = [i['imageTag'] for i in pb.client.images(REPOSITORY)]
+        assert tags == ['develop-{0}'.format(i) for i in range(4, 14)
+                        ] + ['pw-1-0', 'pw-1-1', 'pw-1-2']
+        assert consumer.pending == {}
+
+
+if __name__ == "__main__":
+    unittest.main()
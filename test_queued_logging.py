@@ -0,0 +1,61 @@
+import logging
+import threading
+import unittest
+
+from queued_logging import DictQueueHandler, queuedHandler
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record, threading.current_thread()))
+
+
+class queuedLoggingTestCase(unittest.TestCase):
+    """
+    Class with test cases for logging through a queue
+    """
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_queued_logging')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def test_dictMessagesAreKept(self):
+        handler = DictQueueHandler(None)
+        message = {"Plan": "deleteOldBuilds", "count": 2}
+        record = handler.prepare(
+            self.logger.makeRecord('test', logging.INFO, __file__, 1, message,
+                                   None, None))
+        message['count'] = 3
+        assert record.msg == {"Plan": "deleteOldBuilds", "count": 2}
+        record = handler.prepare(
+            self.logger.makeRecord('test', logging.INFO, __file__, 1,
+                                   "%s of %d", ('one', 2), None))
+        assert record.msg == 'one of 2' and record.args is None
+
+    def test_recordsAreHandledOffThread(self):
+        recording = RecordingHandler()
+        handler = queuedHandler(recording)
+        self.logger.addHandler(handler)
+        self.logger.info({"Plan": "getOrphans", "items": ['a', 'b']})
+        self.logger.info("There are {0} images".format(2))
+        handler.close()
+        assert [r.msg for r, thread in recording.records] == [{
+            "Plan": "getOrphans",
+            "items": ['a', 'b']
+        }, "There are 2 images"]
+        assert all(thread is not threading.current_thread()
+                   for r, thread in recording.records)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import quota_planner
+from coordination import Coordinator, LeaseStore
+from pruneBuilds import PruneBuilds, parseInventory
+from synthetic_registry import FakeEcrClient, FakeGithub
+from testcase import PruneBuildsTestCase
+
+
+def builds(branch, count):
+    return [{
+        'imageTag': '{0}-{1}'.format(branch, i),
+        'imageDigest': '{0}:{1}'.format(branch, i)
+    } for i in range(0, count)]
+
+
+class quotaPlannerTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the fleet image budget planner
+    """
+
+    def test_planQuota(self):
+        inventories = {
+            'org/a': (parseInventory(builds('develop', 4) + builds('pw-1', 2)),
+                      ['orphan']),
+            'org/b': (parseInventory(builds('master', 3) + [{
+                'imageTag': 'latest',
+                'imageDigest': 'latest'
+            }]), [])
+        }
+        plan, total = quota_planner.planQuota(inventories, 11)
+        assert total == 11 and plan == []
+
+        plan, total = quota_planner.planQuota(inventories, 5)
+        # orphans, then the builds furthest from the newest of their group
+        # across repositories, feature builds going before develop builds
+        # and develop before master builds as far
+        assert plan == [('org/a', {'imageDigest': 'orphan'}),
+                        ('org/a', {'imageDigest': 'develop:0'}),
+                        ('org/a', {'imageDigest': 'develop:1'}),
+                        ('org/b', {'imageDigest': 'master:0'}),
+                        ('org/a', {'imageDigest': 'pw-1:0'}),
+                        ('org/a', {'imageDigest': 'develop:2'})]
+
+        # the newest build of every group and 'latest' are never planned
+        plan, total = quota_planner.planQuota(inventories, 0)
+        assert len(plan) == 7
+
+    def test_sharedDigest(self):
+        # an image tagged with the newest build of its group is kept
+        inventory = builds('develop', 3) + [{
+            'imageTag': 'pw-2-0',
+            'imageDigest': 'develop:2'
+        }, {
+            'imageTag': 'pw-2-1',
+            'imageDigest': 'pw-2:1'
+        }]
+        plan, total = quota_planner.planQuota(
+            {'org/a': (parseInventory(inventory), [])}, 0)
+        assert total == 4
+        assert [i for r, i in plan] == [{'imageDigest': 'develop:0'},
+                                        {'imageDigest': 'develop:1'}]
+
+    def test_batches(self):
+        plan = [('a', 1), ('b', 2), ('a', 3), ('a', 4), ('b', 5)]
+        assert list(quota_planner.batches(plan, 2)) == [('a', [1, 3]),
+                                                         ('b', [2, 5]),
+                                                         ('a', [4])]
+
+    def test_enforceImageBudget(self):
+        client = FakeEcrClient({
+            'org/a': builds('develop', 8),
+            'org/b': builds('master', 6)
+        })
+        pb = PruneBuilds(client=client, gitClient=FakeGithub({}),
+                         imageBudget=10)
+        summary = pb.enforceImageBudget(['org/a', 'org/b'], 0)
+        assert summary['images'] == 14 and summary['planned'] == 4
+        assert pb.plans['org/a']['imageIds'] == [{
+            'imageDigest': 'develop:0'
+        }, {
+            'imageDigest': 'develop:1'
+        }, {
+            'imageDigest': 'develop:2'
+        }]
+        assert len(client.images('org/a')) == 8
+
+        summary = pb.enforceImageBudget(['org/a', 'org/b'], 1)
+        assert summary['deleted'] == 4
+        assert len(client.images('org/a')) + len(client.images('org/b')) == 10
+
+    def test_budgetSkipsLeasedRepositories(self):
+        """
+        the image budget leaves alone a repository another replica holds
+        the lease of
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = LeaseStore(os.path.join(directory, 'leases.db'))
+        client = FakeEcrClient({
+            'org/a': builds('develop', 8),
+            'org/b': builds('master', 6)
+        })
+        pb = PruneBuilds(
+            client=client,
+            gitClient=FakeGithub({}),
+            imageBudget=10,
+            coordinator=Coordinator(store, 'a'))
+        with Coordinator(store, 'b').lease('org/a') as acquired:
+            assert acquired
+            summary = pb.enforceImageBudget(['org/a', 'org/b'], 1)
+        assert summary['planned'] == 4 and summary['deleted'] == 1
+        assert len(client.images('org/a')) == 8
+        assert len(client.images('org/b')) == 5
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from botocore.exceptions import ClientError
+
+from rate_limiter import AdaptiveRateLimiter, TokenBucket, parseRates
+
+
+def clientError(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'ListImages')
+
+
+class rateLimiterTestCase(unittest.TestCase):
+    """
+    Class with test cases for the ECR rate limiter
+    """
+
+    def setUp(self):
+        self.sleeps = []
+        self.limiter = AdaptiveRateLimiter(
+            rates={'list_images': 2}, maxRetries=3, sleep=self.sleeps.append)
+
+    def test_tokenBucketPacesCalls(self):
+        now = [0.0]
+        bucket = TokenBucket(2, burst=2, clock=lambda: now[0])
+        assert [bucket.reserve() for i in range(0, 4)] == [0, 0, 0.5, 1.0]
+        now[0] = 10
+        assert bucket.reserve() == 0
+
+    def test_retriesThrottlesAndAdaptsRate(self):
+        responses = [
+            clientError('ThrottlingException'),
+            clientError('ThrottlingException'), {
+                'imageIds': []
+            }
+        ]
+
+        def listImages(**kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        assert self.limiter.call(
+            'list_images', listImages, repositoryName='repository') == {
+                'imageIds': []
+            }
+        stats = self.limiter.stats()['list_images']
+        assert stats['calls'] == 3
+        assert stats['throttles'] == 2
+        assert stats['retries'] == 2
+        assert stats['rate'] == 0.6
+        backoffs = [s for s in self.sleeps if s > 0]
+        assert len(backoffs) >= 2 and max(backoffs) <= 30
+
+    def test_givesUpAfterMaxRetries(self):
+
+        def listImages(**kwargs):
+            raise clientError('ThrottlingException')
+
+        with self.assertRaises(ClientError):
+            self.limiter.call('list_images', listImages)
+        assert self.limiter.stats()['list_images']['calls'] == 4
+
+    def test_otherErrorsAreNotRetried(self):
+
+        def listImages(**kwargs):
+            raise clientError('RepositoryNotFoundException')
+
+        with self.assertRaises(ClientError):
+            self.limiter.call('list_images', listImages)
+        assert self.limiter.stats()['list_images']['retries'] == 0
+
+    def test_parseRates(self):
+        assert parseRates('list_images=5')['list_images'] == 5
+        assert parseRates('')['batch_delete_image'] == 10
+        with self.assertRaises(ValueError):
+            parseRates('list_images=fast')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import unittest
+
+from pruneBuilds import parseTag
+from records import ImageId, ParsedTag
+
+
+class recordsTestCase(unittest.TestCase):
+    """
+    Class with test cases for the image and parsed tag records
+    """
+
+    def test_imageIdReadsLikeADict(self):
+        tagged = ImageId.fromApi({'imageTag': 'develop-1', 'imageDigest': 'a'})
+        untagged = ImageId.fromApi({'imageDigest': 'b'})
+        assert tagged['imageTag'] == 'develop-1'
+        assert 'imageTag' in tagged and 'imageTag' not in untagged
+        assert untagged.get('imageTag') is None
+        assert untagged.get('imageTag', '') == ''
+        with self.assertRaises(KeyError):
+            untagged['imageTag']
+        assert untagged.asApi() == {'imageDigest': 'b'}
+        assert tagged == {'imageTag': 'develop-1', 'imageDigest': 'a'}
+        assert tagged == ImageId('develop-1', 'a') and tagged != untagged
+        assert not hasattr(tagged, '__dict__')
+
+    def test_parsedTagReadsLikeADict(self):
+        version = parseTag('12.22.2', 'a')
+        assert version['tag'] == '12.22.2' and version['minor'] == 22
+        assert version['gitKey'] is None and 'gitKey' in version
+        assert 'buildNo' not in version and version.get('buildNo') is None
+        with self.assertRaises(KeyError):
+            version['branch']
+        assert sorted(version.keys()) == [
+            'digest', 'gitKey', 'kind', 'major', 'minor', 'patch', 'tag'
+        ]
+
+    def test_branchesAreShared(self):
+        first = parseTag('pw-' + str(1234) + '-1')
+        second = parseTag('pw-' + str(1234) + '-2')
+        assert first.branch is second.branch
+        assert first.gitKey is second.gitKey
+        assert ParsedTag('x', branch='pw-' + str(1234)).branch is first.branch
+        assert sys.getsizeof(first) < sys.getsizeof({'tag': first.tag})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,13 @@
 import boto3
 import random
+import re
 import string
 from moto import mock_ecr
 import pytest
 import unittest
+import pruneBuilds
 from pruneBuilds import PruneBuilds
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 
 class registryOpsTestCase(unittest.TestCase):
@@ -84,6 +86,35 @@ class registryOpsTestCase(unittest.TestCase):
         assert version_match_result['minor'] == 22
         assert version_match_result['patch'] == 2
 
+    def test_parseTag(self):
+        """
+        every tag is classified once, with the fields of its class and the
+        key used to compare it against github branches
+        """
+        expected = {
+            "c-develop-27": ('develop', '27'),
+            "master-25": ('master', 'master'),
+            "c-cw-822-3": ('feature', '3'),
+            "pw-6532-4": ('feature', 'pw-6532'),
+            "12.1.0-38": ('feature', None),
+            "12.9.8-rc-4": ('rc', None),
+            "c-12.22.2": ('version', None),
+            "myTag-rc-34": (None, None),
+            "latest": (None, None)
+        }
+        for tag, (kind, gitKey) in expected.items():
+            parsed = pruneBuilds.parseTag(tag, 'sha256:abc')
+            assert parsed['tag'] == tag
+            assert parsed['digest'] == 'sha256:abc'
+            assert parsed['kind'] == kind
+            assert parsed['gitKey'] == gitKey
+        assert pruneBuilds.parseTag("12.9.8-rc-4")['buildNo'] == 4
+        assert pruneBuilds.parseTag("c-12.22.2")['minor'] == 22
+        assert self.test_pb.splitBranchBuild("latest") is None
+
+        imageList = [{'imageDigest': 'a'}, {'imageTag': 'develop-1', 'imageDigest': 'b'}]
+        assert [i['tag'] for i in pruneBuilds.parseInventory(imageList)] == ['develop-1']
+
     def test_FilterNoTags(self):
         """
         given a list of objects some with tags, filter out the ones that don't have tags
@@ -331,6 +362,223 @@ class registryOpsTestCase(unittest.TestCase):
         assert '12.1.0-rc' not in gitClosedBranchTagsList
         assert 'c-cr-2' in gitClosedBranchTagsList
 
+    @mock_ecr
+    def test_batchDeleteImages(self):
+        """
+        250 tags should go out in 3 batch_delete_image requests of at most
+        100 ids each, and a missing tag should be reported without a retry
+        """
+        self.client.create_repository(repositoryName='test-repository-batch')
+        for i in range(0, 250):
+            self.client.put_image(
+                repositoryName='test-repository-batch',
+                imageManifest=self.generateFakeDigest(),
+                imageTag="feature-{0}".format(i))
+        imageIds = [{'imageTag': "feature-{0}".format(i)} for i in range(0, 250)]
+        imageIds.append({'imageTag': 'does-not-exist-1'})
+
+        outcomes = self.test_pb.batchDeleteImages('test-repository-batch',
+                                                  imageIds)
+        assert len(outcomes) == 3
+        assert [o['requested'] for o in outcomes] == [100, 100, 51]
+        assert sum(len(o['deleted']) for o in outcomes) == 250
+        assert len(outcomes[2]['failures']) == 1
+        assert outcomes[2]['failures'][0]['failureCode'] == 'ImageNotFound'
+        assert self.test_pb.getAllImages('test-repository-batch') == []
+
+    def test_batchDeleteImagesRetriesOnlyFailures(self):
+        """
+        ids reported back with a retryable failure code are resubmitted on
+        their own, permanent failures are not
+        """
+        imageIds = [{'imageTag': "feature-{0}".format(i)} for i in range(0, 5)]
+        responses = [{
+            'imageIds': imageIds[0:3],
+            'failures': [{
+                'imageId': imageIds[3],
+                'failureCode': 'KmsError'
+            }, {
+                'imageId': imageIds[4],
+                'failureCode': 'ImageNotFound'
+            }]
+        }, {
+            'imageIds': [imageIds[3]],
+            'failures': []
+        }]
+        with patch.object(self.test_pb, 'deleteImageBatch',
+                          side_effect=responses) as batchMock, \
+                patch('pruneBuilds.time.sleep'):
+            outcomes = self.test_pb.batchDeleteImages('repository', imageIds)
+        assert batchMock.call_count == 2
+        batchMock.assert_called_with('repository', [imageIds[3]])
+        assert [o['attempt'] for o in outcomes] == [0, 1]
+        assert outcomes[1]['deleted'] == [imageIds[3]]
+
+    @mock_ecr
+    @patch('pruneBuilds.PruneBuilds.getGitRepoBranches',
+           return_value=['develop', 'master'])
+    def test_cleanImagesConcurrent(self, getGitRepoBranchesMock):
+        """
+        clean three repositories with a pool of workers, every result must
+        belong to the repository it was computed for
+        """
+        repositories = ['test-repository-a', 'test-repository-b', 'test-repository-c']
+        for n, repository in enumerate(repositories):
+            self.client.create_repository(repositoryName=repository)
+            for i in range(0, 12 + n):
+                self.client.put_image(
+                    repositoryName=repository,
+                    imageManifest=self.generateFakeDigest(),
+                    imageTag="develop-{0}".format(i))
+
+        pb = PruneBuilds(workers=3)
+        with patch.dict('os.environ', {
+                'DELETE_IMAGES': '1',
+                'REGISTRIES': ','.join(repositories)
+        }):
+            results = pb.clean_images()
+        assert [r['repository'] for r in results] == repositories
+        for n, result in enumerate(results):
+            assert result['images'] == 12 + n
+            assert result['condemned'] == 2 + n
+            assert result['deleted'] == 2 + n
+            assert len(pb.getAllImages(repositories[n])) == 10
+
+    def test_deleteClosedGitBranchesLargeInventory(self):
+        """
+        the indexed closed branch lookup must return the same tags (including
+        tags listed under two closed branches) as the nested loop it replaced
+        """
+
+        def referenceClosedGitBranches(imageList, gitBranches):
+            branchRegexp = re.compile(
+                r'(?P<branch>((?!.*rc)[-_A-Za-z0-9]*))-(?P<buildNo>[0-9]+$)')
+            onlyTagged = self.test_pb.filterNoTags(imageList)
+            ecr_images_set = set()
+            for tag in [i['imageTag'] for i in onlyTagged]:
+                if branchRegexp.match(tag):
+                    if tag.startswith('c-'):
+                        ecr_images_set.add(tag.rsplit('-', 1)[1])
+                    else:
+                        ecr_images_set.add(tag.rsplit('-', 1)[0])
+            git_closed_branch_tags = []
+            for branch in ecr_images_set.difference(set(gitBranches)):
+                for tag in onlyTagged:
+                    if tag['imageTag'].rsplit('-', 1)[0] == branch or tag['imageTag'].rsplit('-', 1)[1] == branch:
+                        git_closed_branch_tags.append(tag['imageTag'])
+            return git_closed_branch_tags
+
+        rand = random.Random(5)
+        branches = ['pw-{0}'.format(i) for i in range(0, 200)]
+        imageList = []
+        for i in range(0, 10000):
+            tag = rand.choice([
+                "{0}-{1}".format(rand.choice(branches), i),
+                "c-{0}-{1}".format(rand.choice(branches), rand.randint(1, 30)),
+                "develop-{0}".format(i), "master-{0}".format(i),
+                "c-19.{0}.{1}".format(rand.randint(1, 12), i),
+                "19.{0}.{1}-rc-{1}".format(rand.randint(1, 12), i),
+                "feature-rc-{0}".format(i)
+            ])
+            imageList.append({'imageTag': tag, 'imageDigest': str(i)})
+        imageList.append({'imageDigest': 'untagged'})
+        gitBranches = ['develop', 'master'] + branches[0:50]
+
+        result = self.test_pb.deleteClosedGitBranches(
+            'TestRepositoryLarge', imageList, gitBranches)
+        assert len(result['ImageTags']) > 1000
+        assert sorted(result['ImageTags']) == sorted(
+            referenceClosedGitBranches(imageList, gitBranches))
+
+    def test_streamInventory(self):
+        """
+        pages are parsed as they arrive and every 100 orphans are handed over
+        for deletion before the listing is finished
+        """
+        pages = []
+        for p in range(0, 3):
+            page = [{
+                'imageDigest': 'sha256:{0}-{1}'.format(p, i)
+            } for i in range(0, 70)]
+            page.append({
+                'imageDigest': 'sha256:tagged-{0}'.format(p),
+                'imageTag': 'develop-{0}'.format(p)
+            })
+            pages.append({'imageIds': page})
+        events = []
+
+        def listImages(repositoryName, maxResults, nextToken=0):
+            events.append(('page', nextToken))
+            page = dict(pages[nextToken])
+            if nextToken + 1 < len(pages):
+                page['nextToken'] = nextToken + 1
+            return page
+
+        pb = PruneBuilds()
+        pb.client = Mock()
+        pb.client.list_images.side_effect = listImages
+        parsed, orphans, count = pb.streamInventory(
+            'repository', lambda digests: events.append(('orphans', len(digests))))
+        assert count == 213
+        assert [i['tag'] for i in parsed] == ['develop-0', 'develop-1', 'develop-2']
+        assert len(orphans) == 210
+        assert events == [('page', 0), ('page', 1), ('orphans', 100),
+                          ('page', 2), ('orphans', 100), ('orphans', 10)]
+        assert self.test_pb.getOrphans([])['ImageDigests'] == []
+
+    def test_planDeletion(self):
+        """
+        a manifest whose tags are all condemned goes once by digest, one with
+        a surviving tag only loses its condemned tags, orphans join the plan
+        """
+        imageList = [{
+            'imageTag': 'pw-1-1',
+            'imageDigest': 'a'
+        }, {
+            'imageTag': 'build-1',
+            'imageDigest': 'a'
+        }, {
+            'imageTag': 'pw-1-2',
+            'imageDigest': 'b'
+        }, {
+            'imageTag': 'develop-3',
+            'imageDigest': 'b'
+        }, {
+            'imageTag': 'pw-1-4',
+            'imageDigest': 'c'
+        }]
+        plan = pruneBuilds.planDeletion(
+            pruneBuilds.parseInventory(imageList),
+            ['pw-1-1', 'build-1', 'pw-1-2', 'pw-1-4', 'gone-5'], ['d', 'a'])
+        assert plan == [{
+            'imageDigest': 'a'
+        }, {
+            'imageTag': 'pw-1-2'
+        }, {
+            'imageDigest': 'c'
+        }, {
+            'imageTag': 'gone-5'
+        }, {
+            'imageDigest': 'd'
+        }]
+
+    def test_logChunks(self):
+        """
+        test that planned tags are logged in bounded chunks
+        """
+        log = Mock()
+        log.isEnabledFor.return_value = True
+        tags = ['develop-' + str(n) for n in range(0, 25)]
+        pruneBuilds.logChunks(log, 'would delete', 'deleteOldBuilds', tags,
+                              chunkSize=10, maxChunks=2)
+        records = [c[0][0] for c in log.info.call_args_list]
+        assert [r.get('items') for r in records] == [tags[:10], tags[10:20], None]
+        assert records[0]['chunks'] == 3 and records[0]['count'] == 25
+        assert records[2]['omitted'] == 5
+        log.reset_mock()
+        pruneBuilds.logChunks(log, 'delete', 'getOrphans', [], chunkSize=10)
+        assert not log.info.called
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,85 @@
+import datetime
+import random
+import unittest
+
+import retention
+from pruneBuilds import parseInventory
+
+
+class retentionTestCase(unittest.TestCase):
+    """
+    Class with test cases for the retention rules
+    """
+
+    def generateInventory(self, count):
+        images = []
+        for i in range(0, count):
+            branch = random.choice(['develop', 'master', 'c-develop'] +
+                                   ['pw-{0}'.format(b) for b in range(0, 40)])
+            images.append({
+                'imageTag': "{0}-{1}".format(branch, i),
+                'imageDigest': str(i)
+            })
+        random.shuffle(images)
+        return images
+
+    def referenceOldBuilds(self, parsed, keep):
+        """
+        full sort of every branch, the way deleteOldBuilds used to do it
+        """
+        toDelete = []
+        for kind in ['develop', 'master']:
+            builds = [i for i in parsed if i.kind == kind]
+            builds.sort(key=lambda x: x.buildNo, reverse=True)
+            toDelete += [i.tag for i in builds[keep[kind]:]]
+        feature = [i for i in parsed if i.kind == 'feature']
+        feature.sort(key=lambda x: x.buildNo, reverse=True)
+        for branch in set(i.branch for i in feature):
+            builds = [i for i in feature if i.branch == branch]
+            toDelete += [i.tag for i in builds[keep['feature']:]]
+        return toDelete
+
+    def test_selectOldBuildsMatchesFullSort(self):
+        """
+        the bounded heaps must condemn exactly what full sorts would, for
+        the default and for custom per class counts
+        """
+        parsed = parseInventory(self.generateInventory(3000))
+        for keep in [
+                retention.DEFAULT_RETENTION, {
+                    'develop': 3,
+                    'master': 0,
+                    'feature': 2
+                }
+        ]:
+            assert sorted(retention.selectOldBuilds(parsed, keep)) == sorted(
+                self.referenceOldBuilds(parsed, keep))
+
+    def test_selectOldBuildsDuplicateBranchKeys(self):
+        """
+        a feature branch interleaved with others is only processed once
+        """
+        images = [{'imageTag': t} for t in
+                  ['pw-1-1', 'pw-2-1', 'pw-1-2', 'pw-2-2', 'pw-1-3']]
+        toDelete = retention.selectOldBuilds(parseInventory(images))
+        assert sorted(toDelete) == ['pw-1-1', 'pw-1-2', 'pw-2-1']
+
+    def test_isExpiredVersion(self):
+        today = datetime.datetime(2019, 5, 10)
+        assert not retention.isExpiredVersion(19, 5, today)
+        assert not retention.isExpiredVersion(19, 3, today)
+        assert retention.isExpiredVersion(19, 2, today)
+        assert retention.isExpiredVersion(18, 12, today)
+        january = datetime.datetime(2019, 1, 10)
+        assert not retention.isExpiredVersion(18, 11, january)
+        assert retention.isExpiredVersion(18, 10, january)
+
+    def test_parseRetention(self):
+        assert retention.parseRetention('') == retention.DEFAULT_RETENTION
+        assert retention.parseRetention('feature=2,develop=5')['feature'] == 2
+        with self.assertRaises(ValueError):
+            retention.parseRetention('nightly=3')
+
+
+if __name__ == "__main__":
+    unittest.main()
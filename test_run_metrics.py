@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from run_metrics import RunMetrics
+from synthetic_registry import generateInventory, localPruneBuilds
+from testcase import PruneBuildsTestCase
+
+REPOSITORY = 'org/measured'
+
+
+class runMetricsTestCase(PruneBuildsTestCase):
+    """
+    Class with test cases for the per run metrics
+    """
+
+    def setUp(self):
+        PruneBuildsTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        PruneBuildsTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_summaries(self):
+        now = [100.0]
+        metrics = RunMetrics(clock=lambda: now[0])
+        with metrics.phase('a', 'listing'):
+            pass
+        with metrics.phase('a', 'listing'):
+            pass
+        metrics.countCall('a', 'ecr', 'list_images')
+        metrics.countCall('b', 'github', 'get_branches', 3)
+        metrics.add('a', 'pages', 2)
+        metrics.add('b', 'pages', 1)
+        metrics.add('b', 'deleted', 5)
+
+        summary = metrics.repositorySummary('a')
+        assert summary['Summary'] == 'repository'
+        assert list(summary['phases']) == ['listing']
+        assert summary['calls'] == {'ecr.list_images': 1}
+        assert summary['pages'] == 2 and summary['deleted'] == 0
+
+        now[0] = 160.0
+        run = metrics.runSummary()
+        assert run['Summary'] == 'run' and run['seconds'] == 60
+        assert run['repositories'] == 2
+        assert run['pages'] == 3 and run['deleted'] == 5
+        assert run['calls'] == {
+            'ecr.list_images': 1,
+            'github.get_branches': 3
+        }
+
+        path = os.path.join(self.directory, 'registry_ops.prom')
+        metrics.writePrometheus(path)
+        with open(path) as f:
+            text = f.read()
+        assert 'registry_ops_run_seconds 60.0\n' in text
+        assert 'registry_ops_api_calls{repository="b",service="github",operation="get_branches"} 3\n' in text
+        assert 'registry_ops_deleted{repository="b"} 5\n' in text
+        assert os.listdir(self.directory) == ['registry_ops.prom']
+
+    def test_partialRuns(self):
+        """
+        a run of some repositories is timed from their start and only sums
+        their figures
+        """
+        now = [100.0]
+        metrics = RunMetrics(clock=lambda: now[0])
+        metrics.start('a')
+        metrics.add('a', 'deleted', 2)
+        now[0] = 110.0
+        assert metrics.runSummary(['a'])['seconds'] == 10
+
+        now[0] = 500.0
+        metrics.start('b')
+        metrics.add('b', 'deleted', 3)
+        now[0] = 530.0
+        run = metrics.runSummary(['b'])
+        assert run['seconds'] == 30
+        assert run['repositories'] == 1 and run['deleted'] == 3
+
+        text = metrics.prometheus(['b'])
+        assert 'registry_ops_run_seconds 30.0\n' in text
+        assert 'registry_ops_repository_seconds{repository="a"} 10.0\n' in text
+        assert 'registry_ops_repository_last_run_timestamp_seconds{repository="a"} 110.0\n' in text
+        assert 'registry_ops_repository_last_run_timestamp_seconds{repository="b"} 530.0\n' in text
+
+    def test_sharedStatsOfFullRuns(self):
+        """
+        the scheduler's partial runs leave the shared branch cache counters
+        to the full runs
+        """
+        inventory, openBranches = generateInventory(300, 5, seed=3)
+        branchCache = mock.Mock()
+        branchCache.getBranches.return_value = openBranches
+        pb = localPruneBuilds({REPOSITORY: inventory},
+                              {REPOSITORY: openBranches},
+                              branchCache=branchCache)
+        with self.environ(0, [REPOSITORY]):
+            pb.clean_images([REPOSITORY])
+            assert branchCache.save.called
+            assert not branchCache.resetStats.called
+            pb.clean_images()
+            assert branchCache.resetStats.called
+
+    def test_cleanImagesMetrics(self):
+        inventory, openBranches = generateInventory(3000, 30, seed=2)
+        path = os.path.join(self.directory, 'registry_ops.prom')
+        pb = localPruneBuilds({REPOSITORY: inventory},
+                              {REPOSITORY: openBranches},
+                              prometheusTextfile=path)
+        result = self.cleanImages(pb, 1, [REPOSITORY])[0]
+
+        summary = pb.metrics.repositorySummary(REPOSITORY)
+        assert sorted(summary['phases']) == [
+            'deletes', 'github', 'listing', 'planning'
+        ]
+        assert summary['images'] == len(inventory)
+        pages = -(-len(inventory) // 1000)
+        assert summary['pages'] == pages
+        assert summary['calls']['ecr.list_images'] == pages
+        assert summary['calls'][
+            'ecr.batch_delete_image'] == pb.client.calls['BatchDeleteImage']
+        assert summary['calls']['github.get_repo'] == 1
+        assert summary['planned'] == result['condemned'] + result['orphans']
+        assert summary['deleted'] == result['deleted']
+        assert os.path.exists(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from scheduler import Scheduler, parseIntervals
+
+
+class schedulerTestCase(unittest.TestCase):
+    """
+    Class with test cases for the job scheduler
+    """
+
+    def setUp(self):
+        self.now = [1000.0]
+        self.scheduler = Scheduler(workers=2, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def waitIdle(self):
+        # a job releasing the test is still marked running until it returns
+        while any(s['running'] for s in self.scheduler.stats()):
+            time.sleep(0.001)
+
+    def test_parseIntervals(self):
+        assert parseIntervals('org/a=3600, org/b=60') == {
+            'org/a': 3600,
+            'org/b': 60
+        }
+        assert parseIntervals('') == {}
+        with self.assertRaises(ValueError):
+            parseIntervals('org/a=soon')
+        with self.assertRaises(ValueError):
+            parseIntervals('org/a=0')
+
+    def test_intervalsAndStagger(self):
+        runs = []
+        done = threading.Semaphore(0)
+
+        def job(name):
+
+            def run():
+                runs.append((name, self.now[0]))
+                done.release()
+
+            return run
+
+        self.scheduler.addStaggered([('a', job('a')), ('b', job('b'))],
+                                    interval=100,
+                                    intervals={'b': 30},
+                                    stagger=10)
+        assert self.scheduler.runPending() == 10
+        done.acquire()
+        self.waitIdle()
+        self.now[0] = 1010
+        assert self.scheduler.runPending() == 30
+        done.acquire()
+        self.waitIdle()
+        self.now[0] = 1040
+        assert self.scheduler.runPending() == 30
+        done.acquire()
+        assert runs == [('a', 1000), ('b', 1010), ('b', 1040)]
+
+    def test_skipsOverlappingAndCountsMissedRuns(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+
+        self.scheduler.add('slow', slow, interval=60)
+        self.scheduler.runPending()
+        started.wait(5)
+        # the host slept through two whole intervals, the run is still going
+        self.now[0] = 1000 + 3 * 60 + 5
+        assert self.scheduler.runPending() == 55
+        release.set()
+        self.scheduler.executor.shutdown(wait=True)
+        stats = self.scheduler.stats()[0]
+        assert stats['runs'] == 1
+        assert stats['skipped'] == 1
+        assert stats['missed'] == 2
+        assert stats['nextRun'] == 1000 + 4 * 60
+        assert stats['lastDuration'] is not None and not stats['running']
+
+    def test_runWakesUpOnStop(self):
+        self.scheduler.add('later', lambda: None, interval=3600, delay=3600)
+        thread = threading.Thread(target=self.scheduler.run)
+        thread.start()
+        self.scheduler.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import logging
+import os
+import unittest
+from unittest import mock
+
+
+class PruneBuildsTestCase(unittest.TestCase):
+    """
+    Base class of the test cases running PruneBuilds, with logging below
+    quietLevel silenced while they run
+    """
+
+    quietLevel = logging.INFO
+
+    def setUp(self):
+        logging.disable(self.quietLevel)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def environ(self, delete, repositories=None):
+        """
+        DELETE_IMAGES and, when repositories are given, REGISTRIES set for
+        the enclosed block
+        """
+        values = {'DELETE_IMAGES': str(delete)}
+        if repositories is not None:
+            values['REGISTRIES'] = ','.join(repositories)
+        return mock.patch.dict(os.environ, values)
+
+    def cleanImages(self, pb, delete, repositories):
+        with self.environ(delete, repositories):
+            return pb.clean_images()